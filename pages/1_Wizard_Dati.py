@@ -1,12 +1,23 @@
 import os
 import pandas as pd
-import io
-import zipfile
+from contextlib import contextmanager
 import json
-import openpyxl
 import numpy as np
 import streamlit as st
-from sqlalchemy import create_engine, text, inspect
+from src import jobs
+from src.db import get_engine
+from src.export_bundle import percorso_zip
+from src.pipeline import get_config, importa_struttura, importa_appoggio, popola_dati, esporta, svuota_database
+from src.locks import RisorsaOccupata, descrivi_stato, lettura, lock_per, scrittura
+from src.mapping_grid import (ASSEGNA_AGGIUNGI, ASSEGNA_NASCONDI, ASSEGNA_RIMUOVI, ASSEGNA_SOSTITUISCI, MODALITA_ASSEGNAZIONE, NASCONDI,
+                              NON_MAPPARE, STATI, STATO_NON_MAPPATE, assegna_in_blocco, destinazioni_reali, etichette_destinazioni, filtra_sorgenti,
+                              imposta_principale, pagina, stato_mappatura)
+from src.mapping_plan import STRATEGIA_UNPIVOT, compila_piano
+from src.mapping_suggest import carica_storico, indice_destinazioni, invalida_storico, suggerisci_tutte
+from src.mapping_store import esiste_configurazione, leggi_configurazione, salva_configurazione
+from src.mass_edit import OPERATORI, OPERATORI_SENZA_VALORE, applica_modifiche
+from src.schema_catalog import colonne_tabella, elenca_tabelle
+from src.table_preview import leggi_pagina
 
 # --- BLOCCO DI INIZIALIZZAZIONE DELLO STATO ---
 # Questo blocco rende la pagina autosufficiente
@@ -19,61 +30,9 @@ if 'tipo_struttura' not in st.session_state:
 # --- CONFIGURAZIONE E HELPER ---
 BASE_DIR = os.getcwd() 
 DATA_DIR = os.path.join(BASE_DIR, 'data')
-DB_PATH = os.path.join(BASE_DIR, 'db', 'imported_data.sqlite')
 MAPPING_BASE_DIR = os.path.join(BASE_DIR, 'mapping')
 EXPORT_BASE_DIR = os.path.join(BASE_DIR, 'export')
 
-# VERSIONE FINALE DELLA FUNZIONE HELPER - Supporta la logica "ibrida"
-def crea_righe_multiple(df: pd.DataFrame, key_cols_map: dict, context_cols_map: dict, unpivot_map: dict) -> pd.DataFrame:
-    """
-    Crea righe multiple con logica ibrida: la prima riga è completa, le successive sono sparse.
-    - key_cols_map: Colonne chiave da ripetere su OGNI riga. {dest: source}
-    - context_cols_map: Colonne di contesto da mostrare SOLO sulla prima riga. {dest: source}
-    - unpivot_map: Colonne da trasformare. {dest: [source_1, source_2, ...]}
-    """
-    final_rows = []
-    num_groups = max(len(v) for v in unpivot_map.values()) if unpivot_map else 0
-    if num_groups == 0: return pd.DataFrame()
-
-    for _, source_row in df.iterrows():
-        is_first_row_for_this_company = True
-        
-        # Prepara i dati chiave che si ripeteranno sempre
-        key_data = {dest_col: source_row.get(source_col) for dest_col, source_col in key_cols_map.items()}
-        # Prepara i dati di contesto che appariranno solo una volta
-        context_data = {dest_col: source_row.get(source_col) for dest_col, source_col in context_cols_map.items()}
-
-        for i in range(num_groups):
-            new_row_segment = {}
-            is_valid_row = False
-            
-            for dest_col, source_cols_list in unpivot_map.items():
-                try:
-                    value = source_row.get(source_cols_list[i], '')
-                    new_row_segment[dest_col] = value
-                    if str(value).strip():
-                        is_valid_row = True
-                except IndexError:
-                    new_row_segment[dest_col] = ''
-            
-            if is_valid_row:
-                if is_first_row_for_this_company:
-                    # Per la prima riga, unisci tutto: chiavi + contesto + dati trasformati
-                    full_row = {**key_data, **context_data, **new_row_segment}
-                    is_first_row_for_this_company = False
-                else:
-                    # Per le righe successive, unisci solo: chiavi + dati trasformati
-                    full_row = {**key_data, **new_row_segment}
-                
-                final_rows.append(full_row)
-                
-    return pd.DataFrame(final_rows)
-
-try:
-    engine = create_engine(f'sqlite:///{DB_PATH}')
-except Exception as e:
-    st.error(f"Errore critico nel motore del database: {e}"); st.stop()
-
 # Sostituisci questa funzione
 def load_template_callback(config):
     """
@@ -114,7 +73,7 @@ def load_template_callback(config):
 
 def on_mode_change():
     """Pulisce lo stato della sessione che dipende dalla modalità quando questa viene cambiata."""
-    keys_to_clear = [k for k in st.session_state.keys() if '_ms_' in k or 'tabella_in_modifica' in k or 'mass_edits' in k or 'exported_file_paths' in k or k.startswith('live_mapping_state_')]
+    keys_to_clear = [k for k in st.session_state.keys() if '_ms_' in k or 'tabella_in_modifica' in k or 'mass_edits' in k or 'mass_conditions' in k or 'exported_file_paths' in k or k.startswith('live_mapping_state_')]
     for key in keys_to_clear:
         if key in st.session_state: del st.session_state[key]
 
@@ -126,7 +85,6 @@ def delete_file(directory, filename):
     except Exception as e:
         st.error(f"Errore durante l'eliminazione del file {filename}: {e}")
 
-# SOSTITUISCI LA TUA get_current_config CON QUESTA VERSIONE
 def get_current_config():
     """
     Genera la configurazione dinamica. Se un codice studio è selezionato,
@@ -134,91 +92,120 @@ def get_current_config():
     """
     mode = st.session_state.get('tipo_struttura', 'Ditta').lower()
     codice_studio = st.session_state.get('codice_studio_valore_sicuro')
+    return get_config(mode, codice_studio, BASE_DIR)
 
-    # Percorso base per la modalità (es. ./data/ditta/)
-    mode_data_dir = os.path.join(DATA_DIR, mode)
-    mode_mapping_dir = os.path.join(MAPPING_BASE_DIR, mode)
-    mode_export_dir = os.path.join(EXPORT_BASE_DIR, mode)
+def log_streamlit(livello, messaggio):
+    """Logger per le funzioni di src/pipeline.py: inoltra i messaggi alla funzione Streamlit omonima (st.info, st.success, ...)."""
+    getattr(st, livello)(messaggio)
 
-    # I percorsi diventano specifici per il cliente SE un codice studio è stato caricato
-    if codice_studio:
-        appoggio_dir = os.path.join(mode_data_dir, codice_studio, 'appoggio')
-        mapping_dir = os.path.join(mode_mapping_dir, codice_studio)
-        export_dir = os.path.join(mode_export_dir, codice_studio)
-    else:
-        # Se nessun cliente è selezionato, punta alle cartelle base
-        appoggio_dir = os.path.join(mode_data_dir, 'appoggio')
-        mapping_dir = mode_mapping_dir
-        export_dir = mode_export_dir
-
-    config = {
-        "mode": mode,
-        # La struttura è SEMPRE condivisa, come richiesto
-        "struttura_dir": os.path.join(mode_data_dir, 'struttura'),
-        # Gli altri percorsi sono dinamici
-        "appoggio_dir": appoggio_dir,
-        "mapping_dir": mapping_dir,
-        "export_dir": export_dir,
-        "db_struttura_prefix": f"struttura_{mode}_",
-        "db_appoggio_suffix": f"_appoggio_{mode}"
-    }
-    
-    # Crea tutte le cartelle necessarie per evitare errori
-    for key, path in config.items():
-        if key.endswith("_dir"):
-            os.makedirs(path, exist_ok=True)
-            
-    return config
-
-# Funzione helper per il salvataggio della configurazione globale (definita qui, non all'interno di step_5)
-# Questa funzione ora gestirà una struttura di mappatura annidata
 def save_global_mapping_config(config, current_full_mapping_data):
-    """Salva le configurazioni globali di mappatura in file JSON."""
-    mapping_dir = config["mapping_dir"]
-    
-    # current_full_mapping_data['column_mappings'] è ora un dizionario annidato
-    global_mapping_path = os.path.join(mapping_dir, "global_mapping.json")
-    with open(global_mapping_path, 'w', encoding='utf-8') as f:
-        json.dump(current_full_mapping_data['column_mappings'], f, indent=4) # Salva solo il sottodizionario delle mappature
-    
-    date_columns_path = os.path.join(mapping_dir, "date_columns.json")
-    with open(date_columns_path, 'w', encoding='utf-8') as f:
-        json.dump({"date_columns": current_full_mapping_data['date_format_columns']}, f, indent=4)
-
-    studio_mapping_path = os.path.join(mapping_dir, "studio_mapping.json")
-    with open(studio_mapping_path, 'w', encoding='utf-8') as f:
-        json.dump({"codice_studio_column": current_full_mapping_data['studio_code_column']}, f, indent=4)
-    
-    force_1to1_tables_path = os.path.join(mapping_dir, "force_1to1_tables.json")
-    with open(force_1to1_tables_path, 'w', encoding='utf-8') as f:
-        json.dump({"force_1to1_tables": current_full_mapping_data['force_1to1_tables']}, f, indent=4)
-    
-    # st.success("Configurazioni globali salvate automaticamente.") # Non mostrare in ogni rerun
-
-# NUOVA FUNZIONE GLOBALE PER LA CALLBACK ON_CHANGE
-# La callback ora gestisce una lista di valori selezionati
-def update_live_mapping_callback(source_key, mode): # Rimosso current_selected_struttura_table_name dall'args
-    """Aggiorna lo stato della mappatura live quando un multiselect cambia."""
-    live_mapping_state_key = f"live_mapping_state_{mode}" # Revertito a chiave globale per mode
-    widget_key = f"map_global_{source_key}_{mode}"
-    
-    if widget_key in st.session_state:
-        # st.multiselect restituisce una lista, quindi salviamo la lista direttamente
-        st.session_state[live_mapping_state_key][source_key] = st.session_state[widget_key]
-
-# In pages/1_Wizard_Dati.py, nel blocco delle FUNZIONI HELPER
-import unicodedata
-
-def sanitize_column_name(col_name):
+    """Salva la configurazione di mappatura (scrive su disco solo se è cambiata, vedi src/mapping_store.py)."""
+    salvata = salva_configurazione(config["mapping_dir"], current_full_mapping_data)
+    if salvata:
+        # La configurazione fa parte dello storico dei suggerimenti degli altri studi
+        invalida_storico()
+    return salvata
+
+@contextmanager
+def operazione_esclusiva(config, descrizione):
     """
-    Pulisce aggressivamente il nome di una colonna:
-    - Rimuove accenti e caratteri speciali.
-    - Converte in minuscolo.
-    - Sostituisce spazi e punteggiatura con un singolo trattino basso.
+    Blocco in scrittura sul database dello studio (vedi src/locks.py): se un'altra sessione sta
+    importando o popolando, l'operazione resta in coda e lo stato dell'attesa viene mostrato qui.
     """
-    s = ''.join(c for c in unicodedata.normalize('NFD', str(col_name)) if unicodedata.category(c) != 'Mn')
-    s = ''.join(c if c.isalnum() else ' ' for c in s.lower())
-    return '_'.join(s.split())
+    placeholder = st.empty()
+    def in_attesa(stato, posizione):
+        placeholder.info(f"⏳ In attesa: {descrivi_stato(stato, posizione)}")
+    with scrittura(config, descrizione, in_attesa=in_attesa):
+        placeholder.empty()
+        yield
+
+def avvia_job(config, tipo, descrizione, funzione, *args, **kwargs):
+    """Avvia l'operazione in background (vedi src/jobs.py) e ricarica la pagina per mostrarne l'avanzamento."""
+    jobs.avvia(config, tipo, descrizione, funzione, *args, **kwargs)
+    st.rerun()
+
+def job_attivo(job):
+    return job is not None and job["stato"] in jobs.STATI_ATTIVI
+
+def mostra_job(config, job):
+    """Avanzamento del job se è in corso (aggiornato ogni secondo), altrimenti il suo esito con i messaggi di log."""
+    if job is None:
+        return
+    if job_attivo(job):
+        _pannello_job_attivo(config, job["id"])
+        return
+    durata = (job["terminato"] or job["creato"]) - (job["avviato"] or job["creato"])
+    if job["stato"] == jobs.STATO_COMPLETATO:
+        st.success(f"{job['descrizione']} completato in {durata:.1f}s.")
+    elif job["stato"] == jobs.STATO_ERRORE:
+        st.error(f"{job['descrizione']} non riuscito: {job['errore']}")
+    elif job["stato"] == jobs.STATO_ANNULLATO:
+        st.warning(f"{job['descrizione']} annullato dopo {job['completate']} di {job['totale']} elementi.")
+    else:
+        st.warning(f"{job['descrizione']} interrotto da un riavvio del server: va rieseguito.")
+    with st.expander(f"Messaggi dell'ultima esecuzione ({len(job['messaggi'])})"):
+        for livello, messaggio in job["messaggi"]:
+            log_streamlit(livello, messaggio)
+
+@st.fragment(run_every=1)
+def _pannello_job_attivo(config, job_id):
+    job = jobs.leggi(config, job_id)
+    if not job_attivo(job):
+        # Job terminato: si ricarica tutta la pagina per mostrarne l'esito
+        st.rerun()
+    if job["stato"] == jobs.STATO_IN_CODA:
+        st.info(f"⏳ {job['descrizione']}: {job['corrente'] or 'in coda'}")
+    else:
+        frazione = job["completate"] / job["totale"] if job["totale"] else 0.0
+        testo = f"{job['descrizione']}: {job['completate']} di {job['totale']}" + (f" — `{job['corrente']}`" if job["corrente"] else "")
+        rimanenti = jobs.stima_secondi_rimanenti(job)
+        if rimanenti is not None:
+            testo += f" (circa {int(rimanenti) + 1}s rimanenti)"
+        st.progress(frazione, text=testo)
+    if st.button("⏹️ Annulla", key=f"annulla_job_{job_id}"):
+        jobs.annulla(job_id)
+        st.toast("Annullamento richiesto: l'operazione si fermerà al termine dell'elemento in corso.")
+    if job["messaggi"]:
+        with st.expander("Ultimi messaggi"):
+            for livello, messaggio in job["messaggi"][-10:]:
+                log_streamlit(livello, messaggio)
+
+def mostra_anteprima_tabella(config, engine, table_name, key_prefix):
+    """Anteprima paginata di una tabella: filtro, ordinamento e paginazione sono eseguiti in SQLite (vedi src/table_preview.py)."""
+    table_cols = colonne_tabella(engine, table_name)
+    f1, f2, f3, f4, f5 = st.columns([3, 2, 2, 1, 1])
+    filter_text = f1.text_input("Filtra:", key=f"{key_prefix}_filter")
+    filter_col = f2.selectbox("In colonna:", ["(tutte)"] + table_cols, key=f"{key_prefix}_filter_col")
+    sort_col = f3.selectbox("Ordina per:", ["(ordine di inserimento)"] + table_cols, key=f"{key_prefix}_sort")
+    descending = f4.checkbox("Decresc.", key=f"{key_prefix}_desc")
+    page_size = f5.selectbox("Righe:", [25, 50, 100, 200], index=1, key=f"{key_prefix}_size")
+
+    # Cambiando tabella, filtro o ordinamento si torna alla prima pagina
+    page_key, view_key = f"{key_prefix}_page", f"{key_prefix}_view"
+    view = (table_name, filter_text, filter_col, sort_col, descending, page_size)
+    if st.session_state.get(view_key) != view:
+        st.session_state[view_key] = view; st.session_state[page_key] = 0
+
+    try:
+        # Le anteprime procedono insieme, ma non mentre un'altra sessione riscrive le tabelle
+        with lettura(config, timeout=2):
+            df_page, total_rows, st.session_state[page_key] = leggi_pagina(
+                engine, table_name, st.session_state.get(page_key, 0), page_size, filter_text,
+                colonna_filtro=None if filter_col == "(tutte)" else filter_col,
+                ordina_per=None if sort_col == "(ordine di inserimento)" else sort_col, discendente=descending
+            )
+    except RisorsaOccupata as e:
+        st.info(f"⏳ Anteprima non disponibile durante un'operazione sul database. {e}"); return
+    st.dataframe(df_page, hide_index=True, use_container_width=True)
+
+    total_pages = max(1, (total_rows + page_size - 1) // page_size)
+    first_row = st.session_state[page_key] * page_size
+    c1, c2, c3 = st.columns([2, 6, 2])
+    if c1.button("⬅️ Prec.", disabled=st.session_state[page_key] == 0, key=f"{key_prefix}_prev"):
+        st.session_state[page_key] -= 1; st.rerun()
+    c2.write(f"<div style='text-align: center;'>Righe {min(first_row + 1, total_rows)}-{first_row + len(df_page)} di {total_rows} (pagina {st.session_state[page_key] + 1} di {total_pages})</div>", unsafe_allow_html=True)
+    if c3.button("Succ. ➡️", disabled=st.session_state[page_key] >= total_pages - 1, key=f"{key_prefix}_next"):
+        st.session_state[page_key] += 1; st.rerun()
 
 # --- FUNZIONI DEGLI STEP DEL WIZARD ---
 
@@ -233,21 +220,13 @@ def step_0_impostazioni(config, engine):
  # --- Funzione helper per la pulizia completa ---
     def _svuota_database_e_resetta_stato():
         """
-        CANCELLA FISICAMENTE TUTTE LE TABELLE DAL DATABASE E RESETTA LO STATO DELLA SESSIONE.
+        CANCELLA IL DATABASE DELLA MODALITÀ/STUDIO CORRENTE E RESETTA LO STATO DELLA SESSIONE.
+        Ogni studio ha il suo file di database: svuotarlo significa cancellare il file.
         """
         try:
-            with st.spinner("Cancellazione di tutte le tabelle dal database in corso..."):
-                inspector = inspect(engine)
-                all_tables = inspector.get_table_names()
-                with engine.connect() as connection:
-                    with connection.begin() as transaction:
-                        # Disabilita temporaneamente i vincoli per SQLite per evitare errori di dipendenza
-                        connection.execute(text("PRAGMA foreign_keys = OFF;"))
-                        for table_name in all_tables:
-                            connection.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
-                        # Riabilita i vincoli
-                        connection.execute(text("PRAGMA foreign_keys = ON;"))
-                        transaction.commit()
+            with st.spinner("Cancellazione del database in corso..."):
+                with operazione_esclusiva(config, "Svuota database"):
+                    svuota_database(config)
             
             # Pulisce lo stato della sessione, mantenendo solo le impostazioni di base
             st.success("Database svuotato con successo!")
@@ -340,7 +319,7 @@ def step_0_impostazioni(config, engine):
 
     st.markdown("---")
     # --- Pulsante di pulizia potenziato ---
-    st.warning("ATTENZIONE: L'opzione seguente cancellerà l'INTERO database (tutte le tabelle e i dati) e resetterà la sessione di lavoro.")
+    st.warning(f"ATTENZIONE: L'opzione seguente cancellerà l'INTERO database di questa modalità/studio (`{os.path.relpath(config['db_path'], BASE_DIR)}`, tutte le tabelle e i dati) e resetterà la sessione di lavoro.")
     if st.button('🗑️ Svuota INTERO Database e Resetta', key='svuota_db_top', on_click=_svuota_database_e_resetta_stato):
         pass # La logica è gestita dalla callback on_click
 
@@ -383,64 +362,10 @@ def step_2_import_struttura(config, engine):
     numeric_header_row = st.number_input("Riga intestazioni NUMERICHE", min_value=1, value=2, key=f'struttura_numeric_header_{mode_name}')
     desc_header_row = st.number_input("Riga intestazioni DESCRITTIVE", min_value=1, value=3, key=f'struttura_desc_header_{mode_name}')
     
-    if st.button('Importa Struttura', key=f'importa_struttura_btn_{mode_name}'):
-        with st.spinner("Importazione in corso..."):
-            
-            # --- BLOCCO AGGIUNTO: PULIZIA PREVENTIVA DELLE VECCHIE TABELLE STRUTTURA ---
-            try:
-                st.write("Pulizia delle vecchie tabelle di struttura...")
-                inspector = inspect(engine)
-                all_db_tables = inspector.get_table_names()
-                struttura_tables_to_drop = [t for t in all_db_tables if t.startswith(config["db_struttura_prefix"])]
-                
-                if struttura_tables_to_drop:
-                    with engine.connect() as connection:
-                        with connection.begin() as transaction:
-                            for table_name in struttura_tables_to_drop:
-                                connection.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
-                            transaction.commit()
-                    st.info(f"Rimosse {len(struttura_tables_to_drop)} vecchie tabelle di struttura.")
-                else:
-                    st.info("Nessuna vecchia tabella di struttura da rimuovere.")
-            except Exception as e:
-                st.error(f"Errore durante la pulizia delle vecchie tabelle di struttura: {e}")
-                st.stop()
-            # --- FINE BLOCCO DI PULIZIA ---
-
-            for file_name in selected_files:
-                try:
-                    workbook = openpyxl.load_workbook(os.path.join(config["struttura_dir"], file_name), read_only=True)
-                    sheet = workbook.active
-                    numeric_values = [cell.value for cell in sheet[numeric_header_row]]
-                    descriptive_values = [cell.value for cell in sheet[desc_header_row]]
-                    if descriptive_values and str(descriptive_values[0]).strip().lower() == 'non modificare questa riga':
-                        numeric_values.pop(0); descriptive_values.pop(0)
-                    
-                    header_map = {}; final_headers = []; pretty_name_map = {}
-                    for desc, num in zip(descriptive_values, numeric_values):
-                        if desc and str(desc).strip():
-                            original_desc = ' '.join(str(desc).strip().split())
-                            clean_desc = sanitize_column_name(original_desc)
-                            final_headers.append(clean_desc)
-                            header_map[clean_desc] = num
-                            pretty_name_map[clean_desc] = original_desc
-                    
-                    df_structure = pd.DataFrame(columns=final_headers)
-                    table_name = f'{config["db_struttura_prefix"]}{os.path.splitext(file_name)[0]}'
-                    # Nota: if_exists='replace' qui agisce come 'create' perché abbiamo già cancellato tutto
-                    df_structure.to_sql(table_name, engine, if_exists='replace', index=False)
-                    st.success(f"Struttura '{table_name}' importata con successo.")
-                    
-                    # Salva le mappe dei nomi per l'export e la UI
-                    pretty_name_map_path = os.path.join(config["mapping_dir"], f"{table_name}_prettynames.json")
-                    with open(pretty_name_map_path, 'w', encoding='utf-8') as f: json.dump(pretty_name_map, f, indent=4)
-                    
-                    # Salva la mappa per le intestazioni numeriche (potrebbe servire in futuro per l'export)
-                    header_map_path = os.path.join(config["mapping_dir"], f"{table_name}_headers.json")
-                    with open(header_map_path, 'w', encoding='utf-8') as f: json.dump(header_map, f, indent=4)
-
-                except Exception as e: 
-                    st.error(f"Errore importando {file_name}: {e}")
+    job = jobs.ultimo(config, 'import_struttura')
+    if st.button('Importa Struttura', key=f'importa_struttura_btn_{mode_name}', disabled=job_attivo(job)):
+        avvia_job(config, 'import_struttura', "Import struttura", importa_struttura, config, engine, selected_files, numeric_header_row, desc_header_row)
+    mostra_job(config, job)
 
 def step_3_upload_appoggio(config, engine):
     mode_name = config['mode'].capitalize()
@@ -478,66 +403,10 @@ def step_4_import_appoggio(config, engine):
     selected_files = st.multiselect('Seleziona file da importare', files, default=files, key=f'appoggio_ms_{mode_name}')
     header_row = st.number_input("Riga intestazioni", min_value=1, value=1, key=f'appoggio_header_{mode_name}')
     
-    if st.button('Importa Dati', key=f'importa_appoggio_btn_{mode_name}'):
-        with st.spinner("Importazione in corso..."):
-            
-            # --- BLOCCO AGGIUNTO: PULIZIA PREVENTIVA DELLE VECCHIE TABELLE DI APPOGGIO ---
-            try:
-                st.write("Pulizia delle vecchie tabelle di appoggio...")
-                inspector = inspect(engine)
-                all_db_tables = inspector.get_table_names()
-                appoggio_tables_to_drop = [t for t in all_db_tables if t.endswith(config["db_appoggio_suffix"])]
-                
-                if appoggio_tables_to_drop:
-                    with engine.connect() as connection:
-                        with connection.begin() as transaction:
-                            for table_name in appoggio_tables_to_drop:
-                                connection.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
-                            transaction.commit()
-                    st.info(f"Rimosse {len(appoggio_tables_to_drop)} vecchie tabelle di appoggio.")
-                else:
-                    st.info("Nessuna vecchia tabella di appoggio da rimuovere.")
-            except Exception as e:
-                st.error(f"Errore durante la pulizia delle vecchie tabelle di appoggio: {e}")
-                st.stop()
-            # --- FINE BLOCCO DI PULIZIA ---
-
-            for file_name in selected_files:
-                try:
-                    file_path = os.path.join(config["appoggio_dir"], file_name)
-                    
-                    # Estrazione commenti con openpyxl (logica invariata)
-                    workbook = openpyxl.load_workbook(file_path)
-                    sheet = workbook.active
-                    comments_map = {}
-                    for cell in sheet[header_row]:
-                        if cell.comment and cell.value:
-                            sanitized_header = sanitize_column_name(cell.value)
-                            raw_text = cell.comment.text
-                            colon_position = raw_text.find(':')
-                            comment_text = raw_text[colon_position + 1:].strip() if colon_position != -1 else raw_text.strip()
-                            comments_map[sanitized_header] = comment_text
-                    
-                    comments_path = os.path.join(config["mapping_dir"], "appoggio_comments.json")
-                    with open(comments_path, 'w', encoding='utf-8') as f:
-                        json.dump(comments_map, f, indent=4)
-                    if comments_map:
-                        st.success(f"Trovati e salvati {len(comments_map)} commenti da `{file_name}`.")
-
-                    # Lettura dati e importazione nel DB
-                    df = pd.read_excel(file_path, header=header_row - 1, dtype=str).fillna('')
-                    pretty_name_map = {sanitize_column_name(col): str(col).strip() for col in df.columns}
-                    df.columns = [sanitize_column_name(col) for col in df.columns]
-
-                    table_name = f'{os.path.splitext(file_name)[0]}{config["db_appoggio_suffix"]}'
-                    df.to_sql(table_name, engine, if_exists='replace', index=False)
-                    st.success(f"Dati '{table_name}' importati con colonne sanificate.")
-
-                    pretty_name_map_path = os.path.join(config["mapping_dir"], f"{table_name}_prettynames.json")
-                    with open(pretty_name_map_path, 'w', encoding='utf-8') as f: json.dump(pretty_name_map, f, indent=4)
-                    
-                except Exception as e: 
-                    st.error(f"Errore importando {file_name}: {e}")
+    job = jobs.ultimo(config, 'import_appoggio')
+    if st.button('Importa Dati', key=f'importa_appoggio_btn_{mode_name}', disabled=job_attivo(job)):
+        avvia_job(config, 'import_appoggio', "Import appoggio", importa_appoggio, config, engine, selected_files, header_row)
+    mostra_job(config, job)
 
 # SOSTITUISCI INTERAMENTE LA TUA FUNZIONE step_5_mappatura_globale CON QUESTA
 def step_5_mappatura_globale(config, engine):
@@ -555,8 +424,7 @@ def step_5_mappatura_globale(config, engine):
 
     try:
         # --- 1. CARICAMENTO DATI E SETUP ---
-        inspector = inspect(engine)
-        all_tables = inspector.get_table_names()
+        all_tables = elenca_tabelle(engine)
         struttura_tables = sorted([t for t in all_tables if t.startswith(config["db_struttura_prefix"])])
         appoggio_tables = sorted([t for t in all_tables if t.endswith(config["db_appoggio_suffix"])])
         
@@ -576,7 +444,7 @@ def step_5_mappatura_globale(config, engine):
 
         # Raccogli tutte le colonne sorgente con il loro percorso completo
         for appoggio_tbl in appoggio_tables:
-            cols_in_appoggio_tbl = pd.read_sql_table(appoggio_tbl, engine).columns.tolist()
+            cols_in_appoggio_tbl = colonne_tabella(engine, appoggio_tbl)
             for col in cols_in_appoggio_tbl:
                 all_source_cols_sanitized_full_paths.append(f"{appoggio_tbl}.{col}")
         source_cols_for_ui = sorted(list(set(all_source_cols_sanitized_full_paths)))
@@ -589,17 +457,17 @@ def step_5_mappatura_globale(config, engine):
         # Raccogliamo tutti i nomi di colonna UNICI da tutte le tabelle di struttura
         unique_dest_col_names_sanitized = set()
         for table_name in struttura_tables:
-            cols_in_struttura_tbl = pd.read_sql(f'SELECT * FROM "{table_name}" LIMIT 0', engine).columns.tolist()
+            cols_in_struttura_tbl = colonne_tabella(engine, table_name)
             for col_name_sanitized in cols_in_struttura_tbl:
                 unique_dest_col_names_sanitized.add(col_name_sanitized)
         
         # Questa sarà la nostra lista di opzioni per la mappatura
         sorted_unique_dest_col_names = sorted(list(unique_dest_col_names_sanitized))
-        dest_options_for_multiselect = ["-- Non mappare --", "Nascondi"] + sorted_unique_dest_col_names
+        dest_options_for_multiselect = [NON_MAPPARE, NASCONDI] + sorted_unique_dest_col_names
         
         # NUOVA Funzione per formattare le opzioni di destinazione (mostra solo il pretty name)
         def format_dest_col_name_for_display(sanitized_col_name):
-            if sanitized_col_name in ["-- Non mappare --", "Nascondi"]:
+            if sanitized_col_name in [NON_MAPPARE, NASCONDI]:
                 return sanitized_col_name
             return get_pretty_name(sanitized_col_name)
 
@@ -608,42 +476,24 @@ def step_5_mappatura_globale(config, engine):
         comments_map = json.load(open(comments_path, 'r', encoding='utf-8')) if os.path.exists(comments_path) else {}
 
         # --- 2. GESTIONE STATO E CARICAMENTO MAPPATURE ESISTENTI ---
-        loaded_full_mapping_data_from_file = {}
-        mapping_path = os.path.join(config["mapping_dir"], "global_mapping.json")
-        if os.path.exists(mapping_path):
-            with open(mapping_path, 'r', encoding='utf-8') as f:
-                loaded_full_mapping_data_from_file = json.load(f)
-        
+        saved_mapping_config = leggi_configurazione(config["mapping_dir"])
+        loaded_full_mapping_data_from_file = saved_mapping_config["column_mappings"]
+
         loaded_global_settings = st.session_state.get('loaded_template_data', {})
-        if not loaded_global_settings: 
-            date_columns_path = os.path.join(config["mapping_dir"], "date_columns.json")
-            if os.path.exists(date_columns_path):
-                with open(date_columns_path, 'r', encoding='utf-8') as f:
-                    loaded_global_settings.setdefault("date_format_columns", json.load(f).get("date_columns", []))
-            
-            studio_mapping_path = os.path.join(config["mapping_dir"], "studio_mapping.json")
-            if os.path.exists(studio_mapping_path):
-                with open(studio_mapping_path, 'r', encoding='utf-8') as f:
-                    loaded_global_settings.setdefault("studio_code_column", json.load(f).get("codice_studio_column", ""))
-
-            force_1to1_tables_path = os.path.join(config["mapping_dir"], "force_1to1_tables.json")
-            if os.path.exists(force_1to1_tables_path):
-                with open(force_1to1_tables_path, 'r', encoding='utf-8') as f:
-                    loaded_global_settings.setdefault("force_1to1_tables", json.load(f).get("force_1to1_tables", []))
-            else: 
-                loaded_global_settings.setdefault("force_1to1_tables", [])
-        
+        if not loaded_global_settings:
+            loaded_global_settings = {k: saved_mapping_config[k] for k in ("date_format_columns", "studio_code_column", "force_1to1_tables")}
+
         # Inizializzazione dello stato live della mappatura
         live_mapping_state_key = f"live_mapping_state_{mode}" 
         if live_mapping_state_key not in st.session_state:
             st.session_state[live_mapping_state_key] = {}
             for col_full_path in source_cols_for_ui:
-                default_dest_list = loaded_full_mapping_data_from_file.get(col_full_path, ["-- Non mappare --"])
+                default_dest_list = loaded_full_mapping_data_from_file.get(col_full_path, [NON_MAPPARE])
                 if not isinstance(default_dest_list, list):
                     default_dest_list = [default_dest_list]
                 # Valida che le opzioni caricate esistano ancora
                 valid_default_dest_list = [d for d in default_dest_list if d in dest_options_for_multiselect]
-                st.session_state[live_mapping_state_key][col_full_path] = valid_default_dest_list if valid_default_dest_list else ["-- Non mappare --"]
+                st.session_state[live_mapping_state_key][col_full_path] = valid_default_dest_list if valid_default_dest_list else [NON_MAPPARE]
         
         current_live_mapping = st.session_state[live_mapping_state_key]
 
@@ -662,54 +512,124 @@ def step_5_mappatura_globale(config, engine):
         st.subheader(f"Mappatura Colonne Dati Sorgente a Descrizioni di Destinazione")
         st.info("Mappa una sorgente a una descrizione. Se quella descrizione esiste in più tabelle di struttura, verranno popolate tutte automaticamente nei casi di mappatura semplice (1-a-1).")
 
-        hide_unmapped_key = f'hide_unmapped_{mode}_global'
-        hide_hidden_key = f'hide_hidden_{mode}_global'
-        st.checkbox("Nascondi colonne non mappate", key=hide_unmapped_key, value=st.session_state.get(hide_unmapped_key, False))
-        st.checkbox("Nascondi colonne impostate su 'Nascondi'", key=hide_hidden_key, value=st.session_state.get(hide_hidden_key, False))
-        st.markdown("---")
+        # Filtri lato server: alla griglia arriva solo la pagina corrente (vedi src/mapping_grid.py)
+        f1, f2, f3 = st.columns([3, 3, 2])
+        search_text = f1.text_input("Cerca (colonna, commento, destinazione):", key=f'mapping_search_{mode}')
+        table_filter = f2.multiselect("Tabelle di appoggio:", options=appoggio_tables, key=f'mapping_tables_filter_{mode}', format_func=get_pretty_name)
+        state_filter = f3.selectbox("Stato:", options=STATI, key=f'mapping_state_filter_{mode}')
 
-        cols_to_display_filtered = source_cols_for_ui 
-        if st.session_state[hide_unmapped_key]:
-            cols_to_display_filtered = [c for c in cols_to_display_filtered if current_live_mapping.get(c) not in [["-- Non mappare --"], []]]
-        if st.session_state[hide_hidden_key]:
-            cols_to_display_filtered = [c for c in cols_to_display_filtered if current_live_mapping.get(c) != ["Nascondi"]]
+        cols_to_display_filtered = filtra_sorgenti(
+            source_cols_for_ui, current_live_mapping, search_text, table_filter, state_filter,
+            nome_leggibile=get_pretty_name, commenti=comments_map
+        )
 
-        # Logica di paginazione
         page_key = f'mapping_page_{mode}_global'
-        if page_key not in st.session_state: st.session_state[page_key] = 0
-        items_per_page = 10
-        total_pages = (len(cols_to_display_filtered) + items_per_page - 1) // items_per_page
-        st.session_state[page_key] = min(st.session_state.get(page_key, 0), max(0, total_pages - 1))
-        start_index, end_index = st.session_state[page_key] * items_per_page, (st.session_state[page_key] + 1) * items_per_page
-        paginated_cols = cols_to_display_filtered[start_index:end_index]
-
-        st.write(f"**Mappa Colonne Sorgente (Pagina {st.session_state[page_key] + 1} di {total_pages})**")
-        
+        page_size = st.session_state.get(f'mapping_page_size_{mode}', 50)
+        paginated_cols, st.session_state[page_key], total_pages = pagina(cols_to_display_filtered, st.session_state.get(page_key, 0), page_size)
+
+        st.write(f"**{len(cols_to_display_filtered)} colonne sorgente** (Pagina {st.session_state[page_key] + 1} di {total_pages})")
+
+        # Opzioni di destinazione con etichette leggibili: inviate una sola volta per la colonna della griglia
+        dest_labels, label_to_dest = etichette_destinazioni(sorted_unique_dest_col_names, get_pretty_name)
+        dest_to_label = {v: k for k, v in label_to_dest.items()}
+        grid_options = [NON_MAPPARE, NASCONDI] + dest_labels
+
+        # Suggerimenti: indice delle destinazioni (in cache fino al prossimo import) + mappature di altri studi e template
+        suggest_index = indice_destinazioni(sorted_unique_dest_col_names, get_pretty_name)
+        suggest_history = carica_storico(os.path.join(config["mapping_root_dir"], mode), escludi=config["mapping_dir"])
+        page_unmapped = [c for c in paginated_cols if stato_mappatura(current_live_mapping.get(c, [NON_MAPPARE])) == STATO_NON_MAPPATE]
+        page_suggestions = suggerisci_tutte(suggest_index, page_unmapped, get_pretty_name, suggest_history)
+
+        selection_key = f'mapping_selection_{mode}'
+        if selection_key not in st.session_state: st.session_state[selection_key] = set()
+        selected_sources = st.session_state[selection_key]
+
+        grid_rows = []
         for col_full_path in paginated_cols:
-            default_selected_destinations = current_live_mapping.get(col_full_path, ["-- Non mappare --"])
             source_table_name_raw, source_col_name_sanitized = col_full_path.split('.', 1)
-            source_table_display_name = get_pretty_name(source_table_name_raw)
-            display_pretty_name = get_pretty_name(source_col_name_sanitized)
-            comment_text = comments_map.get(source_col_name_sanitized)
-            label_to_show = f"`{display_pretty_name}` (da `{source_table_display_name}`) → 💬" if comment_text else f"`{display_pretty_name}` (da `{source_table_display_name}`) →"
-
-            st.multiselect(
-                label_to_show,
-                options=dest_options_for_multiselect,           # Usa la nuova lista di opzioni astratte
-                default=default_selected_destinations, 
-                key=f"map_global_{col_full_path}_{mode}",
-                on_change=update_live_mapping_callback, 
-                args=(col_full_path, mode,),
-                help=comment_text,
-                format_func=format_dest_col_name_for_display    # Usa la nuova funzione di formattazione
-            )
+            destinations = current_live_mapping.get(col_full_path, [NON_MAPPARE])
+            real_destinations = destinazioni_reali(destinations)
+            grid_rows.append({
+                "Seleziona": col_full_path in selected_sources,
+                "Colonna sorgente": get_pretty_name(source_col_name_sanitized),
+                "Tabella": get_pretty_name(source_table_name_raw),
+                "Commento": comments_map.get(source_col_name_sanitized) or "",
+                "Destinazione": dest_to_label.get(real_destinations[0], real_destinations[0]) if real_destinations else destinations[0],
+                "Altre destinazioni": [dest_to_label.get(d, d) for d in real_destinations[1:]],
+                "Suggerimento": f"{dest_to_label[page_suggestions[col_full_path][0]]} ({page_suggestions[col_full_path][1]:.0%})" if col_full_path in page_suggestions else "",
+            })
+        grid_df = pd.DataFrame(grid_rows, index=paginated_cols, columns=["Seleziona", "Colonna sorgente", "Tabella", "Commento", "Destinazione", "Altre destinazioni", "Suggerimento"])
+
+        # La chiave dipende da filtri e pagina: cambiando vista le modifiche non salvate della griglia non vengono riapplicate altrove
+        # La revisione cambia dopo un'assegnazione in blocco, che modifica righe già mostrate nella griglia
+        grid_rev_key = f'mapping_grid_rev_{mode}'
+        grid_key = f"mapping_grid_{mode}_{hash((search_text, tuple(table_filter), state_filter, st.session_state[page_key], page_size, st.session_state.get(grid_rev_key, 0)))}"
+        edited_df = st.data_editor(
+            grid_df, key=grid_key, hide_index=True, use_container_width=True,
+            disabled=["Colonna sorgente", "Tabella", "Commento", "Altre destinazioni", "Suggerimento"],
+            column_config={
+                "Seleziona": st.column_config.CheckboxColumn("✓", help="Seleziona per l'assegnazione in blocco", width="small"),
+                "Commento": st.column_config.TextColumn("💬 Commento", width="medium"),
+                "Destinazione": st.column_config.SelectboxColumn("Destinazione", options=grid_options, required=True, width="large"),
+                "Altre destinazioni": st.column_config.ListColumn("Altre destinazioni", help="Usa l'assegnazione in blocco per aggiungere o togliere destinazioni"),
+                "Suggerimento": st.column_config.TextColumn("💡 Suggerimento", help="Destinazione proposta per le colonne non mappate (accettabile in blocco)", width="medium"),
+            },
+        )
+        for col_full_path in paginated_cols:
+            if edited_df.at[col_full_path, "Seleziona"]: selected_sources.add(col_full_path)
+            else: selected_sources.discard(col_full_path)
+            new_label = edited_df.at[col_full_path, "Destinazione"]
+            if new_label != grid_df.at[col_full_path, "Destinazione"]:
+                current_live_mapping[col_full_path] = imposta_principale(current_live_mapping.get(col_full_path), label_to_dest.get(new_label, new_label))
+
+        c1, c2, c3, c4 = st.columns([2, 3, 2, 2])
+        if c1.button("⬅️ Prec.", disabled=st.session_state[page_key] == 0, key=f'mapping_prev_{mode}'):
+            st.session_state[page_key] -= 1; st.rerun()
+        c2.write(f"<div style='text-align: center;'>Pagina {st.session_state[page_key] + 1} di {total_pages}</div>", unsafe_allow_html=True)
+        if c3.button("Succ. ➡️", disabled=st.session_state[page_key] >= total_pages - 1, key=f'mapping_next_{mode}'):
+            st.session_state[page_key] += 1; st.rerun()
+        c4.selectbox("Righe per pagina", [25, 50, 100, 200], index=[25, 50, 100, 200].index(page_size), key=f'mapping_page_size_{mode}', label_visibility="collapsed")
+
+        with st.expander(f"Assegnazione in blocco ({len(selected_sources)} selezionate)"):
+            bulk_target_labels = {"selezionate": f"Colonne selezionate ({len(selected_sources)})", "filtrate": f"Tutte le colonne filtrate ({len(cols_to_display_filtered)})"}
+            bulk_target = st.radio("Applica a:", list(bulk_target_labels), format_func=bulk_target_labels.get, key=f'mapping_bulk_target_{mode}', horizontal=True)
+            bulk_mode = st.radio("Operazione:", MODALITA_ASSEGNAZIONE, key=f'mapping_bulk_mode_{mode}', horizontal=True)
+            bulk_labels = st.multiselect("Destinazioni:", options=dest_labels, key=f'mapping_bulk_dest_{mode}',
+                                         disabled=bulk_mode in (ASSEGNA_RIMUOVI, ASSEGNA_NASCONDI))
+            b1, b2, _ = st.columns([2, 2, 4])
+            if b1.button("Applica", type="primary", key=f'mapping_bulk_apply_{mode}'):
+                targets = sorted(selected_sources) if bulk_target == "selezionate" else cols_to_display_filtered
+                if bulk_mode in (ASSEGNA_SOSTITUISCI, ASSEGNA_AGGIUNGI) and not bulk_labels:
+                    st.warning("Scegli almeno una destinazione.")
+                else:
+                    changed = assegna_in_blocco(current_live_mapping, targets, [label_to_dest[l] for l in bulk_labels], bulk_mode)
+                    st.session_state[grid_rev_key] = st.session_state.get(grid_rev_key, 0) + 1
+                    st.toast(f"Aggiornate {changed} colonne sorgente.")
+                    st.rerun()
+            if b2.button("Deseleziona tutto", key=f'mapping_bulk_clear_{mode}'):
+                selected_sources.clear()
+                st.session_state[grid_rev_key] = st.session_state.get(grid_rev_key, 0) + 1
+                st.rerun()
 
-        if total_pages > 1:
-            st.markdown("---")
-            c1,c2,c3 = st.columns([2,3,2]); 
-            if st.session_state[page_key] > 0: c1.button("⬅️ Prec.", on_click=lambda: st.session_state.__setitem__(page_key, st.session_state[page_key] - 1))
-            c2.write(f"<div style='text-align: center;'>Pagina {st.session_state[page_key] + 1} di {total_pages}</div>", unsafe_allow_html=True)
-            if st.session_state[page_key] < total_pages - 1: c3.button("Succ. ➡️", on_click=lambda: st.session_state.__setitem__(page_key, st.session_state[page_key] + 1))
+        with st.expander("💡 Suggerimenti automatici"):
+            st.caption("Proposte per le colonne filtrate non ancora mappate, ricavate dalla somiglianza dei nomi e dalle mappature di altri studi e dei template.")
+            threshold = st.slider("Punteggio minimo:", 0.0, 1.0, 0.6, 0.05, key=f'mapping_suggest_threshold_{mode}')
+            unmapped_filtered = [c for c in cols_to_display_filtered if stato_mappatura(current_live_mapping.get(c, [NON_MAPPARE])) == STATO_NON_MAPPATE]
+            suggestions = suggerisci_tutte(suggest_index, unmapped_filtered, get_pretty_name, suggest_history, soglia=threshold)
+            if not suggestions:
+                st.info("Nessun suggerimento sopra la soglia per le colonne filtrate.")
+            else:
+                st.dataframe(pd.DataFrame([
+                    {"Colonna sorgente": get_pretty_name(s.split('.', 1)[1]), "Tabella": get_pretty_name(s.split('.', 1)[0]),
+                     "Destinazione proposta": dest_to_label[d], "Punteggio": score, "Origine": reason}
+                    for s, (d, score, reason) in suggestions.items()
+                ]), hide_index=True, use_container_width=True,
+                    column_config={"Punteggio": st.column_config.ProgressColumn("Punteggio", min_value=0.0, max_value=1.0, format="%.2f")})
+                if st.button(f"Accetta {len(suggestions)} suggerimenti", type="primary", key=f'mapping_suggest_accept_{mode}'):
+                    changed = sum(assegna_in_blocco(current_live_mapping, [s], [d], ASSEGNA_SOSTITUISCI) for s, (d, _, _) in suggestions.items())
+                    st.session_state[grid_rev_key] = st.session_state.get(grid_rev_key, 0) + 1
+                    st.toast(f"Accettati {changed} suggerimenti.")
+                    st.rerun()
         st.markdown("---")
 
         # --- 5. IMPOSTAZIONI AGGIUNTIVE GLOBALI ---
@@ -739,7 +659,7 @@ def step_5_mappatura_globale(config, engine):
         # --- 6. AZIONI SUL TEMPLATE E SALVATAGGIO ---
         current_full_mapping_data['column_mappings'] = { 
             s_key: d_list for s_key, d_list in current_live_mapping.items() 
-            if d_list and d_list != ["-- Non mappare --"] and d_list != ["Nascondi"]
+            if d_list and d_list != [NON_MAPPARE] and d_list != [NASCONDI]
         }
         current_full_mapping_data['date_format_columns'] = selected_date_cols
         current_full_mapping_data['studio_code_column'] = selected_studio_col if selected_studio_col != "-- Non applicare --" else ""
@@ -753,6 +673,7 @@ def step_5_mappatura_globale(config, engine):
                     template_path = os.path.join(templates_dir, f"{safe_filename}.json")
                     with open(template_path, 'w', encoding='utf-8') as f:
                         json.dump(current_full_mapping_data, f, indent=4)
+                    invalida_storico()
                     st.success(f"Template '{template_name_input}' salvato!"); st.rerun()
                 else: 
                     st.error("Inserisci un nome per il template.")
@@ -764,17 +685,19 @@ def step_5_mappatura_globale(config, engine):
                     template_path = os.path.join(templates_dir, f"{safe_filename}.json")
                     with open(template_path, 'w', encoding='utf-8') as f:
                         json.dump(current_full_mapping_data, f, indent=4)
+                    invalida_storico()
                     st.success(f"Template '{loaded_name_for_display}' aggiornato!")
 
             st.markdown("---")
             st.info("Le configurazioni sono salvate automaticamente ad ogni interazione.")
-    
+
+        # Salvataggio automatico: il file viene riscritto solo se la configurazione è cambiata.
+        # Dopo un errore non si salva, per non sovrascrivere la mappatura con uno stato parziale.
+        save_global_mapping_config(config, current_full_mapping_data)
+
     except Exception as e: 
         st.error(f"Errore critico durante la mappatura: {e}"); st.exception(e)
 
-    # Salvataggio automatico ad ogni interazione
-    save_global_mapping_config(config, current_full_mapping_data)
-
 
 # SOSTITUISCI IL TUO STEP 5B CON QUESTA VERSIONE AGGIORNATA
 def step_5b_verifica_trasformazioni(config, engine):
@@ -782,22 +705,13 @@ def step_5b_verifica_trasformazioni(config, engine):
     st.info("Questo step analizza la mappatura astratta. Se rileva che una descrizione è mappata da più sorgenti, ti permette di configurare la trasformazione per le tabelle che la contengono.")
 
     try:
-        # Carica la mappatura astratta {source_full_path: [dest_col_name_1, ...]}
-        mapping_path = os.path.join(config["mapping_dir"], "global_mapping.json")
-        if not os.path.exists(mapping_path):
+        # Piano di esecuzione condiviso con popolamento ed export (vedi src/mapping_plan.py)
+        if not esiste_configurazione(config["mapping_dir"]):
             st.warning("Esegui prima la mappatura allo Step 6."); return
-        with open(mapping_path, 'r', encoding='utf-8') as f:
-            global_mapping_abstract = json.load(f)
-        
-        force_1to1_tables_path = os.path.join(config["mapping_dir"], "force_1to1_tables.json")
-        force_1to1_tables = []
-        if os.path.exists(force_1to1_tables_path):
-            with open(force_1to1_tables_path, 'r', encoding='utf-8') as f:
-                force_1to1_tables = json.load(f).get("force_1to1_tables", [])
+        piano = compila_piano(config, engine)
 
         # Carica i nomi leggibili per un output più chiaro
-        inspector = inspect(engine)
-        all_tables = inspector.get_table_names()
+        all_tables = elenca_tabelle(engine)
         master_pretty_name_map = {}
         for table_name_sanitized in all_tables:
             path = os.path.join(config["mapping_dir"], f"{table_name_sanitized}_prettynames.json")
@@ -809,39 +723,15 @@ def step_5b_verifica_trasformazioni(config, engine):
         def get_pretty_name(s_name):
             return master_pretty_name_map.get(s_name, s_name)
 
-        # --- NUOVA LOGICA DI RILEVAMENTO UNPIVOT ---
-        # 1. Inverti la mappa per avere dest_col -> [lista di sorgenti]
-        dest_to_sources_map = {}
-        for source_full, dest_cols in global_mapping_abstract.items():
-            for dest_col in dest_cols:
-                if dest_col not in dest_to_sources_map:
-                    dest_to_sources_map[dest_col] = []
-                dest_to_sources_map[dest_col].append(source_full.split('.')[-1]) # Salva solo il nome della colonna sorgente
-
-        # 2. Analizza ogni tabella struttura per vedere se è coinvolta
-        struttura_tables = sorted([t for t in all_tables if t.startswith(config["db_struttura_prefix"])])
+        # --- RILEVAMENTO UNPIVOT ---
+        # Le tabelle con strategia unpivot hanno almeno una colonna mappata da più sorgenti
         unpivot_tables_info = {}
-        for struttura_table in struttura_tables:
-            if struttura_table in force_1to1_tables:
+        for struttura_table in sorted(piano["tabelle"]):
+            piano_tabella = piano["tabelle"][struttura_table]
+            if piano_tabella["strategia"] != STRATEGIA_UNPIVOT:
                 continue
-
-            table_dest_cols = pd.read_sql(f'SELECT * FROM "{struttura_table}" LIMIT 0', engine).columns.tolist()
-            
-            # Cerca le colonne in QUESTA tabella che sono target di mappature molti-a-uno o uno-a-uno
-            unpivot_triggers = {}
-            one_to_one_cols = []
-            is_unpivot_target = False
-
-            for dest_col in table_dest_cols:
-                sources = dest_to_sources_map.get(dest_col, [])
-                if len(sources) > 1:
-                    unpivot_triggers[dest_col] = sources
-                    is_unpivot_target = True
-                elif len(sources) == 1:
-                    one_to_one_cols.append(dest_col)
-            
-            if is_unpivot_target:
-                unpivot_tables_info[struttura_table] = {"triggers": unpivot_triggers, "key_options": one_to_one_cols}
+            unpivot_triggers = {dest_col: [s.split('.')[-1] for s in sources] for dest_col, sources in piano_tabella["unpivot"].items()}
+            unpivot_tables_info[struttura_table] = {"triggers": unpivot_triggers, "key_options": list(piano_tabella["uno_a_uno"])}
 
         st.markdown("---")
         
@@ -895,169 +785,102 @@ def step_6_popola_dati(config, engine):
     mode_name = config['mode'].capitalize()
     st.header(f"Step 7: Popola Dati ({mode_name})")
 
-    if st.button("APPLICA MAPPATURA E POPOLA", key=f'popola_btn_{mode_name}'):
-        with st.spinner("Popolamento in corso..."):
-            try:
-                # 1. Caricamento Globale delle configurazioni
-                mapping_path = os.path.join(config["mapping_dir"], "global_mapping.json")
-                if not os.path.exists(mapping_path):
-                    st.error("'global_mapping.json' non trovato."); return
-                with open(mapping_path, 'r', encoding='utf-8') as f:
-                    global_mapping_abstract = json.load(f)
-
-                unpivot_keys_path = os.path.join(config["mapping_dir"], "unpivot_keys_config.json")
-                unpivot_keys_config = json.load(open(unpivot_keys_path)) if os.path.exists(unpivot_keys_path) else {}
-                
-                studio_mapping_path = os.path.join(config["mapping_dir"], "studio_mapping.json")
-                studio_target_col = json.load(open(studio_mapping_path))['codice_studio_column'] if os.path.exists(studio_mapping_path) else ""
-                codice_studio_value = st.session_state.get('codice_studio_valore_sicuro', '').upper()
-
-                force_1to1_tables_path = os.path.join(config["mapping_dir"], "force_1to1_tables.json")
-                force_1to1_tables = json.load(open(force_1to1_tables_path))['force_1to1_tables'] if os.path.exists(force_1to1_tables_path) else []
-
-                inspector = inspect(engine)
-                all_appoggio_tables_in_db = [t for t in inspector.get_table_names() if t.endswith(config["db_appoggio_suffix"])]
-                appoggio_dfs = {tbl: pd.read_sql_table(tbl, engine).astype(str) for tbl in all_appoggio_tables_in_db}
-                
-                struttura_tables = [t for t in inspector.get_table_names() if t.startswith(config["db_struttura_prefix"])]
-                if not (appoggio_dfs and struttura_tables):
-                    st.warning("Nessun dato di appoggio o tabella di struttura trovati."); return
-
-                # Inverti la mappa per avere dest_col -> [lista di sorgenti complete]
-                dest_to_sources_map = {}
-                for source_full, dest_cols in global_mapping_abstract.items():
-                    for dest_col in dest_cols:
-                        if dest_col not in dest_to_sources_map:
-                            dest_to_sources_map[dest_col] = []
-                        dest_to_sources_map[dest_col].append(source_full)
-
-                # 2. Ciclo di Esecuzione per ogni tabella struttura
-                for struttura_table in struttura_tables:
-                    st.write(f"--- Elaborazione per `{struttura_table}` ---")
-                    
-                    dest_cols_for_this_table = pd.read_sql(f'SELECT * FROM "{struttura_table}" LIMIT 0', engine).columns.tolist()
-                    
-                    # Determina se questa tabella necessita di una trasformazione unpivot
-                    is_unpivot = False
-                    if struttura_table not in force_1to1_tables:
-                        for dest_col in dest_cols_for_this_table:
-                            if len(dest_to_sources_map.get(dest_col, [])) > 1:
-                                is_unpivot = True
-                                break
-
-                    df_popolato = pd.DataFrame()
-
-                    # --- LOGICA IBRIDA ---
-                    if is_unpivot:
-                        st.info(f"Logica Rilevata: Trasformazione Wide-to-Long (Unpivot) per `{struttura_table}`")
-                        
-                        table_specific_dest_map = {k: v for k, v in dest_to_sources_map.items() if k in dest_cols_for_this_table}
-                        
-                        one_to_one_map = {dest: sources[0] for dest, sources in table_specific_dest_map.items() if len(sources) == 1}
-                        unpivot_map = {dest: sources for dest, sources in table_specific_dest_map.items() if len(sources) > 1}
-
-                        all_source_tables = {s.split('.')[0] for sources_list in table_specific_dest_map.values() for s in sources_list}
-                        if not all_source_tables: continue
-                        
-                        if len(all_source_tables) > 1:
-                             st.warning(f"La trasformazione per `{struttura_table}` usa dati da più tabelle sorgente. Si assume una chiave comune implicita, il che potrebbe portare a risultati inattesi.")
-                        
-                        # In caso di unpivot, si assume una singola tabella di appoggio principale.
-                        # La logica di join per unpivot multi-tabella non è definita.
-                        source_table_name = list(all_source_tables)[0]
-                        df_appoggio_current = appoggio_dfs[source_table_name]
-                        
-                        clean_one_to_one = {dest: src.split('.')[-1] for dest, src in one_to_one_map.items()}
-                        clean_unpivot = {dest: [s.split('.')[-1] for s in src_list] for dest, src_list in unpivot_map.items()}
-
-                        user_defined_keys = unpivot_keys_config.get(struttura_table, [])
-                        key_cols_map = {k: v for k, v in clean_one_to_one.items() if k in user_defined_keys} if user_defined_keys else clean_one_to_one
-                        context_cols_map = {k: v for k, v in clean_one_to_one.items() if k not in user_defined_keys} if user_defined_keys else {}
-                            
-                        df_popolato = crea_righe_multiple(df_appoggio_current, key_cols_map, context_cols_map, clean_unpivot)
-
-                    else: # Mappatura Semplice
-                        st.info(f"Logica Rilevata: Mappatura Semplice (1-a-1) per `{struttura_table}`")
-                        
-                        max_len_df = max(appoggio_dfs.values(), key=len)
-                        df_popolato = pd.DataFrame(index=max_len_df.index, columns=dest_cols_for_this_table)
-
-                        for dest_col in dest_cols_for_this_table:
-                            sources = dest_to_sources_map.get(dest_col, [])
-                            if len(sources) == 1:
-                                source_full_path = sources[0]
-                                source_table, source_col = source_full_path.split('.', 1)
-                                
-                                if source_table in appoggio_dfs and source_col in appoggio_dfs[source_table].columns:
-                                    df_popolato[dest_col] = appoggio_dfs[source_table][source_col]
-                    
-                    # --- APPLICAZIONE CODICE STUDIO E SALVATAGGIO ---
-                    if studio_target_col and codice_studio_value and studio_target_col in df_popolato.columns:
-                        df_popolato[studio_target_col] = codice_studio_value
-                    
-                    if not df_popolato.empty:
-                        df_popolato = df_popolato.reindex(columns=dest_cols_for_this_table).fillna('')
-                        df_popolato.to_sql(struttura_table, engine, if_exists='replace', index=False)
-                        st.success(f"Tabella `{struttura_table}` popolata con successo con {len(df_popolato)} righe.")
-                        st.dataframe(df_popolato.head())
-                    else:
-                        st.warning(f"Nessun dato generato per `{struttura_table}`.")
-
-            except Exception as e: 
-                st.error(f"Errore durante il popolamento: {e}"); st.exception(e)
+    forza_ripopolamento = st.checkbox(
+        "Ricalcola tutte le tabelle", value=False, key=f'popola_forza_{mode_name}',
+        help="Normalmente vengono ricalcolate solo le tabelle i cui input (mappatura, chiavi, codice studio, dati di appoggio) sono cambiati."
+    )
+    job = jobs.ultimo(config, 'popola')
+    if st.button("APPLICA MAPPATURA E POPOLA", key=f'popola_btn_{mode_name}', disabled=job_attivo(job)):
+        avvia_job(config, 'popola', "Popolamento", popola_dati, config, engine, st.session_state.get('codice_studio_valore_sicuro', ''), forza=forza_ripopolamento)
+    mostra_job(config, job)
+
+    populated_tables = [t for t in sorted(elenca_tabelle(engine)) if t.startswith(config["db_struttura_prefix"])]
+    if populated_tables:
+        with st.expander("Sfoglia le tabelle popolate"):
+            preview_table = st.selectbox("Tabella:", populated_tables, key=f'popola_anteprima_{mode_name}')
+            mostra_anteprima_tabella(config, engine, preview_table, f'popola_anteprima_{mode_name}')
 
 def step_7_modifica_massiva(config, engine):
     mode_name = config['mode'].capitalize()
     st.header(f"Step 8: Modifica Massiva ({mode_name})")
     try:
-        inspector = inspect(engine)
-        struttura_tables = sorted([t for t in inspector.get_table_names() if t.startswith(config["db_struttura_prefix"])])
+        struttura_tables = sorted([t for t in elenca_tabelle(engine) if t.startswith(config["db_struttura_prefix"])])
         if not struttura_tables: st.warning("Nessuna tabella dati da modificare."); return
 
-        session_key_table = f'tabella_in_modifica_{mode_name}'; session_key_edits = f'mass_edits_{mode_name}'
-        if session_key_table not in st.session_state: st.session_state[session_key_table] = ""
-        
-        selected_table = st.selectbox(f"1. Seleziona tabella", [""] + struttura_tables, key=f"modifica_tabella_selector_{mode_name}")
-        if selected_table and selected_table != st.session_state.get(session_key_table):
-            if st.button(f"Prepara Modifiche per '{selected_table}'", key=f"prepare_edit_btn_{mode_name}"):
-                st.session_state[session_key_table] = selected_table
-                st.session_state[session_key_edits] = [{"col": "", "val": ""}]
-                st.rerun()
-        elif not selected_table and st.session_state.get(session_key_table):
-            st.session_state[session_key_table] = ""; st.session_state[session_key_edits] = []; st.rerun()
-        
-        active_table = st.session_state.get(session_key_table)
-        if active_table:
-            if session_key_edits not in st.session_state: st.session_state[session_key_edits] = []
-            st.markdown("---"); st.subheader(f"2. Imposta le modifiche per: `{active_table}`")
-            table_cols = [""] + list(pd.read_sql(f'SELECT * FROM "{active_table}" LIMIT 0', engine).columns)
+        session_key_edits = f'mass_edits_{mode_name}'; session_key_conditions = f'mass_conditions_{mode_name}'
+        if session_key_edits not in st.session_state: st.session_state[session_key_edits] = [{"col": "", "val": ""}]
+        if session_key_conditions not in st.session_state: st.session_state[session_key_conditions] = []
 
-            for i in range(len(st.session_state.get(session_key_edits, []))):
+        selected_tables = st.multiselect("1. Seleziona le tabelle", struttura_tables, key=f"modifica_tabelle_selector_{mode_name}")
+        if selected_tables:
+            st.markdown("---"); st.subheader("2. Imposta le modifiche")
+            # Colonne di tutte le tabelle selezionate: ogni modifica si applica alle tabelle che hanno quella colonna
+            table_cols = [""] + sorted({c for t in selected_tables for c in colonne_tabella(engine, t)})
+
+            for i in range(len(st.session_state[session_key_edits])):
                 with st.container(border=True):
                     c1, c2, c3 = st.columns([4, 4, 1])
                     edit = st.session_state[session_key_edits][i]
-                    default_col_idx = table_cols.index(edit["col"]) if "col" in edit and edit["col"] in table_cols else 0
+                    default_col_idx = table_cols.index(edit["col"]) if edit.get("col") in table_cols else 0
                     edit["col"] = c1.selectbox("Colonna", table_cols, index=default_col_idx, key=f"edit_col_{mode_name}_{i}")
                     edit["val"] = c2.text_input("Nuovo Valore", value=edit.get("val", ""), key=f"edit_val_{mode_name}_{i}")
                     if c3.button("🗑️", key=f"remove_edit_{mode_name}_{i}", help="Rimuovi"):
                         st.session_state[session_key_edits].pop(i); st.rerun()
-            
-            c_btn1, c_btn2, _ = st.columns([2, 2, 8])
+
+            st.subheader("3. Condizioni (facoltative)")
+            st.caption("Le modifiche vengono applicate solo alle righe che soddisfano tutte le condizioni. Senza condizioni si modificano tutte le righe.")
+            for i in range(len(st.session_state[session_key_conditions])):
+                with st.container(border=True):
+                    c1, c2, c3, c4 = st.columns([4, 3, 4, 1])
+                    condition = st.session_state[session_key_conditions][i]
+                    default_col_idx = table_cols.index(condition["col"]) if condition.get("col") in table_cols else 0
+                    condition["col"] = c1.selectbox("Colonna", table_cols, index=default_col_idx, key=f"cond_col_{mode_name}_{i}")
+                    condition["op"] = c2.selectbox("Operatore", OPERATORI, index=OPERATORI.index(condition.get("op", OPERATORI[0])), key=f"cond_op_{mode_name}_{i}")
+                    condition["val"] = c3.text_input("Valore", value=condition.get("val", ""), key=f"cond_val_{mode_name}_{i}",
+                                                     disabled=condition["op"] in OPERATORI_SENZA_VALORE)
+                    if c4.button("🗑️", key=f"remove_cond_{mode_name}_{i}", help="Rimuovi"):
+                        st.session_state[session_key_conditions].pop(i); st.rerun()
+
+            c_btn1, c_btn2, c_btn3, _ = st.columns([2, 2, 2, 6])
             if c_btn1.button("➕ Aggiungi modifica", key=f"add_edit_btn_{mode_name}"):
                 st.session_state[session_key_edits].append({"col": "", "val": ""}); st.rerun()
-            if c_btn2.button("✅ Applica modifiche", type="primary", key=f"apply_all_edits_btn_{mode_name}"):
+            if c_btn2.button("➕ Aggiungi condizione", key=f"add_cond_btn_{mode_name}"):
+                st.session_state[session_key_conditions].append({"col": "", "op": OPERATORI[0], "val": ""}); st.rerun()
+            if c_btn3.button("✅ Applica modifiche", type="primary", key=f"apply_all_edits_btn_{mode_name}"):
+                valid_edits = [e for e in st.session_state[session_key_edits] if e.get("col")]
+                valid_conditions = [c for c in st.session_state[session_key_conditions] if c.get("col")]
+                if not valid_edits: st.warning("Nessuna modifica valida."); st.stop()
                 with st.spinner("Applicazione..."):
-                    valid_edits = [e for e in st.session_state[session_key_edits] if e.get("col")]
-                    if not valid_edits: st.warning("Nessuna modifica valida."); st.stop()
-                    df_to_modify = pd.read_sql_table(active_table, engine)
-                    for single_edit in valid_edits: df_to_modify[single_edit["col"]] = single_edit["val"]
-                    df_to_modify.to_sql(active_table, engine, if_exists='replace', index=False)
-                    st.success(f"Tabella '{active_table}' aggiornata!"); st.rerun()
-            
-            st.markdown("---"); st.write(f"Anteprima di **{active_table}**:")
-            st.dataframe(pd.read_sql_table(active_table, engine))
+                    with operazione_esclusiva(config, "Modifica massiva"):
+                        updated, skipped = applica_modifiche(engine, selected_tables, valid_edits, valid_conditions)
+                for table_name, rows in updated.items():
+                    st.success(f"Tabella '{table_name}': {rows} righe aggiornate.")
+                for table_name in skipped:
+                    st.info(f"Tabella '{table_name}' saltata: non contiene le colonne delle modifiche o delle condizioni.")
+
+            st.markdown("---")
+            preview_table = st.selectbox("Anteprima di:", selected_tables, key=f"modifica_anteprima_{mode_name}")
+            mostra_anteprima_tabella(config, engine, preview_table, f"modifica_anteprima_{mode_name}")
     except Exception as e: st.error(f"Errore: {e}"); st.exception(e)
 
+def pulsante_download_differito(f_path, mime, key, etichetta=None):
+    """
+    Pulsante di download che legge il file solo quando l'utente lo richiede: finché non si
+    preme "Prepara", i rerun della pagina non caricano in memoria i file di export.
+    """
+    file_name = os.path.basename(f_path)
+    etichetta = etichetta or f"⬇️ Scarica {file_name}"
+    pronto_key = f"{key}_pronto"
+    # Il file preparato vale finché non viene riscritto da un nuovo export
+    versione = os.path.getmtime(f_path)
+    if st.session_state.get(pronto_key) == versione:
+        with open(f_path, 'rb') as f:
+            st.download_button(etichetta, f, file_name, mime, key=key)
+    elif st.button(f"{etichetta} ({os.path.getsize(f_path) / 1024 / 1024:.1f} MB) · Prepara", key=f"{key}_prepara"):
+        st.session_state[pronto_key] = versione
+        st.rerun()
+
+
 # SOSTITUISCI LA VECCHIA FUNZIONE CON QUESTA VERSIONE CORRETTA
 def step_8_export_globale(config, engine):
     mode_name = config['mode'].capitalize()
@@ -1068,6 +891,13 @@ def step_8_export_globale(config, engine):
     if export_state_key not in st.session_state: 
         st.session_state[export_state_key] = None
 
+    # L'export gira in background: i file dell'ultimo export completato restano disponibili anche dopo un refresh
+    job = jobs.ultimo(config, 'export')
+    seen_job_key = f'export_job_visto_{mode}'
+    if job and job["stato"] == jobs.STATO_COMPLETATO and st.session_state.get(seen_job_key) != job["id"]:
+        st.session_state[seen_job_key] = job["id"]
+        st.session_state[export_state_key] = [p for p in job["risultato"] if p] or None
+
     # --- MODIFICA 1: Sposta il checkbox qui in alto ---
     # In questo modo viene sempre visualizzato, permettendo all'utente di impostarlo
     # prima di avviare l'export o tra un export e l'altro.
@@ -1078,6 +908,12 @@ def step_8_export_globale(config, engine):
         key=f"export_remove_empty_cols_{mode}",
         help="Se selezionato, le colonne che non contengono alcun dato (oltre alle intestazioni) non verranno incluse nel file Excel finale."
     )
+    st.number_input(
+        "Processi paralleli per l'export",
+        min_value=1, max_value=os.cpu_count() or 1, value=min(4, os.cpu_count() or 1),
+        key=f"export_workers_{mode}",
+        help="Numero di tabelle esportate contemporaneamente. Con 1 l'export è sequenziale."
+    )
     st.markdown("---")
 
     # Ora gestiamo la visualizzazione dei download o del bottone di avvio
@@ -1085,29 +921,17 @@ def step_8_export_globale(config, engine):
         # --- BLOCCO VISUALIZZAZIONE DOWNLOAD (invariato) ---
         st.success(f"Export completato con successo. {len(st.session_state[export_state_key])} file sono pronti.")
         for f_path in st.session_state[export_state_key]:
-            file_name = os.path.basename(f_path)
             if os.path.exists(f_path):
-                with open(f_path, 'rb') as f:
-                    st.download_button(
-                        f"⬇️ Scarica {file_name}", 
-                        f.read(), 
-                        file_name, 
-                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
-                        key=f"dl_{file_name}_{mode}"
-                    )
+                pulsante_download_differito(f_path, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", f"dl_{os.path.basename(f_path)}_{mode}")
             else:
-                st.error(f"File di export '{file_name}' non trovato. Riprova l'export.")
-        
-        if len(st.session_state[export_state_key]) > 1:
+                st.error(f"File di export '{os.path.basename(f_path)}' non trovato. Riprova l'export.")
+
+        # L'archivio ZIP è scritto su disco dal job di export (vedi src/export_bundle.py)
+        zip_path = percorso_zip(config["export_dir"], mode)
+        if len(st.session_state[export_state_key]) > 1 and os.path.exists(zip_path):
             st.markdown("---")
-            with st.spinner("Creazione Archivio ZIP..."):
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, "w") as zipf:
-                    for f_path in st.session_state[export_state_key]:
-                        if os.path.exists(f_path): 
-                            zipf.write(f_path, arcname=os.path.basename(f_path))
-                st.download_button("📦 Scarica tutto (ZIP)", zip_buffer.getvalue(), f"export_{mode}.zip", "application/zip", key=f"dl_zip_btn_{mode}")
-                
+            pulsante_download_differito(zip_path, "application/zip", f"dl_zip_btn_{mode}", etichetta="📦 Scarica tutto (ZIP)")
+
         st.markdown("---")
         if st.button("Esegui un nuovo export", key=f"clear_export_btn_{mode}"):
             st.session_state[export_state_key] = None
@@ -1116,78 +940,12 @@ def step_8_export_globale(config, engine):
     else:
         # --- BLOCCO AVVIO EXPORT ---
         # Il checkbox è già stato disegnato sopra, qui mettiamo solo il bottone
-        if st.button("AVVIA EXPORT FINALE", key=f'start_final_export_btn_{mode}', type="primary"):
-            with st.spinner("Creazione file in corso..."):
-                try:
-                    # --- La logica interna rimane la stessa ---
-                    date_format_path = os.path.join(config["mapping_dir"], "date_columns.json"); colonne_data = []
-                    if os.path.exists(date_format_path):
-                        with open(date_format_path, 'r', encoding='utf-8') as f: 
-                            colonne_data = json.load(f).get("date_columns", [])
-                    
-                    inspector = inspect(engine)
-                    struttura_tables = [t for t in inspector.get_table_names() if t.startswith(config["db_struttura_prefix"])]
-                    if not struttura_tables: 
-                        st.warning("Nessuna tabella dati da esportare trovata.")
-                        st.stop()
-
-                    generated_paths = []
-                    # Nessuna esclusione implicita per cognome/nome. Verranno rimosse se vuote.
-
-                    for struttura_table in struttura_tables:
-                        base_name = struttura_table.replace(config["db_struttura_prefix"], '')
-                        st.write(f"Elaborazione di `{base_name}`...")
-
-                        header_map_path = os.path.join(config["mapping_dir"], f"{struttura_table}_headers.json"); header_map = {}
-                        if os.path.exists(header_map_path):
-                            with open(header_map_path, 'r', encoding='utf-8') as f: header_map = json.load(f)
-                        else:
-                            st.error(f"Mappa intestazioni per {struttura_table} non trovata."); continue
-
-                        df_to_export = pd.read_sql_table(struttura_table, engine)
-                        
-                        df_final_for_export = df_to_export.copy()
-                        if st.session_state.get(f"export_remove_empty_cols_{mode}", False):
-                            if not df_to_export.empty:
-                                cols_to_drop = [
-                                    col for col in df_to_export.columns 
-                                    if df_to_export[col].astype(str).str.strip().eq('').all()
-                                ]
-                                
-                                if cols_to_drop:
-                                    df_final_for_export = df_to_export.drop(columns=cols_to_drop)
-                                    st.info(f"In '{base_name}', rimosse {len(cols_to_drop)} colonne completamente vuote.")
-                            else:
-                                st.warning(f"La tabella '{base_name}' è vuota, l'export per questo file sarà vuoto.")
-                        
-                        for col in colonne_data:
-                            if col in df_final_for_export.columns:
-                                df_final_for_export[col] = pd.to_datetime(df_final_for_export[col], errors='coerce').dt.strftime('%d/%m/%Y').fillna('')
-                        
-                        dest_cols = list(df_final_for_export.columns)
-                        numeric_headers_row = [header_map.get(col, '') for col in dest_cols]
-                        
-                        wb_export = openpyxl.Workbook()
-                        ws_export = wb_export.active
-                        
-                        ws_export.append(["Non modificare questa riga", base_name.upper()])
-                        ws_export.append(["Non modificare questa riga"] + numeric_headers_row)
-                        ws_export.append(["Non modificare questa riga"] + dest_cols)
-                        
-                        for row_data_tuple in df_final_for_export.itertuples(index=False, name=None):
-                            ws_export.append([""] + list(row_data_tuple))
-
-                        export_file_name = f"{base_name}_Export.xlsx"
-                        export_file_path = os.path.join(config["export_dir"], export_file_name)
-                        wb_export.save(export_file_path)
-                        generated_paths.append(export_file_path)
-                        st.success(f"File '{export_file_name}' salvato in: `{export_file_path}`") # Messaggio di debug più chiaro
-
-                    st.session_state[export_state_key] = generated_paths
-                    st.rerun()
-
-                except Exception as e:
-                    st.error(f"Errore durante l'export: {e}"); st.exception(e)
+        if st.button("AVVIA EXPORT FINALE", key=f'start_final_export_btn_{mode}', type="primary", disabled=job_attivo(job)):
+            avvia_job(
+                config, 'export', "Export", esporta, config, engine, st.session_state.get(f"export_remove_empty_cols_{mode}", False),
+                workers=st.session_state.get(f"export_workers_{mode}", 1)
+            )
+        mostra_job(config, job)
 
 # --- GESTIONE WIZARD E UI ---
 st.title('Importazione e Mappatura Dati')
@@ -1213,6 +971,17 @@ st.sidebar.radio(
 )
 
 config = get_current_config()
+try:
+    # Ogni modalità/studio ha il proprio database; l'engine è condiviso tra rerun e sessioni (vedi src/db.py)
+    engine = get_engine(config["db_path"])
+except Exception as e:
+    st.error(f"Errore critico nel motore del database: {e}"); st.stop()
+
+# Operazioni in corso sul database dello studio da parte di altre sessioni
+lock_status = lock_per(config).stato()
+if lock_status["scrittore"] or lock_status["coda"]:
+    st.sidebar.info(f"🔒 {descrivi_stato(lock_status)}")
+
 # NUOVO BLOCCO PIÙ SICURO
 try:
     # Tentiamo di eseguire lo step corrente
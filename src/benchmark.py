@@ -0,0 +1,214 @@
+"""
+Benchmark delle fasi di scrittura su database, sui dati di esempio del progetto.
+
+    python -m src.benchmark engine --mode dipendente
+    python -m src.benchmark storage --mode dipendente
+    python -m src.benchmark bulk --righe 1000000
+    python -m src.benchmark memoria --righe 1000000
+
+Ogni variante lavora su un database e una copia della mappatura in una cartella
+temporanea, quindi i file del progetto non vengono modificati. La cache di parsing
+viene popolata prima delle misure, così i tempi riflettono le scritture su SQLite e
+non la lettura dei file Excel. I benchmark `bulk` e `memoria` usano invece una tabella
+di appoggio sintetica (colonne di testo, come quelle lette dai file Excel).
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from src.bulk_writer import scrivi_tabella
+from src.column_encoding import leggi_tabella, scrivi_tabella_codificata
+from src.db import get_engine, scrittura_massiva
+from src.pipeline import BASE_DIR, esegui_pipeline, get_config
+from src.storage import BACKENDS
+
+FASI_SCRITTURA = ['import_struttura', 'import_appoggio', 'popola']
+
+
+def _log_silenzioso(livello, messaggio):
+    pass
+
+
+def _config_temporanea(mode, codice_studio, base_dir, mapping_dir, cartella):
+    """Config che legge i dati del progetto ma scrive mappatura ed export nella cartella temporanea."""
+    config = get_config(mode, codice_studio or None, base_dir, mapping_dir)
+    mapping_tmp = os.path.join(cartella, 'mapping')
+    shutil.copytree(config["mapping_dir"], mapping_tmp, dirs_exist_ok=True)
+    config["mapping_dir"] = mapping_tmp
+    config["export_dir"] = os.path.join(cartella, 'export')
+    return config
+
+
+def _misura(config, engine, codice_studio, ripetizioni):
+    """Tempo minimo per fase su più ripetizioni (popolamento forzato ad ogni giro)."""
+    migliori = {}
+    for _ in range(ripetizioni):
+        tempi = esegui_pipeline(config, engine, codice_studio, FASI_SCRITTURA, forza=True, log=_log_silenzioso)
+        for fase, secondi in tempi.items():
+            migliori[fase] = min(secondi, migliori.get(fase, secondi))
+    return migliori
+
+
+def _stampa_confronto(titoli, risultati):
+    fasi = list(risultati[0])
+    print(f"{'fase':<20}" + ''.join(f"{t:>14}" for t in titoli) + f"{'risparmio':>12}")
+    for fase in fasi + ['totale']:
+        valori = [sum(r.values()) if fase == 'totale' else r[fase] for r in risultati]
+        risparmio = (1 - valori[-1] / valori[0]) * 100 if valori[0] else 0.0
+        print(f"{fase:<20}" + ''.join(f"{v:>13.3f}s" for v in valori) + f"{risparmio:>11.1f}%")
+
+
+def benchmark_engine(mode, codice_studio='', base_dir=BASE_DIR, mapping_dir=None, ripetizioni=3):
+    """Confronta un engine SQLite non configurato con quello condiviso di src/db.py."""
+    with tempfile.TemporaryDirectory() as cartella:
+        config = _config_temporanea(mode, codice_studio, base_dir, mapping_dir, cartella)
+        engine_standard = create_engine(f"sqlite:///{os.path.join(cartella, 'standard.sqlite')}")
+        engine_ottimizzato = get_engine(os.path.join(cartella, 'ottimizzato.sqlite'))
+        # Riscaldamento: popola la cache di parsing dei file Excel
+        esegui_pipeline(config, engine_standard, codice_studio, FASI_SCRITTURA, forza=True, log=_log_silenzioso)
+
+        risultati = [_misura(config, engine, codice_studio, ripetizioni) for engine in (engine_standard, engine_ottimizzato)]
+        engine_standard.dispose()
+        engine_ottimizzato.dispose()
+    _stampa_confronto(['standard', 'ottimizzato'], risultati)
+    return risultati
+
+
+def benchmark_storage(mode, codice_studio='', base_dir=BASE_DIR, mapping_dir=None, ripetizioni=3):
+    """Confronta i backend dei dati di appoggio (src/storage.py) su import e popolamento dei dati di esempio."""
+    with tempfile.TemporaryDirectory() as cartella:
+        config = _config_temporanea(mode, codice_studio, base_dir, mapping_dir, cartella)
+        risultati = []
+        for backend in BACKENDS:
+            config["storage"] = backend
+            engine = get_engine(os.path.join(cartella, f'{backend}.sqlite'))
+            # Riscaldamento: popola la cache di parsing dei file Excel
+            esegui_pipeline(config, engine, codice_studio, FASI_SCRITTURA, forza=True, log=_log_silenzioso)
+            risultati.append(_misura(config, engine, codice_studio, ripetizioni))
+            engine.dispose()
+    _stampa_confronto(BACKENDS, risultati)
+    return risultati
+
+
+def appoggio_sintetico(righe, colonne=20, seed=0):
+    """Tabella di appoggio sintetica: solo testo, con codici, nomi, importi e date come stringhe."""
+    rng = np.random.default_rng(seed)
+    dati = {}
+    for i in range(colonne):
+        tipo = i % 4
+        if tipo == 0:
+            valori = rng.integers(0, 100000, righe).astype(str)
+        elif tipo == 1:
+            valori = np.char.add('NOME_', rng.integers(0, 5000, righe).astype(str))
+        elif tipo == 2:
+            valori = np.char.add(rng.integers(0, 10000, righe).astype(str), ',50')
+        else:
+            valori = np.char.add('01/01/', rng.integers(1950, 2025, righe).astype(str))
+        dati[f"colonna_{i}"] = valori.astype(object)
+    return pd.DataFrame(dati)
+
+
+def _scrivi_to_sql(engine, tabella, df):
+    with scrittura_massiva(engine) as connessione:
+        df.to_sql(tabella, connessione, if_exists='replace', index=False)
+
+
+def benchmark_bulk(righe=1_000_000, colonne=20, ripetizioni=1):
+    """Righe al secondo di DataFrame.to_sql contro src/bulk_writer.py, sull'engine configurato di src/db.py."""
+    df = appoggio_sintetico(righe, colonne)
+    varianti = [
+        ('to_sql', _scrivi_to_sql),
+        ('bulk_writer', lambda engine, tabella, df: scrivi_tabella(engine, tabella, df, staging=False)),
+        ('bulk_writer+staging', scrivi_tabella),
+    ]
+    risultati = {}
+    with tempfile.TemporaryDirectory() as cartella:
+        engine = get_engine(os.path.join(cartella, 'bulk.sqlite'))
+        for nome, scrivi in varianti:
+            migliore = None
+            for _ in range(ripetizioni):
+                inizio = time.perf_counter()
+                scrivi(engine, 'appoggio_sintetico', df)
+                trascorsi = time.perf_counter() - inizio
+                migliore = trascorsi if migliore is None else min(migliore, trascorsi)
+            risultati[nome] = migliore
+        engine.dispose()
+
+    print(f"{righe} righe x {colonne} colonne")
+    print(f"{'variante':<22}{'tempo':>10}{'righe/s':>14}{'rapporto':>10}")
+    for nome, secondi in risultati.items():
+        print(f"{nome:<22}{secondi:>9.2f}s{righe / secondi:>14,.0f}{risultati['to_sql'] / secondi:>9.1f}x")
+    return risultati
+
+
+def benchmark_memoria(righe=1_000_000, colonne=20):
+    """Memoria e tempo di lettura della tabella di appoggio per il popolamento: tutto testo contro colonne codificate."""
+    df = appoggio_sintetico(righe, colonne)
+    with tempfile.TemporaryDirectory() as cartella:
+        engine = get_engine(os.path.join(cartella, 'memoria.sqlite'))
+        scrivi_tabella(engine, 'testo', df)
+        codifiche = scrivi_tabella_codificata(engine, 'codificata', df)
+        varianti = [
+            ('testo', lambda: pd.read_sql_table('testo', engine).astype(str)),
+            ('codificata', lambda: leggi_tabella(engine, 'codificata')),
+        ]
+        risultati = {}
+        for nome, leggi in varianti:
+            inizio = time.perf_counter()
+            letto = leggi()
+            risultati[nome] = (time.perf_counter() - inizio, letto.memory_usage(deep=True).sum())
+            if nome == 'codificata' and not all((letto[c].astype(object) == df[c]).all() for c in df.columns):
+                raise AssertionError("La tabella codificata non restituisce le stringhe originali")
+        engine.dispose()
+
+    print(f"{righe} righe x {colonne} colonne; codifiche: " + ', '.join(f"{c} {n}" for c, n in pd.Series(codifiche).value_counts().items()))
+    print(f"{'variante':<14}{'lettura':>10}{'memoria':>12}{'rapporto':>10}")
+    for nome, (secondi, byte) in risultati.items():
+        print(f"{nome:<14}{secondi:>9.2f}s{byte / 1e6:>10.0f}MB{risultati['testo'][1] / byte:>9.1f}x")
+    return risultati
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark delle scritture su database con i dati di esempio.")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+    p_engine = sub.add_parser('engine', help="Engine SQLite standard contro engine configurato (WAL, scrittura massiva)")
+    p_engine.add_argument('--mode', default='dipendente', choices=['ditta', 'dipendente'], help="Tipo di anagrafica")
+    p_engine.add_argument('--studio', default='', help="Codice studio (3 caratteri)")
+    p_engine.add_argument('--base-dir', default=BASE_DIR, help="Cartella principale del progetto (data/, mapping/)")
+    p_engine.add_argument('--mapping-dir', default=None, help="Cartella con la mappatura (default: mapping/<mode>/<studio>)")
+    p_engine.add_argument('--ripetizioni', type=int, default=3, help="Ripetizioni per variante (si tiene il tempo minimo)")
+    p_storage = sub.add_parser('storage', help="Dati di appoggio in SQLite contro Parquet (src/storage.py)")
+    p_storage.add_argument('--mode', default='dipendente', choices=['ditta', 'dipendente'], help="Tipo di anagrafica")
+    p_storage.add_argument('--studio', default='', help="Codice studio (3 caratteri)")
+    p_storage.add_argument('--base-dir', default=BASE_DIR, help="Cartella principale del progetto (data/, mapping/)")
+    p_storage.add_argument('--mapping-dir', default=None, help="Cartella con la mappatura (default: mapping/<mode>/<studio>)")
+    p_storage.add_argument('--ripetizioni', type=int, default=3, help="Ripetizioni per variante (si tiene il tempo minimo)")
+    p_bulk = sub.add_parser('bulk', help="DataFrame.to_sql contro la scrittura a blocchi di src/bulk_writer.py")
+    p_bulk.add_argument('--righe', type=int, default=1_000_000, help="Righe della tabella di appoggio sintetica")
+    p_bulk.add_argument('--colonne', type=int, default=20, help="Colonne della tabella di appoggio sintetica")
+    p_bulk.add_argument('--ripetizioni', type=int, default=1, help="Ripetizioni per variante (si tiene il tempo minimo)")
+    p_memoria = sub.add_parser('memoria', help="Memoria delle tabelle di appoggio lette come testo contro codificate (src/column_encoding.py)")
+    p_memoria.add_argument('--righe', type=int, default=1_000_000, help="Righe della tabella di appoggio sintetica")
+    p_memoria.add_argument('--colonne', type=int, default=20, help="Colonne della tabella di appoggio sintetica")
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'engine':
+        benchmark_engine(args.mode, args.studio.strip().upper(), args.base_dir, args.mapping_dir, args.ripetizioni)
+    elif args.benchmark == 'storage':
+        benchmark_storage(args.mode, args.studio.strip().upper(), args.base_dir, args.mapping_dir, args.ripetizioni)
+    elif args.benchmark == 'bulk':
+        benchmark_bulk(args.righe, args.colonne, args.ripetizioni)
+    elif args.benchmark == 'memoria':
+        benchmark_memoria(args.righe, args.colonne)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Scrittura veloce di un DataFrame in una tabella SQLite, in sostituzione di
+`DataFrame.to_sql(..., if_exists='replace', index=False)`.
+
+I dati vengono convertiti una volta per colonna in valori Python e inseriti con
+`executemany` a blocchi, tutti nella stessa transazione esplicita (il driver sqlite3
+non aprirebbe la transazione prima delle istruzioni DDL). Con `staging=True` la nuova
+tabella viene scritta accanto a quella esistente e sostituita solo alla fine con
+DROP + RENAME: fino al commit chi legge continua a vedere la tabella precedente, e un
+errore a metà lascia la tabella originale intatta.
+"""
+import itertools
+
+import pandas as pd
+
+from src.db import identificatore, scrittura_massiva
+
+DIMENSIONE_BLOCCO = 50000
+SUFFISSO_STAGING = '__staging'
+
+
+def _tipo_sql(serie):
+    """Tipo della colonna come in to_sql: i testi restano TEXT, i numeri INTEGER/REAL."""
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_integer_dtype(serie):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(serie):
+        return 'REAL'
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+
+def _valori_colonna(serie):
+    """Valori della colonna come oggetti Python accettati da sqlite3 (None al posto di NaN/NaT)."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        serie = serie.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    valori = serie.astype(object)
+    if serie.hasnans:
+        valori = valori.where(serie.notna(), None)
+    return valori.tolist()
+
+
+def _scrivi(connessione, tabella, df, dimensione_blocco, staging, prima_del_commit):
+    if not connessione.connection.driver_connection.in_transaction:
+        connessione.exec_driver_sql("BEGIN")
+    destinazione = f"{tabella}{SUFFISSO_STAGING}" if staging else tabella
+    colonne = ', '.join(f"{identificatore(c)} {_tipo_sql(df.iloc[:, i])}" for i, c in enumerate(df.columns))
+    connessione.exec_driver_sql(f"DROP TABLE IF EXISTS {identificatore(destinazione)}")
+    connessione.exec_driver_sql(f"CREATE TABLE {identificatore(destinazione)} ({colonne})")
+
+    if len(df) and len(df.columns):
+        insert = f"INSERT INTO {identificatore(destinazione)} VALUES ({', '.join('?' * len(df.columns))})"
+        righe = zip(*(_valori_colonna(df.iloc[:, i]) for i in range(len(df.columns))))
+        while True:
+            blocco = list(itertools.islice(righe, dimensione_blocco))
+            if not blocco:
+                break
+            connessione.exec_driver_sql(insert, blocco)
+
+    if staging:
+        connessione.exec_driver_sql(f"DROP TABLE IF EXISTS {identificatore(tabella)}")
+        connessione.exec_driver_sql(f"ALTER TABLE {identificatore(destinazione)} RENAME TO {identificatore(tabella)}")
+    if prima_del_commit:
+        prima_del_commit(connessione)
+    connessione.commit()
+
+
+def scrivi_tabella(engine, tabella, df, dimensione_blocco=DIMENSIONE_BLOCCO, staging=True, prima_del_commit=None):
+    """
+    Sostituisce la tabella con il contenuto del DataFrame (senza indice) in un'unica transazione.
+    Usa la connessione di `scrittura_massiva`; restituisce il numero di righe scritte.
+    `prima_del_commit(connessione)` può aggiungere altre istruzioni alla stessa transazione.
+    """
+    with scrittura_massiva(engine) as connessione:
+        try:
+            _scrivi(connessione, tabella, df, dimensione_blocco, staging, prima_del_commit)
+        except BaseException:
+            connessione.rollback()
+            raise
+    return len(df)
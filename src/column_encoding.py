@@ -0,0 +1,199 @@
+"""
+Codifica compatta delle colonne delle tabelle di appoggio.
+
+I file di appoggio sono letti come testo (`dtype=str`), quindi ogni cella diventa una
+stringa Python distinta anche quando la colonna contiene pochi valori ripetuti (codice
+azienda, qualifica, CCNL). All'import ogni colonna viene profilata e salvata con la
+codifica più compatta che permette di riottenere esattamente le stringhe originali:
+
+- `intero`: interi in forma canonica (senza zeri iniziali né segno +), salvati come INTEGER;
+- `data`: date nel formato con cui le scrive la lettura Excel, salvate come secondi (INTEGER);
+- `dizionario`: testi con pochi valori distinti, salvati come codice INTEGER nel dizionario;
+- `testo`: tutto il resto, salvato così com'è.
+
+Nelle codifiche intero e data la cella vuota ('') è salvata come NULL; nel dizionario
+'' è un valore come gli altri, con il suo codice. Le codifiche sono
+registrate in una tabella di servizio dello stesso database, scritta nella stessa
+transazione della tabella. In lettura le colonne codificate diventano Categorical di
+pandas: ogni valore distinto esiste una sola volta in memoria e le celle sono codici interi.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.bulk_writer import scrivi_tabella
+from src.db import identificatore
+
+TABELLA_CODIFICHE = '_codifiche_colonne'
+
+CODIFICA_TESTO = 'testo'
+CODIFICA_INTERO = 'intero'
+CODIFICA_DATA = 'data'
+CODIFICA_DIZIONARIO = 'dizionario'
+
+# Interi che tornano identici con str(int(valore)) e stanno in un INTEGER di SQLite
+_REGEX_INTERO = r'0|-?[1-9][0-9]{0,17}'
+# Formati delle date lette da Excel con dtype=str
+FORMATI_DATA = {
+    '%Y-%m-%d %H:%M:%S': r'[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}',
+    '%Y-%m-%d': r'[0-9]{4}-[0-9]{2}-[0-9]{2}',
+}
+# Dizionario solo se i valori distinti sono al massimo questa frazione delle righe
+SOGLIA_DIZIONARIO = 0.5
+MAX_VALORI_DIZIONARIO = 65536
+
+_EPOCA = pd.Timestamp('1970-01-01')
+_BLOCCO_LETTURA = 50000
+
+
+def _crea_tabella_codifiche(connection):
+    connection.exec_driver_sql(
+        f'CREATE TABLE IF NOT EXISTS "{TABELLA_CODIFICHE}" '
+        '(tabella TEXT NOT NULL, colonna TEXT NOT NULL, codifica TEXT NOT NULL, parametro TEXT, PRIMARY KEY (tabella, colonna))'
+    )
+
+
+def _secondi(valori, formato):
+    """Secondi dall'epoca delle date (NaN dove la stringa non è una data nel formato)."""
+    date = pd.to_datetime(valori, format=formato, errors='coerce')
+    return (date - _EPOCA) // pd.Timedelta(seconds=1)
+
+
+def profila_colonna(valori):
+    """
+    Sceglie la codifica di una colonna di stringhe. Restituisce (codifica, parametro):
+    il formato per le date, la lista dei valori per il dizionario, altrimenti None.
+    """
+    serie = pd.Series(valori, dtype=object)
+    if len(serie) == 0 or pd.api.types.infer_dtype(serie, skipna=False) != 'string':
+        return CODIFICA_TESTO, None
+    pieni = serie[serie != '']
+
+    if len(pieni):
+        if pieni.str.fullmatch(_REGEX_INTERO).all():
+            return CODIFICA_INTERO, None
+        for formato, regex in FORMATI_DATA.items():
+            if not pieni.str.fullmatch(regex).all():
+                continue
+            secondi = _secondi(pieni, formato)
+            if secondi.notna().all() and (pd.to_datetime(secondi, unit='s').dt.strftime(formato) == pieni).all():
+                return CODIFICA_DATA, formato
+
+    distinti = serie.unique()
+    if len(distinti) <= min(MAX_VALORI_DIZIONARIO, max(1, len(serie) * SOGLIA_DIZIONARIO)):
+        return CODIFICA_DIZIONARIO, sorted(distinti)
+    return CODIFICA_TESTO, None
+
+
+def codifica_colonna(valori, codifica, parametro):
+    """Valori da salvare su SQLite per la codifica scelta (per intero e data Int64 con NULL al posto di '')."""
+    serie = pd.Series(valori, dtype=object)
+    if codifica == CODIFICA_INTERO:
+        return pd.array([int(v) if v != '' else None for v in serie], dtype='Int64')
+    if codifica == CODIFICA_DATA:
+        secondi = _secondi(serie.where(serie != ''), parametro)
+        return pd.array(secondi, dtype='Int64')
+    if codifica == CODIFICA_DIZIONARIO:
+        return pd.Index(parametro).get_indexer(serie)
+    return serie
+
+
+def scrivi_tabella_codificata(engine, tabella, df):
+    """
+    Profila e codifica le colonne di `df` (stringhe) e scrive tabella e codifiche in un'unica
+    transazione (vedi src/bulk_writer.py). Restituisce {colonna: codifica}.
+    """
+    codifiche = {colonna: profila_colonna(df[colonna]) for colonna in df.columns}
+    codificato = pd.DataFrame(
+        {colonna: codifica_colonna(df[colonna], *codifiche[colonna]) for colonna in df.columns},
+        index=df.index,
+    )
+
+    scrivi_tabella(engine, tabella, codificato, prima_del_commit=lambda connessione: salva_codifiche(connessione, tabella, codifiche))
+    return {colonna: codifica for colonna, (codifica, _) in codifiche.items()}
+
+
+def salva_codifiche(connessione, tabella, codifiche):
+    """Sostituisce le codifiche della tabella, nella transazione della connessione indicata."""
+    _crea_tabella_codifiche(connessione)
+    connessione.exec_driver_sql(f'DELETE FROM "{TABELLA_CODIFICHE}" WHERE tabella = ?', (tabella,))
+    if codifiche:
+        connessione.exec_driver_sql(
+            f'INSERT INTO "{TABELLA_CODIFICHE}" (tabella, colonna, codifica, parametro) VALUES (?, ?, ?, ?)',
+            [(tabella, colonna, codifica, json.dumps(parametro, ensure_ascii=False)) for colonna, (codifica, parametro) in codifiche.items()],
+        )
+
+
+def leggi_codifiche(engine, tabella):
+    """{colonna: (codifica, parametro)} salvate per la tabella (vuoto per tabelle non codificate)."""
+    with engine.begin() as connection:
+        _crea_tabella_codifiche(connection)
+        righe = connection.execute(
+            text(f'SELECT colonna, codifica, parametro FROM "{TABELLA_CODIFICHE}" WHERE tabella = :t'), {"t": tabella}
+        ).fetchall()
+    return {colonna: (codifica, json.loads(parametro) if parametro else None) for colonna, codifica, parametro in righe}
+
+
+def elimina_codifiche(engine, tabelle):
+    """Cancella le codifiche delle tabelle indicate (es. quando vengono eliminate prima di un nuovo import)."""
+    if not tabelle:
+        return
+    with engine.begin() as connection:
+        _crea_tabella_codifiche(connection)
+        for tabella in tabelle:
+            connection.execute(text(f'DELETE FROM "{TABELLA_CODIFICHE}" WHERE tabella = :t'), {"t": tabella})
+
+
+def _categorie_da_numeri(numeri, decodifica):
+    """Categorical di stringhe da un array Int64: i valori distinti vengono convertiti una sola volta, NULL → ''."""
+    codici, distinti = pd.factorize(numeri, use_na_sentinel=True)
+    categorie = list(decodifica(distinti))
+    if (codici < 0).any():
+        codici = np.where(codici < 0, len(categorie), codici)
+        categorie.append('')
+    return pd.Categorical.from_codes(codici, categorie)
+
+
+def _decodifica(blocchi, codifica, parametro):
+    if codifica == CODIFICA_DIZIONARIO:
+        codici = np.concatenate([np.asarray(b, dtype=np.int64) for b in blocchi]) if blocchi else np.empty(0, dtype=np.int64)
+        return pd.Categorical.from_codes(codici, parametro)
+    if codifica in (CODIFICA_INTERO, CODIFICA_DATA):
+        numeri = pd.array([v for b in blocchi for v in b], dtype='Int64')
+        if codifica == CODIFICA_INTERO:
+            return _categorie_da_numeri(numeri, lambda distinti: [str(v) for v in distinti])
+        return _categorie_da_numeri(numeri, lambda distinti: pd.to_datetime(np.asarray(distinti, dtype=np.int64), unit='s').strftime(parametro))
+    # Testo o colonna senza codifica (tabella importata prima delle codifiche): come read_sql_table(...).astype(str)
+    return pd.Series([v for b in blocchi for v in b], dtype=object).astype(str).to_numpy()
+
+
+def leggi_tabella(engine, tabella, colonne=None, codifiche=None):
+    """
+    Legge una tabella scritta con `scrivi_tabella_codificata` riportando ogni colonna alle stringhe
+    originali: le colonne codificate come Categorical, le altre come stringhe (object).
+    Con `colonne` vengono lette solo le colonne indicate (anche nessuna: resta il numero di righe).
+    """
+    if codifiche is None:
+        codifiche = leggi_codifiche(engine, tabella)
+    if colonne is not None and not colonne:
+        with engine.connect() as connection:
+            righe = connection.exec_driver_sql(f'SELECT COUNT(*) FROM {identificatore(tabella)}').scalar()
+        return pd.DataFrame(index=pd.RangeIndex(righe))
+    selezione = ', '.join(identificatore(c) for c in colonne) if colonne is not None else '*'
+    with engine.connect() as connection:
+        cursore = connection.exec_driver_sql(f'SELECT {selezione} FROM {identificatore(tabella)}')
+        colonne = list(cursore.keys())
+        blocchi = {colonna: [] for colonna in colonne}
+        while True:
+            righe = cursore.fetchmany(_BLOCCO_LETTURA)
+            if not righe:
+                break
+            for colonna, valori in zip(colonne, zip(*righe)):
+                blocchi[colonna].append(valori)
+    dati = {
+        colonna: _decodifica(blocchi.pop(colonna), *codifiche.get(colonna, (CODIFICA_TESTO, None)))
+        for colonna in colonne
+    }
+    return pd.DataFrame(dati, columns=colonne)
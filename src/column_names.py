@@ -0,0 +1,19 @@
+"""
+Nomi delle colonne come vengono salvati nel database.
+
+Modulo senza dipendenze, usato dall'import (src/pipeline.py) e dai suggerimenti di
+mappatura (src/mapping_suggest.py), che devono sanificare i nomi allo stesso modo.
+"""
+import unicodedata
+
+
+def sanitize_column_name(col_name):
+    """
+    Pulisce aggressivamente il nome di una colonna:
+    - Rimuove accenti e caratteri speciali.
+    - Converte in minuscolo.
+    - Sostituisce spazi e punteggiatura con un singolo trattino basso.
+    """
+    s = ''.join(c for c in unicodedata.normalize('NFD', str(col_name)) if unicodedata.category(c) != 'Mn')
+    s = ''.join(c if c.isalnum() else ' ' for c in s.lower())
+    return '_'.join(s.split())
@@ -0,0 +1,103 @@
+"""
+Normalizzazione delle colonne data per l'export (gg/mm/aaaa).
+
+`pd.to_datetime` senza formato deduce il formato dal primo valore e legge le date
+gg/mm/aaaa come mese/giorno ('01/02/2020' diventa il 2 gennaio, '13/02/2020' non è
+valida). Qui il formato di ogni colonna viene riconosciuto una volta su un campione di
+valori, provando i formati noti con i formati italiani (giorno prima del mese) favoriti
+a parità di valori riconosciuti. La colonna viene poi convertita con quel formato
+esatto in un'unica passata vettoriale.
+
+I formati riconosciuti vengono conservati per colonna nell'oggetto `FormatiColonne`,
+che l'export usa per tutti i blocchi della tabella. Se in un blocco successivo
+compaiono valori in un formato nuovo, solo quei valori vengono analizzati e il formato
+si aggiunge a quelli della colonna. I valori che nessun formato noto riconosce passano
+per `pd.to_datetime` valore per valore. Ogni valore distinto viene convertito una volta sola.
+"""
+import numpy as np
+import pandas as pd
+
+FORMATO_USCITA = '%d/%m/%Y'
+
+# Formati provati, in ordine di preferenza a parità di valori riconosciuti
+FORMATI_NOTI = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d',
+    '%d/%m/%Y',
+    '%d/%m/%Y %H:%M:%S',
+    '%d-%m-%Y',
+    '%d.%m.%Y',
+    '%d/%m/%y',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y%m%d',
+    '%m/%d/%Y',
+]
+DIMENSIONE_CAMPIONE = 1000
+
+
+def rileva_formati(valori, dimensione_campione=DIMENSIONE_CAMPIONE):
+    """
+    Formati che riconoscono almeno un valore del campione (valori non vuoti), dal più al meno
+    efficace; a parità di valori riconosciuti vale l'ordine di FORMATI_NOTI.
+    """
+    campione = pd.Series(valori, dtype=object).dropna().astype(str).str.strip()
+    campione = campione[campione != ''].drop_duplicates().head(dimensione_campione)
+    if campione.empty:
+        return []
+    riconosciuti = {
+        formato: int(pd.to_datetime(campione, format=formato, errors='coerce').notna().sum())
+        for formato in FORMATI_NOTI
+    }
+    return sorted((f for f, n in riconosciuti.items() if n), key=lambda f: -riconosciuti[f])
+
+
+def converti(valori, formati, formato_uscita=FORMATO_USCITA):
+    """
+    Converte i valori applicando i formati nell'ordine: ogni formato legge solo i valori non
+    ancora riconosciuti. Restituisce (Serie formattata, maschera dei valori non vuoti non riconosciuti);
+    i valori non riconosciuti e vuoti diventano ''.
+    """
+    testo = pd.Series(valori, dtype=object).astype(str).str.strip()
+    date = pd.Series(pd.NaT, index=testo.index, dtype='datetime64[ns]')
+    da_leggere = (testo != '') & pd.Series(valori, dtype=object).notna().to_numpy()
+    for formato in formati:
+        if not da_leggere.any():
+            break
+        lette = pd.to_datetime(testo[da_leggere], format=formato, errors='coerce')
+        lette = lette[lette.notna()]
+        date.loc[lette.index] = lette
+        da_leggere.loc[lette.index] = False
+    return date.dt.strftime(formato_uscita).fillna(''), da_leggere
+
+
+class FormatiColonne:
+    """Formati riconosciuti per ogni colonna di una tabella, condivisi tra i blocchi dell'export."""
+
+    def __init__(self):
+        self.formati = {}
+
+    def _normalizza_distinti(self, colonna, valori, formato_uscita):
+        if colonna not in self.formati:
+            self.formati[colonna] = rileva_formati(valori)
+        risultato, non_riconosciuti = converti(valori, self.formati[colonna], formato_uscita)
+        if non_riconosciuti.any():
+            # Formato non visto nel campione iniziale: si analizzano solo i valori rimasti
+            nuovi = [f for f in rileva_formati(valori[non_riconosciuti]) if f not in self.formati[colonna]]
+            if nuovi:
+                self.formati[colonna].extend(nuovi)
+                risultato, non_riconosciuti = converti(valori, self.formati[colonna], formato_uscita)
+        if non_riconosciuti.any():
+            risultato[non_riconosciuti] = pd.to_datetime(valori[non_riconosciuti], format='mixed', errors='coerce').dt.strftime(formato_uscita).fillna('').to_numpy()
+        return risultato.to_numpy(dtype=object)
+
+    def normalizza(self, colonna, valori, formato_uscita=FORMATO_USCITA):
+        """Valori della colonna come gg/mm/aaaa ('' per i valori vuoti o non riconosciuti)."""
+        serie = pd.Series(valori, dtype=object)
+        # Le date si ripetono molto: si convertono solo i valori distinti
+        codici, distinti = pd.factorize(serie, use_na_sentinel=True)
+        convertiti = self._normalizza_distinti(colonna, pd.Series(distinti, dtype=object), formato_uscita)
+        risultato = np.full(len(serie), '', dtype=object)
+        presenti = codici >= 0
+        risultato[presenti] = convertiti[codici[presenti]]
+        return pd.Series(risultato, index=serie.index)
@@ -0,0 +1,118 @@
+"""
+Engine SQLite condiviso e configurato per le prestazioni.
+
+`get_engine` restituisce un solo engine per database e processo, così la pagina
+Streamlit non ne ricrea uno ad ogni rerun e le sessioni condividono lo stesso pool
+di connessioni. Ogni nuova connessione viene impostata con journal WAL (letture non
+bloccate dalle scritture), sincronizzazione NORMAL e una cache di pagine più ampia.
+
+Durante le grandi scritture di import e popolamento `scrittura_massiva` rilassa
+ulteriormente la sincronizzazione sulla connessione usata per scrivere.
+
+Ogni modalità/studio ha un proprio file di database (vedi `get_config` in
+src/pipeline.py): `elimina_database` chiude l'engine e cancella il file insieme ai
+file accessori di SQLite.
+
+`identificatore` e `escape_like` servono ai moduli che compongono SQL con nomi di
+tabelle e colonne (che contengono spazi e trattini) e con ricerche LIKE.
+"""
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+
+# Impostazioni applicate ad ogni connessione
+PRAGMA_CONNESSIONE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # in KiB (64 MB)
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,
+    # Attesa massima (ms) quando un altro processo sta scrivendo, invece di fallire subito con "database is locked"
+    "busy_timeout": 30000,
+}
+
+_engines = {}
+_engine_configurati = weakref.WeakSet()
+_lock = threading.Lock()
+
+
+def identificatore(nome):
+    """Identificatore SQL quotato (nome di tabella o colonna)."""
+    return '"' + str(nome).replace('"', '""') + '"'
+
+
+def escape_like(valore):
+    """Valore con i caratteri speciali di LIKE (% e _) protetti, da usare con ESCAPE '\\'."""
+    return str(valore).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _imposta_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for nome, valore in PRAGMA_CONNESSIONE.items():
+            cursor.execute(f"PRAGMA {nome}={valore}")
+    finally:
+        cursor.close()
+
+
+def crea_engine(db_path):
+    """Crea un nuovo engine configurato. Da usare dove serve un engine proprio (es. processi worker)."""
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    engine = create_engine(f'sqlite:///{db_path}')
+    event.listen(engine, "connect", _imposta_pragma)
+    _engine_configurati.add(engine)
+    return engine
+
+
+def get_engine(db_path):
+    """Restituisce l'engine condiviso per il database indicato, creandolo alla prima richiesta."""
+    chiave = os.path.abspath(db_path)
+    with _lock:
+        if chiave not in _engines:
+            _engines[chiave] = crea_engine(chiave)
+        return _engines[chiave]
+
+
+def chiudi_engine(db_path):
+    """Chiude le connessioni dell'engine condiviso del database (se esiste) e lo rimuove dalla cache."""
+    with _lock:
+        engine = _engines.pop(os.path.abspath(db_path), None)
+    if engine is not None:
+        engine.dispose()
+    return engine
+
+
+def elimina_database(db_path):
+    """Cancella il file del database e i suoi file -wal/-shm/-journal. Restituisce l'engine chiuso (o None)."""
+    engine = chiudi_engine(db_path)
+    for suffisso in ('', '-wal', '-shm', '-journal'):
+        path = os.path.abspath(db_path) + suffisso
+        if os.path.exists(path):
+            os.remove(path)
+    return engine
+
+
+@contextmanager
+def scrittura_massiva(engine):
+    """
+    Restituisce una connessione per le scritture massive (intere tabelle, vedi src/bulk_writer.py) con
+    `synchronous=OFF`: in modalità WAL un crash può perdere le ultime transazioni ma non
+    corrompe il database, e i dati si possono sempre reimportare dai file sorgente.
+    Su engine non creati da questo modulo la connessione viene usata senza modifiche.
+    """
+    configurato = engine in _engine_configurati
+    with engine.connect() as connection:
+        if configurato:
+            connection.exec_driver_sql("PRAGMA synchronous=OFF")
+            # Nessuna transazione aperta: ogni tabella scritta resta una transazione a sé
+            connection.commit()
+        try:
+            yield connection
+            connection.commit()
+        finally:
+            if configurato:
+                connection.rollback()
+                connection.exec_driver_sql(f"PRAGMA synchronous={PRAGMA_CONNESSIONE['synchronous']}")
@@ -0,0 +1,68 @@
+"""
+Archivio ZIP con tutti i file di un export, scritto su disco una volta sola.
+
+L'archivio viene creato dal job di export (non dalla pagina ad ogni rerun) copiando i
+file uno alla volta in un file temporaneo, quindi la memoria usata non dipende dalle
+dimensioni degli export. Nel commento dello ZIP è salvata l'impronta del contenuto dei
+file: se un nuovo export produce gli stessi dati, l'archivio esistente viene riusato.
+
+Un .xlsx è a sua volta uno ZIP: l'impronta usa i CRC delle sue parti, letti dall'indice
+senza decomprimere, escludendo le proprietà del documento (data di salvataggio), che
+cambiano ad ogni export anche a dati invariati.
+"""
+import os
+import zipfile
+
+from src.fingerprint import impronta_file, impronta_oggetto
+from src.parse_cache import scrittura_atomica
+
+# Parti di un .xlsx che non dipendono dai dati
+PARTI_VOLATILI = ('docProps/core.xml',)
+
+
+def percorso_zip(cartella, mode):
+    """Percorso dell'archivio ZIP dell'export di una modalità."""
+    return os.path.join(cartella, f"export_{mode}.zip")
+
+
+def _impronta_file(path):
+    try:
+        with zipfile.ZipFile(path) as zipf:
+            return [[i.filename, i.CRC, i.file_size] for i in zipf.infolist() if i.filename not in PARTI_VOLATILI]
+    except zipfile.BadZipFile:
+        return impronta_file(path)
+
+
+def impronta_contenuto(percorsi):
+    """Impronta dei file dell'export (nome e contenuto di ciascuno)."""
+    return impronta_oggetto([[os.path.basename(p), _impronta_file(p)] for p in percorsi])
+
+
+def _impronta_zip(path):
+    try:
+        with zipfile.ZipFile(path) as zipf:
+            return zipf.comment.decode('utf-8')
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+
+def crea_zip(percorsi, path):
+    """
+    Scrive l'archivio con i file indicati (se il contenuto è cambiato dall'ultima volta).
+    Restituisce True se l'archivio è stato riscritto, False se era già aggiornato.
+    """
+    percorsi = [p for p in percorsi if p and os.path.exists(p)]
+    impronta = impronta_contenuto(percorsi)
+    if _impronta_zip(path) == impronta:
+        return False
+
+    def scrivi(tmp_path):
+        # Gli .xlsx sono già compressi: si archiviano senza ricomprimerli
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as zipf:
+            for percorso in percorsi:
+                zipf.write(percorso, arcname=os.path.basename(percorso))
+            zipf.comment = impronta.encode('utf-8')
+
+    # File temporaneo univoco: due export contemporanei dello stesso studio non si intralciano
+    scrittura_atomica(path, scrivi)
+    return True
@@ -0,0 +1,71 @@
+"""
+Impronte (hash) degli input di ogni tabella, usate per il ripopolamento incrementale.
+
+Le impronte sono salvate in una tabella di servizio nello stesso database dei dati,
+così svuotare il database le azzera insieme alle tabelle a cui si riferiscono.
+"""
+import hashlib
+import json
+
+import pandas as pd
+from sqlalchemy import text
+
+from src.db import identificatore
+
+TABELLA_IMPRONTE = '_impronte_tabelle'
+
+# Da incrementare quando cambia la logica di popolamento: invalida tutte le impronte salvate
+VERSIONE_LOGICA = 2
+
+
+def _crea_tabella_impronte(connection):
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS "{TABELLA_IMPRONTE}" (tabella TEXT PRIMARY KEY, impronta TEXT NOT NULL)'))
+
+
+def impronta_oggetto(obj):
+    """Hash SHA-256 di un oggetto serializzabile in JSON (chiavi ordinate)."""
+    payload = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def impronta_file(path, **parametri):
+    """Hash SHA-256 del contenuto di un file insieme ai parametri con cui viene letto."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for blocco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(blocco)
+    h.update(impronta_oggetto(parametri).encode('utf-8'))
+    return h.hexdigest()
+
+
+def impronta_tabella(engine, tabella, chunksize=50000):
+    """Hash del contenuto di una tabella, calcolato a blocchi. Usato quando non esiste un'impronta salvata all'import."""
+    h = hashlib.sha256()
+    for chunk in pd.read_sql_query(f'SELECT * FROM {identificatore(tabella)}', engine, chunksize=chunksize):
+        h.update(','.join(chunk.columns).encode('utf-8'))
+        h.update(pd.util.hash_pandas_object(chunk.astype(str), index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def leggi_impronte(engine):
+    """Restituisce {tabella: impronta} per tutte le impronte salvate."""
+    with engine.begin() as connection:
+        _crea_tabella_impronte(connection)
+        return {row[0]: row[1] for row in connection.execute(text(f'SELECT tabella, impronta FROM "{TABELLA_IMPRONTE}"'))}
+
+
+def salva_impronta(engine, tabella, impronta):
+    """Salva (o sostituisce) l'impronta di una tabella."""
+    with engine.begin() as connection:
+        _crea_tabella_impronte(connection)
+        connection.execute(text(f'INSERT OR REPLACE INTO "{TABELLA_IMPRONTE}" (tabella, impronta) VALUES (:t, :i)'), {"t": tabella, "i": impronta})
+
+
+def elimina_impronte(engine, tabelle):
+    """Cancella le impronte delle tabelle indicate (es. dopo un nuovo import o una modifica manuale)."""
+    if not tabelle:
+        return
+    with engine.begin() as connection:
+        _crea_tabella_impronte(connection)
+        for tabella in tabelle:
+            connection.execute(text(f'DELETE FROM "{TABELLA_IMPRONTE}" WHERE tabella = :t'), {"t": tabella})
@@ -1,8 +1,12 @@
 import os
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import json
 
+from src.bulk_writer import scrivi_tabella
+from src.db import get_engine, identificatore
+from src.schema_catalog import colonne_tabella
+
 # Percorsi cartelle
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db', 'imported_data.sqlite')
@@ -30,8 +34,8 @@ def import_file_to_db(file_name, table_name=None, header_row=0, data_start_row=N
     if table_name is None:
         table_name = os.path.splitext(file_name)[0]
 
-    engine = create_engine(f'sqlite:///{DB_PATH}')
-    df.to_sql(table_name, engine, if_exists='replace', index=False)
+    engine = get_engine(DB_PATH)
+    scrivi_tabella(engine, table_name, df)
     print(f"Tabella '{table_name}' creata/importata nel database con {len(df)} righe e {len(df.columns)} colonne.")
     print(f"Colonne: {list(df.columns)}\n")
     return table_name, list(df.columns)
@@ -70,7 +74,7 @@ def import_selected_files():
 
 def list_tables_in_db():
     """Stampa l'elenco delle tabelle presenti nel database."""
-    engine = create_engine(f'sqlite:///{DB_PATH}')
+    engine = get_engine(DB_PATH)
     with engine.connect() as conn:
         result = conn.execute(text("SELECT name FROM sqlite_master WHERE type='table';"))
         tables = [row[0] for row in result]
@@ -81,36 +85,32 @@ def list_tables_in_db():
 
 def show_table_preview(table_name, n=5):
     """Mostra le prime n righe di una tabella del database."""
-    engine = create_engine(f'sqlite:///{DB_PATH}')
+    engine = get_engine(DB_PATH)
     try:
-        df = pd.read_sql_table(table_name, engine)
+        df = pd.read_sql_query(f'SELECT * FROM {identificatore(table_name)} LIMIT {int(n)}', engine)
         print(f"\nAnteprima della tabella '{table_name}':")
-        print(df.head(n))
+        print(df)
     except Exception as e:
         print(f"Errore nella lettura della tabella {table_name}: {e}")
 
 def show_table_columns(table_name):
     """Mostra le intestazioni delle colonne di una tabella del database."""
-    engine = create_engine(f'sqlite:///{DB_PATH}')
-    try:
-        df = pd.read_sql_table(table_name, engine)
-        print(f"\nColonne della tabella '{table_name}':")
-        for col in df.columns:
-            print(f"- {col}")
-    except Exception as e:
-        print(f"Errore nella lettura della tabella {table_name}: {e}")
+    engine = get_engine(DB_PATH)
+    columns = colonne_tabella(engine, table_name)
+    if not columns:
+        print(f"Errore nella lettura della tabella {table_name}: tabella non trovata")
+        return
+    print(f"\nColonne della tabella '{table_name}':")
+    for col in columns:
+        print(f"- {col}")
 
 def find_common_columns():
     """Trova e mostra le colonne comuni tra le tabelle del database (potenziali chiavi di collegamento)."""
-    engine = create_engine(f'sqlite:///{DB_PATH}')
+    engine = get_engine(DB_PATH)
     tables = list_tables_in_db()
     columns_by_table = {}
     for t in tables:
-        try:
-            df = pd.read_sql_table(t, engine)
-            columns_by_table[t] = set(df.columns)
-        except Exception as e:
-            print(f"Errore nella lettura della tabella {t}: {e}")
+        columns_by_table[t] = set(colonne_tabella(engine, t))
     # Trova colonne comuni
     all_columns = {}
     for table, cols in columns_by_table.items():
@@ -165,7 +165,7 @@ def join_tables_on_key(mapping_path=None):
     if not rels:
         print("Nessuna relazione salvata.")
         return
-    engine = create_engine(f'sqlite:///{DB_PATH}')
+    engine = get_engine(DB_PATH)
     for rel in rels:
         col = rel['colonna']
         tables = rel['tabelle']
@@ -0,0 +1,244 @@
+"""
+Esecuzione in background delle operazioni lunghe del wizard (import, popolamento, export).
+
+Il pulsante della pagina registra un job e lo affida a un pool di thread del processo:
+la pagina resta utilizzabile e non dipende più dalla durata della richiesta del browser.
+Lo stato di ogni job (avanzamento per tabella, messaggi di log, risultato o errore) è
+salvato nella tabella `jobs` di un database dedicato (config["jobs_db_path"]), quindi
+sopravvive al refresh della pagina e allo svuotamento del database dello studio.
+
+I job di ogni studio aspettano in una coda propria e al pool viene affidato solo il
+primo: job dello stesso studio vengono eseguiti uno alla volta, quelli di studi diversi
+in parallelo, e un job in attesa non occupa un thread del pool. Il job in esecuzione
+prende comunque il blocco in scrittura dello studio (vedi src/locks.py), che può essere
+tenuto da operazioni della pagina come la modifica massiva.
+L'annullamento è cooperativo: viene controllato ad ogni chiamata di `progresso`, cioè
+tra un file o una tabella e il successivo.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from src.db import get_engine
+from src.locks import descrivi_stato, scrittura
+
+STATO_IN_CODA = 'in coda'
+STATO_IN_ESECUZIONE = 'in esecuzione'
+STATO_COMPLETATO = 'completato'
+STATO_ERRORE = 'errore'
+STATO_ANNULLATO = 'annullato'
+# Job attivi quando il processo si è fermato (riavvio del server)
+STATO_INTERROTTO = 'interrotto'
+STATI_ATTIVI = (STATO_IN_CODA, STATO_IN_ESECUZIONE)
+
+# Intervallo minimo (secondi) tra due salvataggi dell'avanzamento
+INTERVALLO_SALVATAGGIO = 0.5
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='job')
+_annullamenti = {}
+# Job in attesa per studio (chiave: database); il primo è quello affidato al pool
+_code = {}
+_preparati = set()
+_lock = threading.Lock()
+
+
+class JobAnnullato(Exception):
+    """Sollevata nel thread del job quando l'utente ne chiede l'annullamento."""
+
+
+def _engine(config):
+    """Engine del database dei job; al primo accesso del processo crea la tabella e chiude i job rimasti attivi."""
+    engine = get_engine(config["jobs_db_path"])
+    with _lock:
+        if config["jobs_db_path"] in _preparati:
+            return engine
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, tipo TEXT NOT NULL, chiave TEXT NOT NULL, "
+                "descrizione TEXT, stato TEXT NOT NULL, creato REAL, avviato REAL, terminato REAL, "
+                "completate INTEGER DEFAULT 0, totale INTEGER DEFAULT 0, corrente TEXT, messaggi TEXT, risultato TEXT, errore TEXT)"
+            ))
+            connection.execute(text("CREATE INDEX IF NOT EXISTS jobs_chiave_tipo ON jobs (chiave, tipo, creato)"))
+            # Nessun thread di questo processo li sta eseguendo: il server è stato riavviato
+            connection.execute(
+                text("UPDATE jobs SET stato = :interrotto, terminato = :ora WHERE stato IN (:in_coda, :in_esecuzione)"),
+                {"interrotto": STATO_INTERROTTO, "ora": time.time(), "in_coda": STATO_IN_CODA, "in_esecuzione": STATO_IN_ESECUZIONE}
+            )
+        _preparati.add(config["jobs_db_path"])
+    return engine
+
+
+def _aggiorna(engine, job_id, **campi):
+    assegnazioni = ', '.join(f"{nome} = :{nome}" for nome in campi)
+    with engine.begin() as connection:
+        connection.execute(text(f"UPDATE jobs SET {assegnazioni} WHERE id = :id"), {**campi, "id": job_id})
+
+
+def _dal_db(riga):
+    job = dict(riga._mapping)
+    job["messaggi"] = json.loads(job["messaggi"] or "[]")
+    job["risultato"] = json.loads(job["risultato"]) if job["risultato"] is not None else None
+    return job
+
+
+class _Esecuzione:
+    """Stato in memoria di un job in corso, salvato sul database al massimo ogni INTERVALLO_SALVATAGGIO secondi."""
+
+    def __init__(self, engine, job_id, annullamento):
+        self.engine, self.job_id, self.annullamento = engine, job_id, annullamento
+        self.messaggi, self.ultimo_salvataggio = [], 0.0
+        self.campi = {}
+
+    def salva(self, forza=False):
+        if forza or time.monotonic() - self.ultimo_salvataggio >= INTERVALLO_SALVATAGGIO:
+            _aggiorna(self.engine, self.job_id, messaggi=json.dumps(self.messaggi, ensure_ascii=False), **self.campi)
+            self.ultimo_salvataggio = time.monotonic()
+
+    def log(self, livello, messaggio):
+        # Le anteprime dei DataFrame non vengono conservate: le tabelle si sfogliano dalla pagina
+        if livello != 'dataframe':
+            self.messaggi.append([livello, str(messaggio)])
+            self.salva()
+
+    def progresso(self, completate, totale, corrente=None):
+        if self.annullamento.is_set():
+            raise JobAnnullato()
+        self.campi.update(completate=completate, totale=totale, corrente=corrente)
+        self.salva()
+
+    def in_attesa(self, stato, posizione):
+        if self.annullamento.is_set():
+            raise JobAnnullato()
+        self.campi.update(corrente=f"In attesa: {descrivi_stato(stato, posizione)}")
+        self.salva()
+
+
+def _chiave(config):
+    return os.path.abspath(config["db_path"])
+
+
+def _segnala_attesa(lavori):
+    """Aggiorna il messaggio dei job in coda dietro a quello in esecuzione (`lavori` dal secondo della coda)."""
+    for posizione, (config, job_id, *_) in enumerate(lavori, start=1):
+        _aggiorna(_engine(config), job_id, corrente=f"In attesa: {posizione} job dello studio prima di questo")
+
+
+def _esegui(config, job_id, descrizione, funzione, args, kwargs):
+    """Esegue il primo job della coda dello studio, poi affida al pool il successivo."""
+    try:
+        _esegui_job(config, job_id, descrizione, funzione, args, kwargs)
+    finally:
+        with _lock:
+            coda = _code[_chiave(config)]
+            coda.pop(0)
+            if not coda:
+                del _code[_chiave(config)]
+            in_attesa = list(coda)
+        if in_attesa:
+            _executor.submit(_esegui, *in_attesa[0])
+            _segnala_attesa(in_attesa[1:])
+
+
+def _esegui_job(config, job_id, descrizione, funzione, args, kwargs):
+    engine = _engine(config)
+    esecuzione = _Esecuzione(engine, job_id, _annullamenti[job_id])
+    try:
+        with scrittura(config, descrizione, in_attesa=esecuzione.in_attesa):
+            # Annullato mentre era in coda: il blocco si è liberato senza passare da `in_attesa`
+            if esecuzione.annullamento.is_set():
+                raise JobAnnullato()
+            esecuzione.campi = {"stato": STATO_IN_ESECUZIONE, "avviato": time.time(), "corrente": None}
+            esecuzione.salva(forza=True)
+            risultato = funzione(*args, log=esecuzione.log, progresso=esecuzione.progresso, **kwargs)
+        esecuzione.campi.update(stato=STATO_COMPLETATO, risultato=json.dumps(risultato, ensure_ascii=False, default=str), corrente=None)
+        esecuzione.campi["completate"] = esecuzione.campi.get("totale", 0)
+    except JobAnnullato:
+        esecuzione.campi.update(stato=STATO_ANNULLATO)
+    except Exception as e:
+        esecuzione.campi.update(stato=STATO_ERRORE, errore=str(e))
+    finally:
+        esecuzione.campi["terminato"] = time.time()
+        esecuzione.salva(forza=True)
+        with _lock:
+            _annullamenti.pop(job_id, None)
+
+
+def avvia(config, tipo, descrizione, funzione, *args, **kwargs):
+    """
+    Registra un job e lo esegue in background. `funzione` viene chiamata con `args`, `kwargs`
+    e in più `log` e `progresso`; il suo valore di ritorno (serializzabile in JSON) diventa
+    il risultato del job. Restituisce l'id del job.
+    """
+    engine = _engine(config)
+    job_id = uuid.uuid4().hex
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO jobs (id, tipo, chiave, descrizione, stato, creato, messaggi) VALUES (:id, :tipo, :chiave, :descrizione, :stato, :creato, '[]')"),
+            {"id": job_id, "tipo": tipo, "chiave": config["db_path"], "descrizione": descrizione, "stato": STATO_IN_CODA, "creato": time.time()}
+        )
+    lavoro = (config, job_id, descrizione, funzione, args, kwargs)
+    with _lock:
+        _annullamenti[job_id] = threading.Event()
+        coda = _code.setdefault(_chiave(config), [])
+        coda.append(lavoro)
+        posizione = len(coda) - 1
+    if posizione == 0:
+        _executor.submit(_esegui, *lavoro)
+    else:
+        _aggiorna(engine, job_id, corrente=f"In attesa: {posizione} job dello studio prima di questo")
+    return job_id
+
+
+def leggi(config, job_id):
+    """Stato del job come dict (None se non esiste)."""
+    with _engine(config).connect() as connection:
+        riga = connection.execute(text("SELECT * FROM jobs WHERE id = :id"), {"id": job_id}).first()
+    return _dal_db(riga) if riga is not None else None
+
+
+def ultimo(config, tipo):
+    """Ultimo job del tipo indicato per la modalità/studio della configurazione (None se non ce ne sono)."""
+    with _engine(config).connect() as connection:
+        riga = connection.execute(
+            text("SELECT * FROM jobs WHERE chiave = :chiave AND tipo = :tipo ORDER BY creato DESC LIMIT 1"),
+            {"chiave": config["db_path"], "tipo": tipo}
+        ).first()
+    return _dal_db(riga) if riga is not None else None
+
+
+def annulla(job_id):
+    """
+    Chiede l'annullamento di un job in corso o in coda. Un job in attesa nella coda dello studio
+    viene tolto subito; restituisce False se il job non è più attivo in questo processo.
+    """
+    rimosso, in_attesa = None, []
+    with _lock:
+        evento = _annullamenti.get(job_id)
+        if evento is None:
+            return False
+        evento.set()
+        for coda in _code.values():
+            # Il primo della coda è già nel pool: si ferma da solo al prossimo controllo
+            rimosso = next((lavoro for lavoro in coda[1:] if lavoro[1] == job_id), None)
+            if rimosso is not None:
+                coda.remove(rimosso)
+                _annullamenti.pop(job_id, None)
+                in_attesa = coda[1:]
+                break
+    if rimosso is not None:
+        _aggiorna(_engine(rimosso[0]), job_id, stato=STATO_ANNULLATO, terminato=time.time(), corrente=None)
+        _segnala_attesa(in_attesa)
+    return True
+
+
+def stima_secondi_rimanenti(job):
+    """Stima del tempo rimanente dalla velocità media finora (None se non ancora stimabile)."""
+    if job["stato"] != STATO_IN_ESECUZIONE or not job["avviato"] or not job["completate"] or not job["totale"]:
+        return None
+    trascorsi = time.time() - job["avviato"]
+    return trascorsi / job["completate"] * (job["totale"] - job["completate"])
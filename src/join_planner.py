@@ -0,0 +1,139 @@
+"""
+Join tra tabelle di appoggio tramite colonne chiave.
+
+Le relazioni sono quelle salvate da `src/importer.select_and_save_relationships`
+(relazioni.json): una lista di {"colonna": <chiave>, "tabelle": [<tabella>, ...]}, dove
+la stessa colonna identifica l'entità in tutte le tabelle elencate.
+
+Una tabella principale fissa le righe del risultato (una per entità). Le altre tabelle
+vengono collegate con un hash join sinistro: per ogni (tabella, chiave) si costruisce
+una sola volta l'indice chiave → prima riga, e per ogni tabella collegata si calcola
+una sola volta il vettore delle posizioni allineate alla principale. Indici e posizioni
+restano in una cache valida per tutto il popolamento, quindi le colonne richieste da
+più tabelle di struttura si ottengono con un semplice `take`, senza copiare le tabelle.
+"""
+import json
+import os
+from collections import Counter, deque
+
+import numpy as np
+import pandas as pd
+
+NOME_FILE_RELAZIONI = 'relazioni.json'
+
+
+def carica_relazioni(*cartelle):
+    """
+    Legge relazioni.json dalla prima cartella che lo contiene e restituisce [(colonna, [tabelle])].
+    Le voci malformate vengono ignorate.
+    """
+    for cartella in cartelle:
+        path = os.path.join(cartella, NOME_FILE_RELAZIONI)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                voci = json.load(f)
+            return [(v["colonna"], list(v["tabelle"])) for v in voci
+                    if isinstance(v, dict) and v.get("colonna") and len(v.get("tabelle", [])) > 1]
+    return []
+
+
+def tabella_principale(sorgenti):
+    """Tabella con più colonne mappate tra le sorgenti 'tabella.colonna' (a parità, la prima in ordine alfabetico)."""
+    conteggi = Counter(s.split('.', 1)[0] for s in sorgenti)
+    return min(conteggi, key=lambda t: (-conteggi[t], t))
+
+
+def pianifica(principale, tabelle, relazioni):
+    """
+    Percorre le relazioni a partire dalla tabella principale (visita in ampiezza) e restituisce
+    (passi, non_collegate). Ogni passo è (tabella, tabella_già_collegata, colonna_chiave).
+    """
+    da_collegare = set(tabelle) - {principale}
+    passi = []
+    coda = deque([principale])
+    while coda and da_collegare:
+        corrente = coda.popleft()
+        for colonna, tabelle_relazione in relazioni:
+            if corrente not in tabelle_relazione:
+                continue
+            for tabella in sorted(da_collegare & set(tabelle_relazione)):
+                passi.append((tabella, corrente, colonna))
+                da_collegare.discard(tabella)
+                coda.append(tabella)
+    return passi, sorted(da_collegare)
+
+
+def _prendi(valori, posizioni, mancante):
+    """valori[posizioni], con `mancante` dove la posizione è -1."""
+    risultato = np.full(len(posizioni), mancante, dtype=object)
+    presenti = posizioni >= 0
+    risultato[presenti] = valori[posizioni[presenti]]
+    return risultato
+
+
+def _chiavi_vuote(valori):
+    """Maschera delle chiavi mancanti, vuote o di soli spazi: non identificano nessuna entità."""
+    serie = pd.Series(valori, dtype=object)
+    return (serie.isna() | serie.astype(str).str.strip().eq('')).to_numpy()
+
+
+def _indice_chiave(df, colonna, cache, tabella, log):
+    """
+    Indice chiave → posizione della prima riga con quella chiave (costruito una volta per run).
+    Le righe con chiave vuota restano fuori dall'indice: non corrispondono a nessuna entità.
+    """
+    chiave_cache = ('indice', tabella, colonna)
+    if chiave_cache not in cache:
+        valori = df[colonna].to_numpy(dtype=object)
+        valide = ~_chiavi_vuote(valori)
+        if not valide.all():
+            log('warning', f"`{tabella}` ha {int((~valide).sum())} righe con chiave `{colonna}` vuota: escluse dal join.")
+        chiavi, righe = pd.Index(valori[valide]), np.flatnonzero(valide)
+        duplicate = chiavi.duplicated()
+        if duplicate.any():
+            log('warning', f"`{tabella}` ha {int(duplicate.sum())} righe con chiave `{colonna}` ripetuta: nel join si usa la prima.")
+        cache[chiave_cache] = (chiavi[~duplicate], righe[~duplicate])
+    return cache[chiave_cache]
+
+
+def allinea(principale, tabelle, relazioni, carica, cache, log):
+    """
+    Restituisce {tabella: posizioni}, dove `posizioni[i]` è la riga della tabella che corrisponde
+    alla riga i della principale (-1 se l'entità non è presente). Restituisce None se una delle
+    tabelle non è raggiungibile tramite le relazioni.
+
+    `carica(tabella)` restituisce il DataFrame della tabella di appoggio; `cache` è un dict
+    condiviso per tutto il popolamento.
+    """
+    passi, non_collegate = pianifica(principale, tabelle, relazioni)
+    if non_collegate:
+        log('warning', f"Nessuna relazione collega `{principale}` a: {', '.join(non_collegate)}.")
+        return None
+
+    posizioni = {principale: np.arange(len(carica(principale)))}
+    for tabella, sinistra, colonna in passi:
+        chiave_cache = ('posizioni', principale, tabella, sinistra, colonna)
+        if chiave_cache not in cache:
+            df_sinistra, df_destra = carica(sinistra), carica(tabella)
+            if colonna not in df_sinistra.columns or colonna not in df_destra.columns:
+                log('warning', f"Colonna chiave `{colonna}` assente in `{sinistra}` o `{tabella}`.")
+                return None
+            chiavi, righe = _indice_chiave(df_destra, colonna, cache, tabella, log)
+            pos_sinistra = posizioni[sinistra]
+            valori_sinistra = _prendi(df_sinistra[colonna].to_numpy(dtype=object), pos_sinistra, None)
+            trovate = chiavi.get_indexer(valori_sinistra)
+            # Entità presenti ma con chiave vuota: restano senza corrispondenza nella tabella collegata
+            senza_chiave = _chiavi_vuote(valori_sinistra) & (pos_sinistra >= 0)
+            trovate[senza_chiave] = -1
+            if senza_chiave.any():
+                log('warning', f"{int(senza_chiave.sum())} righe con chiave `{colonna}` vuota in `{sinistra}`: non collegate a `{tabella}`.")
+            pos_destra = np.full(len(trovate), -1)
+            pos_destra[trovate >= 0] = righe[trovate[trovate >= 0]]
+            cache[chiave_cache] = pos_destra
+        posizioni[tabella] = cache[chiave_cache]
+    return posizioni
+
+
+def valori_allineati(df, colonna, posizioni):
+    """Colonna `colonna` di `df` riordinata secondo `posizioni` (NaN dove l'entità manca)."""
+    return pd.Series(_prendi(df[colonna].to_numpy(dtype=object), posizioni, np.nan), index=pd.RangeIndex(len(posizioni)))
@@ -0,0 +1,156 @@
+"""
+Blocchi lettori/scrittori per modalità/studio, condivisi tra le sessioni Streamlit.
+
+Tutte le sessioni della stessa istanza girano nello stesso processo: le operazioni che
+cancellano o riscrivono tabelle (import, popolamento, modifica massiva, export, reset)
+prendono il blocco in scrittura del database dello studio e vengono eseguite una alla
+volta, nell'ordine di arrivo; le anteprime prendono il blocco in lettura e possono
+procedere insieme finché nessuna scrittura è in corso o in coda.
+
+Chi aspetta riceve periodicamente lo stato del blocco (operazione in corso, posizione in
+coda) tramite la callback `in_attesa`, così l'interfaccia può mostrarlo invece di un
+errore "database is locked". Tra processi diversi (es. la pipeline da riga di comando)
+vale solo il `busy_timeout` impostato sulle connessioni in src/db.py.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_registro = {}
+_lock_registro = threading.Lock()
+
+
+class RisorsaOccupata(Exception):
+    """Il blocco non è stato ottenuto entro il tempo indicato."""
+
+    def __init__(self, stato):
+        super().__init__(descrivi_stato(stato))
+        self.stato = stato
+
+
+class LockLettoreScrittore:
+    """Blocco lettori/scrittori con precedenza alle scritture e coda FIFO degli scrittori."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._lettori = 0
+        self._scrittore = None
+        self._profondita = 0
+        self._coda = []
+
+    def _stato(self):
+        return {
+            "scrittore": dict(self._scrittore) if self._scrittore else None,
+            "lettori": self._lettori,
+            "coda": [dict(r) for r in self._coda],
+        }
+
+    def stato(self):
+        with self._cond:
+            return self._stato()
+
+    def _mio(self):
+        return self._scrittore is not None and self._scrittore["thread"] == threading.get_ident()
+
+    def acquisisci_lettura(self, timeout=None):
+        """Restituisce True se il blocco in lettura è stato ottenuto entro `timeout` secondi."""
+        with self._cond:
+            ottenuto = self._mio() or self._cond.wait_for(lambda: self._scrittore is None and not self._coda, timeout)
+            if ottenuto:
+                self._lettori += 1
+            return ottenuto
+
+    def rilascia_lettura(self):
+        with self._cond:
+            self._lettori -= 1
+            self._cond.notify_all()
+
+    def acquisisci_scrittura(self, descrizione, in_attesa=None, intervallo=1.0, timeout=None):
+        """
+        Attende il proprio turno in coda. Ogni `intervallo` secondi di attesa chiama
+        `in_attesa(stato, posizione)` (posizione 1 = prossimo). Solleva RisorsaOccupata dopo `timeout` secondi.
+        """
+        with self._cond:
+            if self._mio():
+                self._profondita += 1
+                return
+            richiesta = {"descrizione": descrizione, "dal": time.time(), "thread": threading.get_ident()}
+            self._coda.append(richiesta)
+        scadenza = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                with self._cond:
+                    pronto = lambda: self._coda[0] is richiesta and self._scrittore is None and self._lettori == 0
+                    attesa = intervallo if scadenza is None else max(0.0, min(intervallo, scadenza - time.monotonic()))
+                    if self._cond.wait_for(pronto, attesa):
+                        self._coda.pop(0)
+                        # La durata mostrata è quella della scrittura, non dell'attesa in coda
+                        richiesta["dal"] = time.time()
+                        self._scrittore, self._profondita = richiesta, 1
+                        return
+                    stato, posizione = self._stato(), self._coda.index(richiesta) + 1
+                if scadenza is not None and time.monotonic() >= scadenza:
+                    raise RisorsaOccupata(stato)
+                if in_attesa:
+                    in_attesa(stato, posizione)
+        except BaseException:
+            with self._cond:
+                if richiesta in self._coda:
+                    self._coda.remove(richiesta)
+                    self._cond.notify_all()
+            raise
+
+    def rilascia_scrittura(self):
+        with self._cond:
+            self._profondita -= 1
+            if self._profondita == 0:
+                self._scrittore = None
+                self._cond.notify_all()
+
+
+def lock_per(config):
+    """Blocco del database della modalità/studio della configurazione (uno per processo)."""
+    chiave = os.path.abspath(config["db_path"])
+    with _lock_registro:
+        if chiave not in _registro:
+            _registro[chiave] = LockLettoreScrittore()
+        return _registro[chiave]
+
+
+@contextmanager
+def scrittura(config, descrizione, in_attesa=None, timeout=None):
+    """Esegue il blocco `with` con accesso esclusivo al database dello studio."""
+    blocco = lock_per(config)
+    blocco.acquisisci_scrittura(descrizione, in_attesa, timeout=timeout)
+    try:
+        yield
+    finally:
+        blocco.rilascia_scrittura()
+
+
+@contextmanager
+def lettura(config, timeout=None):
+    """Esegue il blocco `with` insieme ad altri lettori; solleva RisorsaOccupata se una scrittura non termina entro `timeout`."""
+    blocco = lock_per(config)
+    if not blocco.acquisisci_lettura(timeout):
+        raise RisorsaOccupata(blocco.stato())
+    try:
+        yield
+    finally:
+        blocco.rilascia_lettura()
+
+
+def descrivi_stato(stato, posizione=None):
+    """Messaggio leggibile sullo stato del blocco (operazione in corso e coda)."""
+    parti = []
+    if stato["scrittore"]:
+        secondi = int(time.time() - stato["scrittore"]["dal"])
+        parti.append(f"In corso: {stato['scrittore']['descrizione']} (da {secondi}s)")
+    elif stato["lettori"]:
+        parti.append(f"Letture in corso: {stato['lettori']}")
+    if stato["coda"]:
+        parti.append(f"in coda: {', '.join(r['descrizione'] for r in stato['coda'])}")
+    if posizione is not None:
+        parti.append(f"la tua operazione è {posizione}ª in coda")
+    return "; ".join(parti) or "Nessuna operazione in corso"
@@ -0,0 +1,124 @@
+"""
+Logica della griglia di mappatura dello Step 6 (senza dipendenze da Streamlit).
+
+La mappatura live è un dict {sorgente 'tabella.colonna': [destinazioni]}, dove una
+lista con il solo NON_MAPPARE o NASCONDI indica una sorgente non mappata o nascosta.
+Filtri, ricerca e paginazione lavorano sull'elenco delle sorgenti lato server: alla
+griglia arriva solo la pagina corrente, mentre le opzioni di destinazione vengono
+inviate una sola volta per colonna invece che per ogni riga.
+"""
+NON_MAPPARE = "-- Non mappare --"
+NASCONDI = "Nascondi"
+
+STATO_TUTTE = "Tutte"
+STATO_MAPPATE = "Mappate"
+STATO_NON_MAPPATE = "Non mappate"
+STATO_NASCOSTE = "Nascoste"
+STATI = [STATO_TUTTE, STATO_MAPPATE, STATO_NON_MAPPATE, STATO_NASCOSTE]
+
+ASSEGNA_SOSTITUISCI = "Sostituisci"
+ASSEGNA_AGGIUNGI = "Aggiungi"
+ASSEGNA_RIMUOVI = "Rimuovi mappatura"
+ASSEGNA_NASCONDI = "Nascondi"
+MODALITA_ASSEGNAZIONE = [ASSEGNA_SOSTITUISCI, ASSEGNA_AGGIUNGI, ASSEGNA_RIMUOVI, ASSEGNA_NASCONDI]
+
+
+def destinazioni_reali(destinazioni):
+    """Destinazioni senza i valori speciali NON_MAPPARE / NASCONDI."""
+    return [d for d in (destinazioni or []) if d not in (NON_MAPPARE, NASCONDI)]
+
+
+def stato_mappatura(destinazioni):
+    """Stato di una sorgente: STATO_MAPPATE, STATO_NASCOSTE o STATO_NON_MAPPATE."""
+    if destinazioni_reali(destinazioni):
+        return STATO_MAPPATE
+    if destinazioni == [NASCONDI]:
+        return STATO_NASCOSTE
+    return STATO_NON_MAPPATE
+
+
+def filtra_sorgenti(sorgenti, mappatura, testo='', tabelle=(), stato=STATO_TUTTE, nome_leggibile=str, commenti=None):
+    """
+    Restituisce le sorgenti che corrispondono ai filtri, nell'ordine originale.
+    La ricerca (senza distinzione di maiuscole) considera nome tecnico e leggibile della
+    colonna, della tabella, il commento dell'intestazione e le destinazioni già mappate.
+    """
+    commenti = commenti or {}
+    testo = (testo or '').strip().lower()
+    tabelle = set(tabelle or ())
+    risultato = []
+    for sorgente in sorgenti:
+        tabella, colonna = sorgente.split('.', 1)
+        if tabelle and tabella not in tabelle:
+            continue
+        destinazioni = mappatura.get(sorgente, [NON_MAPPARE])
+        if stato != STATO_TUTTE and stato_mappatura(destinazioni) != stato:
+            continue
+        if testo:
+            campi = [colonna, nome_leggibile(colonna), nome_leggibile(tabella), commenti.get(colonna) or '']
+            campi += [d for dest in destinazioni_reali(destinazioni) for d in (dest, nome_leggibile(dest))]
+            if not any(testo in str(campo).lower() for campo in campi):
+                continue
+        risultato.append(sorgente)
+    return risultato
+
+
+def pagina(elementi, numero, dimensione):
+    """Restituisce (elementi della pagina, numero di pagina corretto, totale pagine). Le pagine partono da 0."""
+    totale = max(1, (len(elementi) + dimensione - 1) // dimensione)
+    numero = min(max(0, numero), totale - 1)
+    return elementi[numero * dimensione:(numero + 1) * dimensione], numero, totale
+
+
+def etichette_destinazioni(nomi, nome_leggibile=str):
+    """
+    Etichette leggibili (univoche) per le colonne di destinazione. Restituisce
+    (lista di etichette nello stesso ordine, {etichetta: nome}). I valori speciali restano invariati.
+    """
+    conteggi = {}
+    for nome in nomi:
+        etichetta = nome_leggibile(nome)
+        conteggi[etichetta] = conteggi.get(etichetta, 0) + 1
+    etichette, da_etichetta = [], {}
+    for nome in nomi:
+        etichetta = nome_leggibile(nome)
+        if conteggi[etichetta] > 1 or (etichetta in da_etichetta and da_etichetta[etichetta] != nome):
+            etichetta = f"{etichetta} [{nome}]"
+        etichette.append(etichetta)
+        da_etichetta[etichetta] = nome
+    return etichette, da_etichetta
+
+
+def imposta_principale(destinazioni, nuova):
+    """
+    Nuova lista di destinazioni quando nella griglia si cambia la destinazione principale (la prima).
+    Un valore speciale sostituisce tutte le destinazioni; altrimenti le destinazioni aggiuntive restano.
+    """
+    if nuova in (None, '', NON_MAPPARE):
+        return [NON_MAPPARE]
+    if nuova == NASCONDI:
+        return [NASCONDI]
+    altre = [d for d in destinazioni_reali(destinazioni)[1:] if d != nuova]
+    return [nuova] + altre
+
+
+def assegna_in_blocco(mappatura, sorgenti, destinazioni, modalita):
+    """Applica l'assegnazione a tutte le sorgenti indicate (modifica `mappatura`). Restituisce il numero di sorgenti cambiate."""
+    cambiate = 0
+    for sorgente in sorgenti:
+        attuali = mappatura.get(sorgente, [NON_MAPPARE])
+        if modalita == ASSEGNA_SOSTITUISCI:
+            nuove = list(destinazioni) or [NON_MAPPARE]
+        elif modalita == ASSEGNA_AGGIUNGI:
+            reali = destinazioni_reali(attuali)
+            nuove = (reali + [d for d in destinazioni if d not in reali]) or [NON_MAPPARE]
+        elif modalita == ASSEGNA_NASCONDI:
+            nuove = [NASCONDI]
+        elif modalita == ASSEGNA_RIMUOVI:
+            nuove = [NON_MAPPARE]
+        else:
+            raise ValueError(f"Modalità di assegnazione sconosciuta: {modalita}")
+        if nuove != attuali:
+            mappatura[sorgente] = nuove
+            cambiate += 1
+    return cambiate
@@ -0,0 +1,138 @@
+"""
+Piano di esecuzione compilato dalla mappatura salvata.
+
+La configurazione di una modalità/studio (mappatura salvata da src/mapping_store.py,
+chiavi unpivot, relazioni, intestazioni di export) viene trasformata una sola volta in
+un piano che per ogni tabella di struttura indica strategia, sorgenti, chiavi, colonne
+data e intestazioni. Step 6b, popolamento ed export
+leggono tutti lo stesso piano.
+
+Il piano resta in cache finché non cambiano i file di configurazione (data di modifica e
+dimensione) o lo schema del database. Il piano restituito è condiviso: non va modificato.
+"""
+import json
+import os
+import threading
+
+from src.join_planner import NOME_FILE_RELAZIONI, carica_relazioni
+from src.mapping_store import FILE_PRECEDENTI, NOME_FILE, leggi_configurazione
+from src.schema_catalog import colonne_tabella, elenca_tabelle, versione_schema
+
+STRATEGIA_UNPIVOT = 'unpivot'
+STRATEGIA_UNO_A_UNO = '1-a-1'
+
+FILE_CONFIGURAZIONE = [NOME_FILE] + [nome for nome, _, _, _ in FILE_PRECEDENTI] + ["unpivot_keys_config.json"]
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _carica_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def normalizza_mappatura(mappatura):
+    """
+    Porta la mappatura globale alla forma {sorgente: [destinazioni]}. Le mappature salvate con
+    le versioni precedenti hanno una stringa come valore, che va intesa come lista di un elemento
+    (come già fa lo Step 6 quando le carica).
+    """
+    normalizzata = {}
+    for sorgente, destinazioni in mappatura.items():
+        if isinstance(destinazioni, str):
+            destinazioni = [destinazioni] if destinazioni else []
+        normalizzata[sorgente] = list(destinazioni)
+    return normalizzata
+
+
+def _percorsi_configurazione(config, struttura_tables):
+    percorsi = [os.path.join(config["mapping_dir"], nome) for nome in FILE_CONFIGURAZIONE]
+    percorsi += [os.path.join(cartella, NOME_FILE_RELAZIONI) for cartella in (config["mapping_dir"], config["mapping_root_dir"])]
+    percorsi += [os.path.join(config["mapping_dir"], f"{t}_headers.json") for t in struttura_tables]
+    return percorsi
+
+
+def _firma(config, engine, struttura_tables):
+    """Firma degli input del piano: stato dei file di configurazione e versione dello schema."""
+    stati = []
+    for path in _percorsi_configurazione(config, struttura_tables):
+        try:
+            info = os.stat(path)
+            stati.append((path, info.st_mtime_ns, info.st_size))
+        except OSError:
+            stati.append((path, None, None))
+    return (versione_schema(engine), tuple(stati))
+
+
+def _compila(config, engine, all_db_tables):
+    mapping_dir = config["mapping_dir"]
+    configurazione = leggi_configurazione(mapping_dir)
+    mappatura = normalizza_mappatura(configurazione["column_mappings"])
+    colonne_data = configurazione["date_format_columns"]
+    colonna_studio = configurazione["studio_code_column"]
+    tabelle_1a1 = configurazione["force_1to1_tables"]
+    chiavi_unpivot = _carica_json(os.path.join(mapping_dir, "unpivot_keys_config.json"), {})
+
+    # Mappa invertita: colonna di destinazione -> [sorgenti complete 'tabella.colonna']
+    dest_to_sources = {}
+    for sorgente, destinazioni in mappatura.items():
+        for dest in destinazioni:
+            dest_to_sources.setdefault(dest, []).append(sorgente)
+
+    tabelle = {}
+    for tabella in [t for t in all_db_tables if t.startswith(config["db_struttura_prefix"])]:
+        colonne = colonne_tabella(engine, tabella)
+        mappatura_tabella = {dest: sorgenti for dest, sorgenti in dest_to_sources.items() if dest in colonne}
+        is_unpivot = tabella not in tabelle_1a1 and any(len(dest_to_sources.get(c, [])) > 1 for c in colonne)
+        headers_path = os.path.join(mapping_dir, f"{tabella}_headers.json")
+        tabelle[tabella] = {
+            "strategia": STRATEGIA_UNPIVOT if is_unpivot else STRATEGIA_UNO_A_UNO,
+            "colonne": colonne,
+            "mappatura": mappatura_tabella,
+            # Colonne 1-a-1 nell'ordine della tabella (opzioni per le chiavi unpivot)
+            "uno_a_uno": {c: dest_to_sources[c][0] for c in colonne if len(dest_to_sources.get(c, [])) == 1},
+            "unpivot": {c: list(dest_to_sources[c]) for c in colonne if len(dest_to_sources.get(c, [])) > 1},
+            "sorgenti": sorted({s.split('.')[0] for sorgenti in mappatura_tabella.values() for s in sorgenti}),
+            "chiavi": chiavi_unpivot.get(tabella, []),
+            "colonne_data": [c for c in colonne if c in colonne_data],
+            "intestazioni": _carica_json(headers_path, None),
+            "nome_export": tabella.replace(config["db_struttura_prefix"], ''),
+        }
+
+    return {
+        "mappatura": mappatura,
+        "dest_to_sources": dest_to_sources,
+        "colonne_data": colonne_data,
+        "colonna_studio": colonna_studio,
+        "tabelle_1a1": tabelle_1a1,
+        "chiavi_unpivot": chiavi_unpivot,
+        "relazioni": carica_relazioni(mapping_dir, config["mapping_root_dir"]),
+        "appoggio": [t for t in all_db_tables if t.endswith(config["db_appoggio_suffix"])],
+        "tabelle": tabelle,
+    }
+
+
+def compila_piano(config, engine):
+    """Restituisce il piano di esecuzione per la configurazione indicata, ricompilandolo solo se gli input sono cambiati."""
+    all_db_tables = elenca_tabelle(engine)
+    struttura_tables = [t for t in all_db_tables if t.startswith(config["db_struttura_prefix"])]
+    chiave = (config["mapping_dir"], str(engine.url), config["db_struttura_prefix"])
+    firma = _firma(config, engine, struttura_tables)
+    with _lock:
+        voce = _cache.get(chiave)
+        if voce is not None and voce[0] == firma:
+            return voce[1]
+    piano = _compila(config, engine, all_db_tables)
+    with _lock:
+        _cache[chiave] = (firma, piano)
+    return piano
+
+
+def invalida(engine=None):
+    """Svuota la cache dei piani (solo quelli del database indicato, se `engine` è passato)."""
+    with _lock:
+        for chiave in [k for k in _cache if engine is None or k[1] == str(engine.url)]:
+            del _cache[chiave]
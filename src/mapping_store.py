@@ -0,0 +1,125 @@
+"""
+Salvataggio della configurazione di mappatura (Step 6) in un unico documento versionato.
+
+Il documento `mapping_config.json` contiene le mappature delle colonne, le colonne data,
+la colonna del codice studio e le tabelle forzate 1-a-1 (le stesse chiavi dei template).
+Viene riscritto solo quando il contenuto cambia rispetto all'ultima versione salvata, e
+sempre in modo atomico (file temporaneo + rename), così un'interruzione durante la
+scrittura non lascia mai un file troncato.
+
+Le cartelle di mappatura create prima di questo documento usano quattro file separati
+(global_mapping.json, date_columns.json, studio_mapping.json, force_1to1_tables.json):
+finché il documento non esiste la lettura ricade su quelli.
+"""
+import copy
+import json
+import os
+import tempfile
+import threading
+
+from src.fingerprint import impronta_oggetto
+
+NOME_FILE = 'mapping_config.json'
+VERSIONE_DOCUMENTO = 1
+
+# File separati usati prima del documento unico: (nome file, chiave nel file, chiave nel documento, default)
+FILE_PRECEDENTI = [
+    ("global_mapping.json", None, "column_mappings", {}),
+    ("date_columns.json", "date_columns", "date_format_columns", []),
+    ("studio_mapping.json", "codice_studio_column", "studio_code_column", ""),
+    ("force_1to1_tables.json", "force_1to1_tables", "force_1to1_tables", []),
+]
+
+# Per ogni percorso: (stato del file, impronta del contenuto, contenuto)
+_cache = {}
+_lock = threading.Lock()
+
+
+def _stato_file(path):
+    try:
+        info = os.stat(path)
+        return info.st_mtime_ns, info.st_size
+    except OSError:
+        return None
+
+
+def _contenuto(dati):
+    return {chiave: copy.deepcopy(dati.get(chiave, default)) for _, _, chiave, default in FILE_PRECEDENTI}
+
+
+def _leggi_file_precedenti(mapping_dir):
+    dati = {}
+    for nome_file, chiave_file, chiave, default in FILE_PRECEDENTI:
+        path = os.path.join(mapping_dir, nome_file)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                valore = json.load(f)
+            dati[chiave] = valore if chiave_file is None else valore.get(chiave_file, default)
+    return _contenuto(dati)
+
+
+def esiste_configurazione(mapping_dir):
+    """True se la cartella contiene una mappatura salvata (documento unico o file precedenti)."""
+    return os.path.exists(os.path.join(mapping_dir, NOME_FILE)) or os.path.exists(os.path.join(mapping_dir, "global_mapping.json"))
+
+
+def _voce_aggiornata(path):
+    """Voce di cache del documento, riletta solo se il file è cambiato su disco (None se non esiste)."""
+    stato = _stato_file(path)
+    if stato is None:
+        return None
+    with _lock:
+        voce = _cache.get(path)
+    if voce is None or voce[0] != stato:
+        with open(path, 'r', encoding='utf-8') as f:
+            dati = _contenuto(json.load(f))
+        voce = (stato, impronta_oggetto(dati), dati)
+        with _lock:
+            _cache[path] = voce
+    return voce
+
+
+def leggi_configurazione(mapping_dir):
+    """
+    Restituisce la configurazione {column_mappings, date_format_columns, studio_code_column,
+    force_1to1_tables}. Il documento viene riletto solo se è cambiato su disco.
+    """
+    voce = _voce_aggiornata(os.path.join(mapping_dir, NOME_FILE))
+    if voce is None:
+        return _leggi_file_precedenti(mapping_dir)
+    return copy.deepcopy(voce[2])
+
+
+def _scrivi_json_atomico(path, documento):
+    cartella = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=cartella, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(documento, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def salva_configurazione(mapping_dir, dati):
+    """
+    Salva la configurazione se è diversa dall'ultima salvata. Restituisce True se il file è
+    stato scritto, False se il contenuto era invariato (in quel caso il disco non viene toccato
+    se non per controllare la data di modifica del documento).
+    """
+    path = os.path.join(mapping_dir, NOME_FILE)
+    contenuto = _contenuto(dati)
+    impronta = impronta_oggetto(contenuto)
+    voce = _voce_aggiornata(path)
+    if voce is not None and voce[1] == impronta:
+        return False
+
+    os.makedirs(mapping_dir, exist_ok=True)
+    _scrivi_json_atomico(path, {"versione": VERSIONE_DOCUMENTO, **contenuto})
+    with _lock:
+        _cache[path] = (_stato_file(path), impronta, contenuto)
+    return True
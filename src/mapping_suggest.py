@@ -0,0 +1,182 @@
+"""
+Suggerimenti automatici di mappatura sorgente → destinazione.
+
+Le colonne di destinazione (nome sanificato e descrizione leggibile) vengono indicizzate
+una volta sola in un indice invertito di token e trigrammi di caratteri, pesati TF-IDF.
+Per ogni colonna di appoggio si calcola la similarità coseno con le sole destinazioni che
+condividono almeno una caratteristica, quindi il costo non cresce con il prodotto
+sorgenti × destinazioni.
+
+Alla similarità testuale si aggiunge lo storico: le mappature salvate per altri studi
+della stessa modalità e i template. Se una colonna con lo stesso nome è già stata mappata
+altrove, quella destinazione viene proposta per prima. Lo storico viene letto dal disco una
+volta e resta in cache finché non si salva una configurazione o un template (`invalida_storico`).
+"""
+import heapq
+import json
+import math
+import os
+import threading
+from collections import Counter, defaultdict
+
+from src.column_names import sanitize_column_name
+from src.mapping_store import FILE_PRECEDENTI, NOME_FILE, leggi_configurazione
+
+MOTIVO_STORICO = "storico"
+MOTIVO_SOMIGLIANZA = "somiglianza"
+
+# Punteggio minimo di un suggerimento dallo storico (a cui si somma la quota di mappature concordi)
+PESO_BASE_STORICO = 0.6
+
+_cache_indici = {}
+_cache_storico = {}
+_lock = threading.Lock()
+
+
+def caratteristiche(testo):
+    """Token (parole del nome sanificato) e trigrammi di caratteri di ogni token, con le loro frequenze."""
+    conteggi = Counter()
+    for token in sanitize_column_name(testo).split('_'):
+        if not token:
+            continue
+        conteggi[f"t:{token}"] += 1
+        esteso = f"#{token}#"
+        for i in range(len(esteso) - 2):
+            conteggi[f"g:{esteso[i:i + 3]}"] += 1
+    return conteggi
+
+
+def _testo(nome, nome_leggibile):
+    leggibile = nome_leggibile(nome)
+    return nome if leggibile == nome else f"{nome} {leggibile}"
+
+
+def costruisci_indice(destinazioni, nome_leggibile=str):
+    """Indice invertito TF-IDF sulle colonne di destinazione (nome tecnico + descrizione leggibile)."""
+    destinazioni = list(destinazioni)
+    vettori = [caratteristiche(_testo(d, nome_leggibile)) for d in destinazioni]
+    frequenza_doc = Counter(f for v in vettori for f in v)
+    totale = len(destinazioni)
+    idf = {f: math.log((1 + totale) / (1 + n)) + 1 for f, n in frequenza_doc.items()}
+
+    invertito = defaultdict(list)
+    for indice, vettore in enumerate(vettori):
+        pesi = {f: tf * idf[f] for f, tf in vettore.items()}
+        norma = math.sqrt(sum(p * p for p in pesi.values())) or 1.0
+        for f, p in pesi.items():
+            invertito[f].append((indice, p / norma))
+    return {"destinazioni": destinazioni, "idf": idf, "invertito": dict(invertito)}
+
+
+def indice_destinazioni(destinazioni, nome_leggibile=str):
+    """Come `costruisci_indice`, ma in cache finché le destinazioni e le loro descrizioni non cambiano (cioè fino al prossimo import)."""
+    chiave = tuple((d, nome_leggibile(d)) for d in sorted(destinazioni))
+    with _lock:
+        indice = _cache_indici.get(chiave)
+    if indice is None:
+        indice = costruisci_indice(sorted(destinazioni), nome_leggibile)
+        with _lock:
+            _cache_indici.clear()
+            _cache_indici[chiave] = indice
+    return indice
+
+
+def simili(indice, testo, n=3):
+    """Le `n` destinazioni più simili al testo: [(destinazione, punteggio 0-1)]."""
+    vettore = caratteristiche(testo)
+    pesi = {f: tf * indice["idf"][f] for f, tf in vettore.items() if f in indice["idf"]}
+    norma = math.sqrt(sum(p * p for p in pesi.values()))
+    if not norma:
+        return []
+    punteggi = defaultdict(float)
+    for f, p in pesi.items():
+        for i, peso_dest in indice["invertito"][f]:
+            punteggi[i] += p * peso_dest
+    migliori = heapq.nlargest(n, punteggi.items(), key=lambda x: x[1])
+    return [(indice["destinazioni"][i], punteggio / norma) for i, punteggio in migliori]
+
+
+def _mappature_storiche(cartella_modalita, escludi):
+    """Elenca (percorso, mappatura) delle configurazioni salvate e dei template sotto la cartella della modalità."""
+    escludi = os.path.abspath(escludi) if escludi else None
+    for radice, cartelle, file in os.walk(cartella_modalita):
+        cartelle.sort()
+        if os.path.basename(radice) == 'templates':
+            for nome in sorted(file):
+                if nome.endswith('.json'):
+                    path = os.path.join(radice, nome)
+                    try:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            yield path, json.load(f).get("column_mappings", {})
+                    except (OSError, ValueError, AttributeError):
+                        continue
+        elif os.path.abspath(radice) != escludi and (NOME_FILE in file or FILE_PRECEDENTI[0][0] in file):
+            try:
+                yield radice, leggi_configurazione(radice)["column_mappings"]
+            except (OSError, ValueError):
+                continue
+
+
+def carica_storico(cartella_modalita, escludi=None):
+    """
+    Storico delle mappature della modalità: {colonna sorgente (senza tabella): Counter(destinazione)}.
+    `escludi` è la cartella di mappatura in uso, già caricata nello Step 6.
+    """
+    chiave = (os.path.abspath(cartella_modalita), os.path.abspath(escludi) if escludi else None)
+    with _lock:
+        if chiave in _cache_storico:
+            return _cache_storico[chiave]
+
+    storico = defaultdict(Counter)
+    for _, mappatura in _mappature_storiche(cartella_modalita, escludi):
+        for sorgente, destinazioni in mappatura.items():
+            if isinstance(destinazioni, str):
+                destinazioni = [destinazioni]
+            colonna = sorgente.split('.', 1)[-1]
+            for dest in destinazioni:
+                if dest:
+                    storico[colonna][dest] += 1
+    storico = dict(storico)
+    with _lock:
+        _cache_storico[chiave] = storico
+    return storico
+
+
+def invalida_storico():
+    """Svuota la cache dello storico: da chiamare dopo il salvataggio di una configurazione o di un template."""
+    with _lock:
+        _cache_storico.clear()
+
+
+def suggerisci(indice, sorgente, nome_leggibile=str, storico=None, n=3):
+    """
+    Suggerimenti per una sorgente 'tabella.colonna': [(destinazione, punteggio 0-1, motivo)],
+    ordinati per punteggio. Le destinazioni dallo storico devono esistere nell'indice.
+    """
+    colonna = sorgente.split('.', 1)[-1]
+    candidati = {}
+    for dest, punteggio in simili(indice, _testo(colonna, nome_leggibile), n):
+        candidati[dest] = (punteggio, MOTIVO_SOMIGLIANZA)
+
+    precedenti = (storico or {}).get(colonna)
+    if precedenti:
+        note = set(indice["destinazioni"])
+        totale = sum(precedenti.values())
+        for dest, volte in precedenti.items():
+            if dest in note:
+                punteggio = PESO_BASE_STORICO + (1 - PESO_BASE_STORICO) * volte / totale
+                if punteggio > candidati.get(dest, (0, None))[0]:
+                    candidati[dest] = (punteggio, MOTIVO_STORICO)
+
+    ordinati = sorted(candidati.items(), key=lambda x: (-x[1][0], x[0]))[:n]
+    return [(dest, punteggio, motivo) for dest, (punteggio, motivo) in ordinati]
+
+
+def suggerisci_tutte(indice, sorgenti, nome_leggibile=str, storico=None, soglia=0.0):
+    """Miglior suggerimento per ogni sorgente con punteggio almeno pari a `soglia`: {sorgente: (destinazione, punteggio, motivo)}."""
+    risultato = {}
+    for sorgente in sorgenti:
+        proposte = suggerisci(indice, sorgente, nome_leggibile, storico, n=1)
+        if proposte and proposte[0][1] >= soglia:
+            risultato[sorgente] = proposte[0]
+    return risultato
@@ -0,0 +1,97 @@
+"""
+Modifica massiva (Step 8) eseguita direttamente nel database.
+
+Le modifiche {colonna: nuovo valore} e le eventuali condizioni sulle righe vengono
+compilate in istruzioni UPDATE parametrizzate, una per tabella, eseguite tutte nella
+stessa transazione: la tabella non viene riletta né riscritta, e se una tabella fallisce
+nessuna modifica viene applicata.
+"""
+from sqlalchemy import text
+
+from src.db import escape_like, identificatore
+from src.fingerprint import elimina_impronte
+from src.schema_catalog import colonne_tabella
+
+OP_UGUALE = "uguale a"
+OP_DIVERSO = "diverso da"
+OP_CONTIENE = "contiene"
+OP_INIZIA = "inizia con"
+OP_VUOTO = "è vuoto"
+OP_NON_VUOTO = "non è vuoto"
+OPERATORI = [OP_UGUALE, OP_DIVERSO, OP_CONTIENE, OP_INIZIA, OP_VUOTO, OP_NON_VUOTO]
+# Operatori che non usano il valore della condizione
+OPERATORI_SENZA_VALORE = (OP_VUOTO, OP_NON_VUOTO)
+
+
+class ModificaError(Exception):
+    """Modifica non valida (colonna inesistente, operatore sconosciuto, nessuna modifica)."""
+
+
+def _condizione_sql(condizione, parametro):
+    colonna, operatore, valore = identificatore(condizione["col"]), condizione["op"], condizione.get("val", "")
+    if operatore == OP_UGUALE:
+        return f"{colonna} = :{parametro}", valore
+    if operatore == OP_DIVERSO:
+        # IS NOT considera diverse anche le righe con valore NULL
+        return f"{colonna} IS NOT :{parametro}", valore
+    if operatore == OP_CONTIENE:
+        return f"{colonna} LIKE :{parametro} ESCAPE '\\'", f"%{escape_like(valore)}%"
+    if operatore == OP_INIZIA:
+        return f"{colonna} LIKE :{parametro} ESCAPE '\\'", f"{escape_like(valore)}%"
+    if operatore == OP_VUOTO:
+        return f"({colonna} IS NULL OR TRIM({colonna}) = '')", None
+    if operatore == OP_NON_VUOTO:
+        return f"({colonna} IS NOT NULL AND TRIM({colonna}) <> '')", None
+    raise ModificaError(f"Operatore sconosciuto: {operatore}")
+
+
+def compila_update(tabella, colonne, modifiche, condizioni=()):
+    """
+    Compila l'UPDATE per una tabella. `modifiche` è una lista di {"col", "val"}, `condizioni`
+    una lista di {"col", "op", "val"} combinate in AND. Restituisce (sql, parametri).
+    """
+    if not modifiche:
+        raise ModificaError("Nessuna modifica da applicare.")
+    for voce in list(modifiche) + list(condizioni):
+        if voce["col"] not in colonne:
+            raise ModificaError(f"La colonna '{voce['col']}' non esiste nella tabella '{tabella}'.")
+
+    parametri, assegnazioni, filtri = {}, [], []
+    for i, modifica in enumerate(modifiche):
+        assegnazioni.append(f"{identificatore(modifica['col'])} = :v{i}")
+        parametri[f"v{i}"] = modifica.get("val", "")
+    for i, condizione in enumerate(condizioni):
+        sql, valore = _condizione_sql(condizione, f"c{i}")
+        filtri.append(sql)
+        if valore is not None:
+            parametri[f"c{i}"] = valore
+
+    sql = f"UPDATE {identificatore(tabella)} SET {', '.join(assegnazioni)}"
+    if filtri:
+        sql += " WHERE " + " AND ".join(filtri)
+    return sql, parametri
+
+
+def applica_modifiche(engine, tabelle, modifiche, condizioni=()):
+    """
+    Applica modifiche e condizioni a tutte le tabelle indicate in un'unica transazione.
+    Per ogni tabella si usano solo le modifiche sulle sue colonne; le tabelle senza nessuna delle
+    colonne modificate o senza una delle colonne delle condizioni vengono saltate.
+    Restituisce ({tabella: righe aggiornate}, [tabelle saltate]).
+    """
+    piani, saltate = [], []
+    for tabella in tabelle:
+        colonne = colonne_tabella(engine, tabella)
+        modifiche_tabella = [m for m in modifiche if m["col"] in colonne]
+        if not modifiche_tabella or any(c["col"] not in colonne for c in condizioni):
+            saltate.append(tabella)
+            continue
+        piani.append((tabella, *compila_update(tabella, colonne, modifiche_tabella, condizioni)))
+
+    aggiornate = {}
+    with engine.begin() as connection:
+        for tabella, sql, parametri in piani:
+            aggiornate[tabella] = connection.execute(text(sql), parametri).rowcount
+    # Le tabelle modificate non corrispondono più ai loro input: il prossimo popolamento le ricalcolerà
+    elimina_impronte(engine, [t for t, righe in aggiornate.items() if righe])
+    return aggiornate, saltate
@@ -0,0 +1,75 @@
+"""
+Cache dei file Excel già letti, indicizzata per contenuto del file e parametri di import.
+
+Per ogni file viene salvato un sidecar JSON con i metadati (intestazioni, nomi leggibili,
+commenti) e, se il file contiene dati, un file Parquet con il DataFrame già sanificato.
+Reimportare gli stessi file, anche per un altro studio, evita completamente la lettura Excel.
+"""
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+from src.fingerprint import impronta_file
+
+
+def chiave_cache(file_path, tipo, **parametri):
+    """Chiave della cache: hash del contenuto del file, del tipo di import e dei parametri (righe di intestazione)."""
+    return impronta_file(file_path, tipo=tipo, **parametri)
+
+
+def _percorsi(cache_dir, chiave):
+    return os.path.join(cache_dir, f"{chiave}.json"), os.path.join(cache_dir, f"{chiave}.parquet")
+
+
+def scrittura_atomica(path, scrivi):
+    """
+    Scrive su un file temporaneo e lo rinomina, così una lettura concorrente non vede mai file parziali.
+    `scrivi` riceve il percorso del file temporaneo. Il nome è univoco: due scritture contemporanee
+    dello stesso file (es. pipeline da riga di comando e job della pagina) non si intralciano.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    os.close(fd)
+    try:
+        scrivi(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def leggi_cache(cache_dir, chiave):
+    """Restituisce (metadati, DataFrame o None) se la chiave è in cache, altrimenti (None, None)."""
+    meta_path, parquet_path = _percorsi(cache_dir, chiave)
+    if not os.path.exists(meta_path):
+        return None, None
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            metadati = json.load(f)
+        df = None
+        if metadati.get("ha_dati"):
+            df = pd.read_parquet(parquet_path)
+        return metadati, df
+    except Exception:
+        # Cache corrotta o incompleta: verrà riscritta al prossimo import
+        return None, None
+
+
+def scrivi_cache(cache_dir, chiave, metadati, df=None):
+    """Salva metadati ed eventuale DataFrame. Gli errori (es. colonne duplicate) disattivano la cache solo per quel file."""
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path, parquet_path = _percorsi(cache_dir, chiave)
+    try:
+        if df is not None:
+            scrittura_atomica(parquet_path, lambda p: df.to_parquet(p, index=False))
+        metadati = {**metadati, "ha_dati": df is not None}
+
+        def _scrivi_json(p):
+            with open(p, 'w', encoding='utf-8') as f:
+                json.dump(metadati, f, ensure_ascii=False)
+        scrittura_atomica(meta_path, _scrivi_json)
+        return True
+    except Exception:
+        return False
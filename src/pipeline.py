@@ -0,0 +1,628 @@
+"""
+Pipeline di migrazione eseguibile senza Streamlit.
+
+Contiene la logica degli step del wizard (import struttura, import appoggio,
+popolamento ed export) in forma di funzioni riutilizzabili. La pagina
+`pages/1_Wizard_Dati.py` le richiama passando un logger che scrive su Streamlit,
+mentre da riga di comando si può eseguire l'intero flusso in modo non presidiato:
+
+    python -m src.pipeline --mode dipendente --studio ABC --mapping-dir mapping/dipendente/ABC
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import openpyxl
+import pandas as pd
+from sqlalchemy import text
+
+from src.bulk_writer import scrivi_tabella
+from src.column_encoding import elimina_codifiche
+from src.column_names import sanitize_column_name
+from src.db import crea_engine, elimina_database, get_engine, identificatore
+from src.export_bundle import crea_zip, percorso_zip
+from src.join_planner import allinea, tabella_principale, valori_allineati
+from src import mapping_plan, schema_catalog, storage
+from src.mapping_plan import STRATEGIA_UNPIVOT, compila_piano
+from src.mapping_store import esiste_configurazione
+from src.fingerprint import VERSIONE_LOGICA, elimina_impronte, impronta_oggetto, leggi_impronte, salva_impronta
+from src.parse_cache import chiave_cache, leggi_cache, scrivi_cache
+from src.schema_catalog import colonne_tabella, elenca_tabelle
+from src.table_preview import conta_righe
+from src.unpivot import crea_righe_multiple
+from src.xlsx_comments import leggi_commenti_riga
+from src.xlsx_export import scrivi_export_xlsx, trova_colonne_vuote
+
+# Percorsi cartelle
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Nome del database di una modalità quando non è selezionato un codice studio
+NOME_DB_COMUNE = 'comune'
+
+# Fasi della pipeline nell'ordine di esecuzione
+FASI = ['import_struttura', 'import_appoggio', 'popola', 'export']
+
+
+class PipelineError(Exception):
+    """Errore bloccante di uno step della pipeline (configurazione mancante, pulizia fallita, ...)."""
+
+
+def log_console(livello, messaggio):
+    """Logger di default: stampa su stdout. `livello` segue i nomi delle funzioni Streamlit (info, success, ...)."""
+    if livello == 'dataframe':
+        print(messaggio)
+    else:
+        print(f"[{livello.upper()}] {messaggio}")
+
+
+def get_config(mode, codice_studio=None, base_dir=BASE_DIR, mapping_dir=None):
+    """
+    Genera la configurazione dei percorsi per una modalità ('ditta'/'dipendente').
+    Se un codice studio è indicato, appoggio, mapping ed export diventano specifici per quel cliente.
+    Ogni modalità/studio ha anche un proprio database: db/<modalità>/<studio>.sqlite.
+    `mapping_dir` permette di puntare esplicitamente a una cartella di mappatura salvata.
+    """
+    mode = mode.lower()
+    mode_data_dir = os.path.join(base_dir, 'data', mode)
+    mode_mapping_dir = os.path.join(base_dir, 'mapping', mode)
+    mode_export_dir = os.path.join(base_dir, 'export', mode)
+    mode_db_dir = os.path.join(base_dir, 'db', mode)
+
+    if codice_studio:
+        appoggio_dir = os.path.join(mode_data_dir, codice_studio, 'appoggio')
+        studio_mapping_dir = os.path.join(mode_mapping_dir, codice_studio)
+        export_dir = os.path.join(mode_export_dir, codice_studio)
+    else:
+        appoggio_dir = os.path.join(mode_data_dir, 'appoggio')
+        studio_mapping_dir = mode_mapping_dir
+        export_dir = mode_export_dir
+
+    config = {
+        "mode": mode,
+        # La struttura è SEMPRE condivisa
+        "struttura_dir": os.path.join(mode_data_dir, 'struttura'),
+        "appoggio_dir": appoggio_dir,
+        "mapping_dir": mapping_dir or studio_mapping_dir,
+        # Cartella radice della mappatura (es. relazioni.json salvato da src/importer.py)
+        "mapping_root_dir": os.path.join(base_dir, 'mapping'),
+        "export_dir": export_dir,
+        "db_dir": mode_db_dir,
+        "db_path": os.path.join(mode_db_dir, f"{codice_studio or NOME_DB_COMUNE}.sqlite"),
+        # Backend dei dati di appoggio, scelto per installazione (vedi src/storage.py)
+        "storage": storage.backend_predefinito(),
+        # Job in background di tutte le modalità e studi (vedi src/jobs.py)
+        "jobs_db_path": os.path.join(base_dir, 'db', 'jobs.sqlite'),
+        # Cache dei file Excel già letti, condivisa tra modalità e studi (vedi src/parse_cache.py)
+        "cache_dir": os.path.join(base_dir, 'cache', 'xlsx'),
+        "db_struttura_prefix": f"struttura_{mode}_",
+        "db_appoggio_suffix": f"_appoggio_{mode}"
+    }
+
+    # Crea tutte le cartelle necessarie per evitare errori
+    for key, path in config.items():
+        if key.endswith("_dir"):
+            os.makedirs(path, exist_ok=True)
+
+    return config
+
+
+def elenca_file_xlsx(directory):
+    """Restituisce i file .xlsx presenti in una cartella (lista vuota se la cartella non esiste)."""
+    try:
+        return [f for f in os.listdir(directory) if f.endswith('.xlsx')]
+    except FileNotFoundError:
+        return []
+
+
+def _elimina_tabelle(engine, tabelle):
+    """Cancella le tabelle indicate in un'unica transazione."""
+    with engine.connect() as connection:
+        with connection.begin() as transaction:
+            for table_name in tabelle:
+                connection.exec_driver_sql(f'DROP TABLE IF EXISTS {identificatore(table_name)}')
+            transaction.commit()
+
+
+def svuota_database(config):
+    """
+    Cancella il database della modalità/studio (il file, non tabella per tabella) e svuota
+    le cache che si riferiscono a esso. Il database viene ricreato vuoto al prossimo accesso.
+    """
+    engine = elimina_database(config["db_path"])
+    storage.elimina_archivio(config["db_path"])
+    # Senza engine aperto in questo processo le cache vengono svuotate per intero
+    schema_catalog.invalida(engine)
+    mapping_plan.invalida(engine)
+
+
+def _pulisci_tabelle(engine, tabelle, descrizione, log):
+    """Rimuove le tabelle di un tipo (struttura/appoggio) prima di un nuovo import."""
+    try:
+        log('write', f"Pulizia delle vecchie tabelle di {descrizione}...")
+        if tabelle:
+            _elimina_tabelle(engine, tabelle)
+            elimina_impronte(engine, tabelle)
+            elimina_codifiche(engine, tabelle)
+            log('info', f"Rimosse {len(tabelle)} vecchie tabelle di {descrizione}.")
+        else:
+            log('info', f"Nessuna vecchia tabella di {descrizione} da rimuovere.")
+    except Exception as e:
+        raise PipelineError(f"Errore durante la pulizia delle vecchie tabelle di {descrizione}: {e}") from e
+
+
+def _leggi_intestazioni_struttura(file_path, numeric_header_row, desc_header_row):
+    """Legge le righe di intestazione numeriche e descrittive di un file struttura."""
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    sheet = workbook.active
+    numeric_values = [cell.value for cell in sheet[numeric_header_row]]
+    descriptive_values = [cell.value for cell in sheet[desc_header_row]]
+    workbook.close()
+    if descriptive_values and str(descriptive_values[0]).strip().lower() == 'non modificare questa riga':
+        numeric_values.pop(0); descriptive_values.pop(0)
+
+    header_map = {}; final_headers = []; pretty_name_map = {}
+    for desc, num in zip(descriptive_values, numeric_values):
+        if desc and str(desc).strip():
+            original_desc = ' '.join(str(desc).strip().split())
+            clean_desc = sanitize_column_name(original_desc)
+            final_headers.append(clean_desc)
+            header_map[clean_desc] = num
+            pretty_name_map[clean_desc] = original_desc
+    return {"final_headers": final_headers, "header_map": header_map, "pretty_name_map": pretty_name_map}
+
+
+def importa_struttura(config, engine, file_names=None, numeric_header_row=2, desc_header_row=3, log=log_console, progresso=None):
+    """
+    Step 3: importa i file struttura come tabelle vuote e salva le mappe di intestazioni e nomi leggibili.
+    `progresso(completati, totale, file)` viene chiamata prima della pulizia e prima di ogni file.
+    """
+    if file_names is None:
+        file_names = elenca_file_xlsx(config["struttura_dir"])
+
+    all_db_tables = elenca_tabelle(engine)
+    # Prima della pulizia, così un annullamento arrivato nel frattempo non svuota le tabelle
+    if progresso:
+        progresso(0, len(file_names), None)
+    _pulisci_tabelle(engine, [t for t in all_db_tables if t.startswith(config["db_struttura_prefix"])], 'struttura', log)
+
+    imported = []
+    for indice, file_name in enumerate(file_names):
+        if progresso:
+            progresso(indice, len(file_names), file_name)
+        try:
+            file_path = os.path.join(config["struttura_dir"], file_name)
+            chiave = chiave_cache(file_path, 'struttura', numeric_header_row=numeric_header_row, desc_header_row=desc_header_row)
+            metadati, _ = leggi_cache(config["cache_dir"], chiave)
+            if metadati is None:
+                metadati = _leggi_intestazioni_struttura(file_path, numeric_header_row, desc_header_row)
+                scrivi_cache(config["cache_dir"], chiave, metadati)
+            else:
+                log('info', f"`{file_name}` già letto in precedenza: intestazioni recuperate dalla cache.")
+            final_headers, header_map, pretty_name_map = metadati["final_headers"], metadati["header_map"], metadati["pretty_name_map"]
+
+            df_structure = pd.DataFrame(columns=final_headers)
+            table_name = f'{config["db_struttura_prefix"]}{os.path.splitext(file_name)[0]}'
+            # Nota: le tabelle di struttura sono già state cancellate, quindi non serve la tabella di staging
+            scrivi_tabella(engine, table_name, df_structure, staging=False)
+            log('success', f"Struttura '{table_name}' importata con successo.")
+
+            # Salva le mappe dei nomi per l'export e la UI
+            pretty_name_map_path = os.path.join(config["mapping_dir"], f"{table_name}_prettynames.json")
+            with open(pretty_name_map_path, 'w', encoding='utf-8') as f: json.dump(pretty_name_map, f, indent=4)
+
+            # Salva la mappa per le intestazioni numeriche usata dall'export
+            header_map_path = os.path.join(config["mapping_dir"], f"{table_name}_headers.json")
+            with open(header_map_path, 'w', encoding='utf-8') as f: json.dump(header_map, f, indent=4)
+            imported.append(table_name)
+
+        except Exception as e:
+            log('error', f"Errore importando {file_name}: {e}")
+    return imported
+
+
+def _leggi_appoggio(file_path, header_row):
+    """Legge un file di appoggio: restituisce il DataFrame con colonne sanificate e i metadati (commenti, nomi leggibili)."""
+    # Estrazione commenti: legge solo la parte XML dei commenti e la riga di intestazione
+    comments_map = {}
+    for header_value, raw_text in leggi_commenti_riga(file_path, header_row):
+        sanitized_header = sanitize_column_name(header_value)
+        colon_position = raw_text.find(':')
+        comment_text = raw_text[colon_position + 1:].strip() if colon_position != -1 else raw_text.strip()
+        comments_map[sanitized_header] = comment_text
+
+    # Unica lettura completa dei dati
+    df = pd.read_excel(file_path, header=header_row - 1, dtype=str).fillna('')
+    pretty_name_map = {sanitize_column_name(col): str(col).strip() for col in df.columns}
+    df.columns = [sanitize_column_name(col) for col in df.columns]
+    return df, {"comments_map": comments_map, "pretty_name_map": pretty_name_map}
+
+
+def importa_appoggio(config, engine, file_names=None, header_row=1, log=log_console, progresso=None):
+    """
+    Step 5: importa i file di appoggio con colonne sanificate e ne estrae i commenti delle intestazioni.
+    `progresso(completati, totale, file)` viene chiamata prima della pulizia e prima di ogni file.
+    """
+    if file_names is None:
+        file_names = elenca_file_xlsx(config["appoggio_dir"])
+
+    all_db_tables = elenca_tabelle(engine)
+    # Prima della pulizia, così un annullamento arrivato nel frattempo non svuota le tabelle
+    if progresso:
+        progresso(0, len(file_names), None)
+    vecchie_tabelle = [t for t in all_db_tables if t.endswith(config["db_appoggio_suffix"])]
+    _pulisci_tabelle(engine, vecchie_tabelle, 'appoggio', log)
+    storage.elimina(engine, vecchie_tabelle)
+
+    imported = []
+    for indice, file_name in enumerate(file_names):
+        if progresso:
+            progresso(indice, len(file_names), file_name)
+        try:
+            file_path = os.path.join(config["appoggio_dir"], file_name)
+            chiave = chiave_cache(file_path, 'appoggio', header_row=header_row)
+            metadati, df = leggi_cache(config["cache_dir"], chiave)
+            if metadati is None:
+                df, metadati = _leggi_appoggio(file_path, header_row)
+                scrivi_cache(config["cache_dir"], chiave, metadati, df)
+            else:
+                log('info', f"`{file_name}` già letto in precedenza: dati recuperati dalla cache.")
+            comments_map, pretty_name_map = metadati["comments_map"], metadati["pretty_name_map"]
+
+            comments_path = os.path.join(config["mapping_dir"], "appoggio_comments.json")
+            with open(comments_path, 'w', encoding='utf-8') as f:
+                json.dump(comments_map, f, indent=4)
+            if comments_map:
+                log('success', f"Trovati e salvati {len(comments_map)} commenti da `{file_name}`.")
+
+            table_name = f'{os.path.splitext(file_name)[0]}{config["db_appoggio_suffix"]}'
+            storage.scrivi(engine, table_name, df, config["storage"])
+            salva_impronta(engine, table_name, chiave)
+            log('success', f"Dati '{table_name}' importati con colonne sanificate.")
+
+            pretty_name_map_path = os.path.join(config["mapping_dir"], f"{table_name}_prettynames.json")
+            with open(pretty_name_map_path, 'w', encoding='utf-8') as f: json.dump(pretty_name_map, f, indent=4)
+            imported.append(table_name)
+
+        except Exception as e:
+            log('error', f"Errore importando {file_name}: {e}")
+    return imported
+
+
+def popola_dati(config, engine, codice_studio='', log=log_console, forza=False, progresso=None):
+    """
+    Step 7: applica la mappatura globale e popola le tabelle di struttura.
+    Ogni tabella ha un'impronta dei suoi input (porzione di mappatura, chiavi unpivot,
+    forzatura 1-a-1, codice studio e contenuto delle tabelle di appoggio lette): le tabelle
+    con impronta invariata non vengono ricalcolate, salvo `forza=True`.
+    `progresso(completate, totale, tabella)` viene chiamata prima di ogni tabella di struttura.
+    Restituisce {tabella_struttura: numero_righe} per le tabelle ripopolate.
+    """
+    # 1. Piano di esecuzione compilato dalla configurazione salvata (vedi src/mapping_plan.py)
+    if not esiste_configurazione(config["mapping_dir"]):
+        raise PipelineError("Mappatura non trovata: salvarla allo Step 6 ('mapping_config.json' o 'global_mapping.json').")
+    piano = compila_piano(config, engine)
+
+    studio_target_col = piano["colonna_studio"]
+    codice_studio_value = (codice_studio or '').upper()
+    relazioni = piano["relazioni"]
+
+    all_appoggio_tables_in_db = piano["appoggio"]
+    struttura_tables = list(piano["tabelle"])
+    if not (all_appoggio_tables_in_db and struttura_tables):
+        log('warning', "Nessun dato di appoggio o tabella di struttura trovati.")
+        return {}
+
+    # Colonne di appoggio usate dalla mappatura o come chiavi delle relazioni: le sole da leggere
+    colonne_usate = {}
+    for piano_tabella in piano["tabelle"].values():
+        for sources in piano_tabella["mappatura"].values():
+            for source_full_path in sources:
+                source_table, source_col = source_full_path.split('.', 1)
+                colonne_usate.setdefault(source_table, set()).add(source_col)
+    for colonna, tabelle_relazione in relazioni:
+        for tbl in tabelle_relazione:
+            colonne_usate.setdefault(tbl, set()).add(colonna)
+
+    # Le tabelle di appoggio vengono lette solo se servono a una tabella da ricalcolare,
+    # con le colonne codificate come Categorical (vedi src/storage.py)
+    appoggio_dfs = {}
+    def _appoggio(tbl):
+        if tbl not in appoggio_dfs:
+            colonne = [c for c in colonne_tabella(engine, tbl) if c in colonne_usate.get(tbl, ())]
+            appoggio_dfs[tbl] = storage.leggi(engine, tbl, colonne)
+        return appoggio_dfs[tbl]
+
+    # Indici delle chiavi e posizioni dei join, calcolati una sola volta per tutto il popolamento
+    cache_join = {}
+    def _join(sorgenti):
+        """(principale, {tabella: posizioni}) per collegare le tabelle delle sorgenti, o None se non collegabili."""
+        principale = tabella_principale(sorgenti)
+        tabelle = {s.split('.', 1)[0] for s in sorgenti}
+        posizioni = allinea(principale, tabelle, relazioni, _appoggio, cache_join, log) if relazioni else None
+        if posizioni is not None:
+            log('info', f"Join per chiave: righe guidate da `{principale}`, collegate {', '.join(sorted(tabelle - {principale}))}.")
+        return posizioni
+
+    impronte_salvate = leggi_impronte(engine)
+    impronte_appoggio = {}
+    for tbl in all_appoggio_tables_in_db:
+        if tbl not in impronte_salvate:
+            impronte_salvate[tbl] = storage.impronta(engine, tbl)
+            salva_impronta(engine, tbl, impronte_salvate[tbl])
+        impronte_appoggio[tbl] = impronte_salvate[tbl]
+
+    # 2. Ciclo di Esecuzione per ogni tabella struttura
+    risultati = {}
+    for indice, struttura_table in enumerate(struttura_tables):
+        if progresso:
+            progresso(indice, len(struttura_tables), struttura_table)
+        log('write', f"--- Elaborazione per `{struttura_table}` ---")
+
+        piano_tabella = piano["tabelle"][struttura_table]
+        dest_cols_for_this_table = piano_tabella["colonne"]
+        table_specific_dest_map = piano_tabella["mappatura"]
+        is_unpivot = piano_tabella["strategia"] == STRATEGIA_UNPIVOT
+
+        # La mappatura semplice allinea le righe sulla tabella di appoggio più lunga: dipende da tutte
+        if is_unpivot:
+            tabelle_lette = piano_tabella["sorgenti"]
+        else:
+            tabelle_lette = sorted(all_appoggio_tables_in_db)
+        impronta = impronta_oggetto({
+            "versione": VERSIONE_LOGICA,
+            "colonne": dest_cols_for_this_table,
+            "mappatura": table_specific_dest_map,
+            "unpivot": is_unpivot,
+            "chiavi_unpivot": piano_tabella["chiavi"],
+            "studio": [studio_target_col, codice_studio_value],
+            "relazioni": relazioni,
+            "appoggio": {tbl: impronte_appoggio.get(tbl) for tbl in tabelle_lette},
+        })
+        if not forza and impronte_salvate.get(struttura_table) == impronta:
+            log('info', f"Input invariati per `{struttura_table}`: tabella non ricalcolata.")
+            continue
+
+        df_popolato = pd.DataFrame()
+
+        # --- LOGICA IBRIDA ---
+        if is_unpivot:
+            log('info', f"Logica Rilevata: Trasformazione Wide-to-Long (Unpivot) per `{struttura_table}`")
+
+            one_to_one_map = {dest: sources[0] for dest, sources in table_specific_dest_map.items() if len(sources) == 1}
+            unpivot_map = {dest: sources for dest, sources in table_specific_dest_map.items() if len(sources) > 1}
+
+            all_source_tables = piano_tabella["sorgenti"]
+            if not all_source_tables: continue
+
+            sorgenti = [s for sources_list in table_specific_dest_map.values() for s in sources_list if s.split('.', 1)[0] in impronte_appoggio]
+            posizioni = _join(sorgenti) if len({s.split('.', 1)[0] for s in sorgenti}) > 1 else None
+
+            if posizioni is not None:
+                # Più tabelle collegate da relazioni: una tabella unica con colonne 'tabella.colonna'
+                colonne_unite = {}
+                for source_full_path in sorgenti:
+                    source_table, source_col = source_full_path.split('.', 1)
+                    if source_col in _appoggio(source_table).columns:
+                        colonne_unite[source_full_path] = valori_allineati(_appoggio(source_table), source_col, posizioni[source_table])
+                df_appoggio_current = pd.DataFrame(colonne_unite)
+                clean_one_to_one = dict(one_to_one_map)
+                clean_unpivot = {dest: list(src_list) for dest, src_list in unpivot_map.items()}
+            else:
+                if len(all_source_tables) > 1:
+                    log('warning', f"La trasformazione per `{struttura_table}` usa dati da più tabelle sorgente senza una relazione che le colleghi (relazioni.json). Si usa una sola tabella, il che potrebbe portare a risultati inattesi.")
+                source_table_name = list(all_source_tables)[0]
+                df_appoggio_current = _appoggio(source_table_name)
+
+                clean_one_to_one = {dest: src.split('.')[-1] for dest, src in one_to_one_map.items()}
+                clean_unpivot = {dest: [s.split('.')[-1] for s in src_list] for dest, src_list in unpivot_map.items()}
+
+            user_defined_keys = piano_tabella["chiavi"]
+            key_cols_map = {k: v for k, v in clean_one_to_one.items() if k in user_defined_keys} if user_defined_keys else clean_one_to_one
+            context_cols_map = {k: v for k, v in clean_one_to_one.items() if k not in user_defined_keys} if user_defined_keys else {}
+
+            df_popolato = crea_righe_multiple(df_appoggio_current, key_cols_map, context_cols_map, clean_unpivot)
+
+        else: # Mappatura Semplice
+            log('info', f"Logica Rilevata: Mappatura Semplice (1-a-1) per `{struttura_table}`")
+
+            sorgenti = [sources[0] for sources in table_specific_dest_map.values() if len(sources) == 1 and sources[0].split('.', 1)[0] in impronte_appoggio]
+            posizioni = _join(sorgenti) if len({s.split('.', 1)[0] for s in sorgenti}) > 1 else None
+
+            if posizioni is not None:
+                # Una riga per entità della tabella principale, le altre collegate per chiave
+                df_popolato = pd.DataFrame(index=pd.RangeIndex(len(next(iter(posizioni.values())))), columns=dest_cols_for_this_table)
+            else:
+                # Senza relazioni le tabelle vengono allineate per posizione di riga
+                max_len = max(storage.conta_righe(engine, tbl) for tbl in all_appoggio_tables_in_db)
+                df_popolato = pd.DataFrame(index=pd.RangeIndex(max_len), columns=dest_cols_for_this_table)
+
+            for dest_col in dest_cols_for_this_table:
+                sources = table_specific_dest_map.get(dest_col, [])
+                if len(sources) == 1:
+                    source_full_path = sources[0]
+                    source_table, source_col = source_full_path.split('.', 1)
+
+                    if source_table in impronte_appoggio and source_col in _appoggio(source_table).columns:
+                        if posizioni is not None:
+                            df_popolato[dest_col] = valori_allineati(_appoggio(source_table), source_col, posizioni[source_table])
+                        else:
+                            df_popolato[dest_col] = _appoggio(source_table)[source_col].astype(object)
+
+        # --- APPLICAZIONE CODICE STUDIO E SALVATAGGIO ---
+        if studio_target_col and codice_studio_value and studio_target_col in df_popolato.columns:
+            df_popolato[studio_target_col] = codice_studio_value
+
+        if not df_popolato.empty:
+            df_popolato = df_popolato.reindex(columns=dest_cols_for_this_table).fillna('')
+            scrivi_tabella(engine, struttura_table, df_popolato)
+            salva_impronta(engine, struttura_table, impronta)
+            log('success', f"Tabella `{struttura_table}` popolata con successo con {len(df_popolato)} righe.")
+            log('dataframe', df_popolato.head())
+            risultati[struttura_table] = len(df_popolato)
+        else:
+            log('warning', f"Nessun dato generato per `{struttura_table}`.")
+    return risultati
+
+
+def _esporta_tabella(engine, task):
+    """
+    Esporta una singola tabella di struttura. Restituisce il percorso del file e i
+    messaggi di log come lista [(livello, messaggio)], così da poter essere usata
+    anche nei processi worker.
+    """
+    messaggi = []
+    struttura_table, base_name = task["table"], task["base_name"]
+    dest_cols = colonne_tabella(engine, struttura_table)
+    if task["remove_empty_cols"]:
+        if conta_righe(engine, struttura_table) > 0:
+            cols_to_drop = trova_colonne_vuote(engine, struttura_table, dest_cols)
+            if cols_to_drop:
+                dest_cols = [col for col in dest_cols if col not in cols_to_drop]
+                messaggi.append(('info', f"In '{base_name}', rimosse {len(cols_to_drop)} colonne completamente vuote."))
+        else:
+            messaggi.append(('warning', f"La tabella '{base_name}' è vuota, l'export per questo file sarà vuoto."))
+
+    scrivi_export_xlsx(engine, struttura_table, task["export_file_path"], base_name, task["header_map"], dest_cols, task["colonne_data"])
+    messaggi.append(('success', f"File '{os.path.basename(task['export_file_path'])}' salvato in: `{task['export_file_path']}`"))
+    return task["export_file_path"], messaggi
+
+
+def _esporta_tabella_worker(db_path, task):
+    """Punto di ingresso dei processi worker: apre un engine proprio sul database indicato."""
+    engine = crea_engine(db_path)
+    try:
+        return _esporta_tabella(engine, task)
+    finally:
+        engine.dispose()
+
+
+def esporta(config, engine, remove_empty_cols=True, log=log_console, workers=1, progresso=None):
+    """
+    Step 9: esporta ogni tabella di struttura in un file Excel con le tre righe di intestazione.
+    La scrittura avviene a blocchi (vedi src/xlsx_export.py). Con `workers` > 1 le tabelle
+    vengono esportate in parallelo su più processi; `progresso(completate, totale, tabella)`
+    viene chiamata al termine di ogni tabella. Con più file viene scritto anche l'archivio ZIP
+    (vedi src/export_bundle.py). Restituisce i percorsi generati, nello stesso ordine
+    dell'esecuzione sequenziale.
+    """
+    piano = compila_piano(config, engine)
+    struttura_tables = list(piano["tabelle"])
+    if not struttura_tables:
+        log('warning', "Nessuna tabella dati da esportare trovata.")
+        return []
+
+    tasks = []
+    # Nessuna esclusione implicita per cognome/nome. Verranno rimosse se vuote.
+    for struttura_table in struttura_tables:
+        piano_tabella = piano["tabelle"][struttura_table]
+        base_name = piano_tabella["nome_export"]
+        if piano_tabella["intestazioni"] is None:
+            log('error', f"Mappa intestazioni per {struttura_table} non trovata."); continue
+        tasks.append({
+            "table": struttura_table,
+            "base_name": base_name,
+            "header_map": piano_tabella["intestazioni"],
+            "colonne_data": piano_tabella["colonne_data"],
+            "remove_empty_cols": remove_empty_cols,
+            "export_file_path": os.path.join(config["export_dir"], f"{base_name}_Export.xlsx"),
+        })
+
+    db_path = engine.url.database
+    generated_paths = [None] * len(tasks)
+
+    def _completata(indice, risultato):
+        path, messaggi = risultato
+        log('write', f"Elaborazione di `{tasks[indice]['base_name']}`...")
+        for livello, messaggio in messaggi:
+            log(livello, messaggio)
+        generated_paths[indice] = path
+        if progresso:
+            progresso(sum(p is not None for p in generated_paths), len(tasks), tasks[indice]["table"])
+
+    if workers > 1 and len(tasks) > 1 and db_path and db_path != ':memory:':
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            futures = {executor.submit(_esporta_tabella_worker, db_path, task): i for i, task in enumerate(tasks)}
+            try:
+                for future in as_completed(futures):
+                    _completata(futures[future], future.result())
+            except BaseException:
+                # Export interrotto (errore o annullamento da `progresso`): le tabelle non ancora avviate non vengono esportate
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+    else:
+        for i, task in enumerate(tasks):
+            _completata(i, _esporta_tabella(engine, task))
+
+    if len(generated_paths) > 1:
+        zip_path = percorso_zip(config["export_dir"], config["mode"])
+        if crea_zip(generated_paths, zip_path):
+            log('success', f"Archivio ZIP salvato in: `{zip_path}`")
+        else:
+            log('info', "File esportati invariati: riusato l'archivio ZIP esistente.")
+    return generated_paths
+
+
+def esegui_pipeline(config, engine, codice_studio='', fasi=FASI, numeric_header_row=2, desc_header_row=3,
+                    header_row=1, remove_empty_cols=True, workers=1, forza=False, log=log_console):
+    """Esegue in sequenza le fasi richieste e restituisce i tempi di esecuzione {fase: secondi}."""
+    tempi = {}
+    for fase in fasi:
+        inizio = time.perf_counter()
+        log('write', f"=== Fase '{fase}' ===")
+        if fase == 'import_struttura':
+            importa_struttura(config, engine, None, numeric_header_row, desc_header_row, log=log)
+        elif fase == 'import_appoggio':
+            importa_appoggio(config, engine, None, header_row, log=log)
+        elif fase == 'popola':
+            popola_dati(config, engine, codice_studio, log=log, forza=forza)
+        elif fase == 'export':
+            esporta(config, engine, remove_empty_cols, log=log, workers=workers)
+        else:
+            raise PipelineError(f"Fase sconosciuta: {fase}")
+        tempi[fase] = time.perf_counter() - inizio
+        log('info', f"Fase '{fase}' completata in {tempi[fase]:.2f}s")
+    return tempi
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Esegue la migrazione (import → popolamento → export) senza interfaccia.")
+    parser.add_argument('--mode', required=True, choices=['ditta', 'dipendente'], help="Tipo di anagrafica")
+    parser.add_argument('--studio', default='', help="Codice studio (3 caratteri)")
+    parser.add_argument('--mapping-dir', default=None, help="Cartella con la mappatura salvata (default: mapping/<mode>/<studio>)")
+    parser.add_argument('--db', default=None, help="Percorso del database SQLite (default: db/<mode>/<studio>.sqlite)")
+    parser.add_argument('--storage', default=None, choices=storage.BACKENDS, help="Backend dei dati di appoggio (default: variabile d'ambiente WIZARD_STORAGE, altrimenti sqlite)")
+    parser.add_argument('--base-dir', default=BASE_DIR, help="Cartella principale del progetto (data/, mapping/, export/)")
+    parser.add_argument('--fasi', default=','.join(FASI), help=f"Fasi da eseguire, separate da virgola ({','.join(FASI)})")
+    parser.add_argument('--numeric-header-row', type=int, default=2, help="Riga intestazioni NUMERICHE dei file struttura")
+    parser.add_argument('--desc-header-row', type=int, default=3, help="Riga intestazioni DESCRITTIVE dei file struttura")
+    parser.add_argument('--header-row', type=int, default=1, help="Riga intestazioni dei file di appoggio")
+    parser.add_argument('--keep-empty-cols', action='store_true', help="Non rimuovere le colonne vuote dall'export")
+    parser.add_argument('--forza', action='store_true', help="Ricalcola tutte le tabelle di struttura anche se i loro input non sono cambiati")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Processi paralleli per l'export")
+    args = parser.parse_args(argv)
+
+    codice_studio = args.studio.strip().upper()
+    config = get_config(args.mode, codice_studio or None, args.base_dir, args.mapping_dir)
+    if args.storage:
+        config["storage"] = args.storage
+    engine = get_engine(args.db or config["db_path"])
+    fasi = [f.strip() for f in args.fasi.split(',') if f.strip()]
+
+    try:
+        tempi = esegui_pipeline(config, engine, codice_studio, fasi, args.numeric_header_row, args.desc_header_row,
+                                args.header_row, not args.keep_empty_cols, args.workers, args.forza)
+    except PipelineError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 1
+
+    print("\nRiepilogo tempi:")
+    for fase, secondi in tempi.items():
+        print(f"- {fase}: {secondi:.2f}s")
+    print(f"- totale: {sum(tempi.values()):.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Catalogo dello schema del database (tabelle e colonne) con cache in memoria.
+
+Le colonne vengono lette dai metadati di SQLite (PRAGMA table_info) invece che
+caricando le tabelle, quindi il costo non dipende dal numero di righe. La cache è
+condivisa tra i rerun di Streamlit e viene invalidata automaticamente quando
+cambia `PRAGMA schema_version`, cioè ad ogni creazione, modifica o cancellazione
+di tabelle (anche se fatta da un altro processo).
+"""
+import threading
+
+from sqlalchemy import text
+
+from src.db import identificatore
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _stato(connection, chiave):
+    """Restituisce lo stato in cache per il database, azzerandolo se lo schema è cambiato."""
+    versione = connection.execute(text('PRAGMA schema_version')).scalar()
+    stato = _cache.get(chiave)
+    if stato is None or stato["versione"] != versione:
+        stato = {"versione": versione, "tabelle": None, "colonne": {}}
+        _cache[chiave] = stato
+    return stato
+
+
+def versione_schema(engine):
+    """Valore corrente di PRAGMA schema_version: cambia ad ogni modifica dello schema."""
+    with engine.connect() as connection:
+        return connection.execute(text('PRAGMA schema_version')).scalar()
+
+
+def elenca_tabelle(engine):
+    """Nomi delle tabelle del database, in ordine alfabetico."""
+    with _lock, engine.connect() as connection:
+        stato = _stato(connection, str(engine.url))
+        if stato["tabelle"] is None:
+            result = connection.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"))
+            stato["tabelle"] = [row[0] for row in result]
+        return list(stato["tabelle"])
+
+
+def colonne_tabella(engine, tabella):
+    """Nomi delle colonne di una tabella, nell'ordine di definizione (lista vuota se la tabella non esiste)."""
+    with _lock, engine.connect() as connection:
+        stato = _stato(connection, str(engine.url))
+        if tabella not in stato["colonne"]:
+            result = connection.exec_driver_sql(f'PRAGMA table_info({identificatore(tabella)})')
+            stato["colonne"][tabella] = [row[1] for row in result]
+        return list(stato["colonne"][tabella])
+
+
+def invalida(engine=None):
+    """Svuota la cache del catalogo (di un solo database se `engine` è indicato)."""
+    with _lock:
+        if engine is None:
+            _cache.clear()
+        else:
+            _cache.pop(str(engine.url), None)
@@ -0,0 +1,122 @@
+"""
+Archiviazione dei dati delle tabelle di appoggio: SQLite (predefinito) oppure Parquet.
+
+Il backend si sceglie per installazione con la variabile d'ambiente WIZARD_STORAGE
+(`sqlite` o `parquet`) o, da riga di comando, con `--storage`:
+
+- `sqlite`: le righe sono nel database dello studio, con le codifiche di src/column_encoding.py;
+- `parquet`: le righe sono in un file Parquet per tabella, nella cartella `<database>.parquet`
+  accanto al database dello studio. Nel database resta una tabella vuota con le stesse
+  colonne, così catalogo dello schema, mappatura e piano di esecuzione non cambiano.
+
+Il backend usato è registrato con le codifiche della tabella: la lettura non dipende dal
+backend configurato, quindi cambiarlo non rende illeggibili i dati già importati.
+In lettura si indicano le colonne che servono: SQLite esegue la SELECT solo di quelle,
+Parquet legge dal file (mappato in memoria) solo quelle colonne, già codificate a dizionario.
+
+Le tabelle di struttura restano in SQLite con entrambi i backend: lo Step 8 le modifica
+con UPDATE e le anteprime le filtrano e paginano in SQL.
+"""
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src import table_preview
+from src.bulk_writer import scrivi_tabella
+from src.column_encoding import leggi_codifiche, leggi_tabella, salva_codifiche, scrivi_tabella_codificata
+from src.fingerprint import impronta_file, impronta_tabella
+from src.parse_cache import scrittura_atomica
+
+BACKEND_SQLITE = 'sqlite'
+BACKEND_PARQUET = 'parquet'
+BACKENDS = [BACKEND_SQLITE, BACKEND_PARQUET]
+VARIABILE_BACKEND = 'WIZARD_STORAGE'
+
+# Codifica registrata per le colonne delle tabelle i cui dati sono in Parquet
+CODIFICA_PARQUET = 'parquet'
+
+
+def backend_predefinito():
+    """Backend scelto per l'installazione (variabile d'ambiente WIZARD_STORAGE, default sqlite)."""
+    backend = os.environ.get(VARIABILE_BACKEND, BACKEND_SQLITE).strip().lower() or BACKEND_SQLITE
+    if backend not in BACKENDS:
+        raise ValueError(f"{VARIABILE_BACKEND}={backend} non supportato: usare {' o '.join(BACKENDS)}.")
+    return backend
+
+
+def cartella_parquet(db_path):
+    """Cartella dei file Parquet associata a un database (db/<modalità>/<studio>.parquet)."""
+    return f"{os.path.splitext(db_path)[0]}.parquet"
+
+
+def _percorso(engine, tabella):
+    return os.path.join(cartella_parquet(engine.url.database), f"{tabella}.parquet")
+
+
+def _in_parquet(codifiche):
+    return any(codifica == CODIFICA_PARQUET for codifica, _ in codifiche.values())
+
+
+def scrivi(engine, tabella, df, backend=BACKEND_SQLITE):
+    """Sostituisce i dati della tabella (colonne di stringhe) con il backend indicato."""
+    if backend == BACKEND_SQLITE:
+        scrivi_tabella_codificata(engine, tabella, df)
+        return len(df)
+    if backend != BACKEND_PARQUET:
+        raise ValueError(f"Backend di archiviazione non supportato: {backend}")
+
+    percorso = _percorso(engine, tabella)
+    os.makedirs(os.path.dirname(percorso), exist_ok=True)
+    # Scrittura su file temporaneo e rinomina: chi legge vede il file precedente o quello nuovo
+    tabella_arrow = pa.Table.from_pandas(df, preserve_index=False)
+    scrittura_atomica(percorso, lambda tmp_path: pq.write_table(tabella_arrow, tmp_path))
+    codifiche = {colonna: (CODIFICA_PARQUET, None) for colonna in df.columns}
+    scrivi_tabella(engine, tabella, df.iloc[:0], prima_del_commit=lambda connessione: salva_codifiche(connessione, tabella, codifiche))
+    return len(df)
+
+
+def leggi(engine, tabella, colonne=None):
+    """
+    Dati della tabella come stringhe originali (colonne codificate come Categorical), solo per
+    le `colonne` indicate se non è None.
+    """
+    codifiche = leggi_codifiche(engine, tabella)
+    if not _in_parquet(codifiche):
+        return leggi_tabella(engine, tabella, colonne, codifiche)
+    percorso = _percorso(engine, tabella)
+    if colonne is not None and not colonne:
+        return pd.DataFrame(index=pd.RangeIndex(pq.read_metadata(percorso).num_rows))
+    nomi = list(colonne) if colonne is not None else pq.read_schema(percorso).names
+    tabella_arrow = pq.read_table(percorso, columns=nomi, memory_map=True, read_dictionary=nomi)
+    return tabella_arrow.to_pandas()
+
+
+def conta_righe(engine, tabella):
+    """Numero di righe della tabella (per Parquet dai metadati del file, senza leggere i dati)."""
+    if _in_parquet(leggi_codifiche(engine, tabella)):
+        return pq.read_metadata(_percorso(engine, tabella)).num_rows
+    return table_preview.conta_righe(engine, tabella)
+
+
+def impronta(engine, tabella):
+    """Hash del contenuto della tabella, usato quando non esiste un'impronta salvata all'import."""
+    if _in_parquet(leggi_codifiche(engine, tabella)):
+        return impronta_file(_percorso(engine, tabella))
+    return impronta_tabella(engine, tabella)
+
+
+def elimina(engine, tabelle):
+    """Cancella i file Parquet delle tabelle indicate (le tabelle nel database le elimina chi le gestisce)."""
+    for tabella in tabelle:
+        try:
+            os.remove(_percorso(engine, tabella))
+        except FileNotFoundError:
+            pass
+
+
+def elimina_archivio(db_path):
+    """Cancella la cartella Parquet di un database (insieme allo svuotamento del database)."""
+    shutil.rmtree(cartella_parquet(db_path), ignore_errors=True)
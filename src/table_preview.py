@@ -0,0 +1,59 @@
+"""
+Anteprima paginata delle tabelle del database.
+
+Filtro, ordinamento e paginazione sono eseguiti da SQLite (WHERE ... LIKE, ORDER BY,
+LIMIT/OFFSET): all'interfaccia arriva solo la pagina richiesta, e il numero di righe
+viene da una COUNT(*), quindi il costo di una pagina non dipende dalle dimensioni della
+tabella da trasferire.
+"""
+import pandas as pd
+from sqlalchemy import text
+
+from src.db import escape_like, identificatore
+from src.schema_catalog import colonne_tabella
+
+
+def _filtro_sql(colonne, filtro, colonna_filtro=None):
+    """Clausola WHERE (e parametri) per la ricerca testuale, senza distinzione di maiuscole, su una colonna o su tutte."""
+    filtro = (filtro or '').strip()
+    if not filtro:
+        return '', {}
+    valore = '%' + escape_like(filtro) + '%'
+    cercate = [colonna_filtro] if colonna_filtro else colonne
+    condizioni = [f"CAST({identificatore(c)} AS TEXT) LIKE :filtro ESCAPE '\\'" for c in cercate]
+    return ' WHERE ' + ' OR '.join(condizioni), {"filtro": valore}
+
+
+def conta_righe(engine, tabella, filtro='', colonna_filtro=None):
+    """Numero di righe della tabella che soddisfano il filtro (0 se la tabella non esiste)."""
+    colonne = colonne_tabella(engine, tabella)
+    if not colonne:
+        return 0
+    where, parametri = _filtro_sql(colonne, filtro, colonna_filtro)
+    with engine.connect() as connection:
+        return connection.execute(text(f"SELECT COUNT(*) FROM {identificatore(tabella)}{where}"), parametri).scalar()
+
+
+def leggi_pagina(engine, tabella, numero=0, dimensione=50, filtro='', colonna_filtro=None, ordina_per=None, discendente=False):
+    """
+    Restituisce (DataFrame della pagina, righe totali filtrate, numero di pagina corretto).
+    Le pagine partono da 0; senza ordinamento le righe seguono l'ordine di inserimento.
+    """
+    colonne = colonne_tabella(engine, tabella)
+    if not colonne:
+        return pd.DataFrame(), 0, 0
+    if colonna_filtro and colonna_filtro not in colonne:
+        raise ValueError(f"La colonna '{colonna_filtro}' non esiste nella tabella '{tabella}'.")
+    if ordina_per and ordina_per not in colonne:
+        raise ValueError(f"La colonna '{ordina_per}' non esiste nella tabella '{tabella}'.")
+
+    totale = conta_righe(engine, tabella, filtro, colonna_filtro)
+    pagine = max(1, (totale + dimensione - 1) // dimensione)
+    numero = min(max(0, numero), pagine - 1)
+
+    where, parametri = _filtro_sql(colonne, filtro, colonna_filtro)
+    ordine = f"{identificatore(ordina_per)} {'DESC' if discendente else 'ASC'}, rowid" if ordina_per else "rowid"
+    sql = f"SELECT * FROM {identificatore(tabella)}{where} ORDER BY {ordine} LIMIT :limite OFFSET :inizio"
+    with engine.connect() as connection:
+        df = pd.read_sql_query(text(sql), connection, params={**parametri, "limite": dimensione, "inizio": numero * dimensione})
+    return df, totale, numero
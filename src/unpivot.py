@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+# Modalità disponibili per la trasformazione wide-to-long
+MODALITA_VETTORIALE = 'vettoriale'
+MODALITA_LOOP = 'loop'
+
+
+def crea_righe_multiple(df: pd.DataFrame, key_cols_map: dict, context_cols_map: dict, unpivot_map: dict, modalita: str = MODALITA_VETTORIALE) -> pd.DataFrame:
+    """
+    Crea righe multiple con logica ibrida: la prima riga è completa, le successive sono sparse.
+    - key_cols_map: Colonne chiave da ripetere su OGNI riga. {dest: source}
+    - context_cols_map: Colonne di contesto da mostrare SOLO sulla prima riga. {dest: source}
+    - unpivot_map: Colonne da trasformare. {dest: [source_1, source_2, ...]}
+    - modalita: 'vettoriale' (default, lavora per colonne) oppure 'loop' (versione di riferimento riga per riga)
+    """
+    if modalita == MODALITA_VETTORIALE:
+        return _crea_righe_multiple_vettoriale(df, key_cols_map, context_cols_map, unpivot_map)
+    if modalita == MODALITA_LOOP:
+        return _crea_righe_multiple_loop(df, key_cols_map, context_cols_map, unpivot_map)
+    raise ValueError(f"Modalità di unpivot non supportata: {modalita}")
+
+
+def _crea_righe_multiple_loop(df, key_cols_map, context_cols_map, unpivot_map):
+    """Versione di riferimento: scorre ogni riga sorgente con iterrows."""
+    final_rows = []
+    num_groups = max(len(v) for v in unpivot_map.values()) if unpivot_map else 0
+    if num_groups == 0: return pd.DataFrame()
+
+    for _, source_row in df.iterrows():
+        is_first_row_for_this_company = True
+
+        # Prepara i dati chiave che si ripeteranno sempre
+        key_data = {dest_col: source_row.get(source_col) for dest_col, source_col in key_cols_map.items()}
+        # Prepara i dati di contesto che appariranno solo una volta
+        context_data = {dest_col: source_row.get(source_col) for dest_col, source_col in context_cols_map.items()}
+
+        for i in range(num_groups):
+            new_row_segment = {}
+            is_valid_row = False
+
+            for dest_col, source_cols_list in unpivot_map.items():
+                try:
+                    value = source_row.get(source_cols_list[i], '')
+                    new_row_segment[dest_col] = value
+                    if str(value).strip():
+                        is_valid_row = True
+                except IndexError:
+                    new_row_segment[dest_col] = ''
+
+            if is_valid_row:
+                if is_first_row_for_this_company:
+                    # Per la prima riga, unisci tutto: chiavi + contesto + dati trasformati
+                    full_row = {**key_data, **context_data, **new_row_segment}
+                    is_first_row_for_this_company = False
+                else:
+                    # Per le righe successive, unisci solo: chiavi + dati trasformati
+                    full_row = {**key_data, **new_row_segment}
+
+                final_rows.append(full_row)
+
+    return pd.DataFrame(final_rows)
+
+
+def _valori_colonna(df, source_col, default):
+    """Restituisce i valori di una colonna sorgente come array object, o un array costante se la colonna manca."""
+    if source_col in df.columns:
+        return df[source_col].to_numpy(dtype=object)
+    return np.full(len(df), default, dtype=object)
+
+
+def _crea_righe_multiple_vettoriale(df, key_cols_map, context_cols_map, unpivot_map):
+    """
+    Versione colonnare: per ogni gruppo costruisce la maschera delle righe valide con
+    operazioni vettoriali, poi concatena i gruppi e ripristina l'ordine (riga sorgente, gruppo).
+    """
+    num_groups = max(len(v) for v in unpivot_map.values()) if unpivot_map else 0
+    if num_groups == 0: return pd.DataFrame()
+
+    n = len(df)
+    vuoti = np.full(n, '', dtype=object)
+    posizioni_per_gruppo = []
+    valori_per_gruppo = {dest_col: [] for dest_col in unpivot_map}
+
+    for i in range(num_groups):
+        valori_gruppo = {}
+        is_valid = np.zeros(n, dtype=bool)
+        for dest_col, source_cols_list in unpivot_map.items():
+            if i < len(source_cols_list):
+                valori = _valori_colonna(df, source_cols_list[i], '')
+                # Stessa regola della versione loop: una riga è valida se str(valore).strip() non è vuoto
+                is_valid |= pd.Series(valori, dtype=object).astype(str).str.strip().ne('').to_numpy()
+            else:
+                valori = vuoti
+            valori_gruppo[dest_col] = valori
+
+        posizioni_valide = np.flatnonzero(is_valid)
+        posizioni_per_gruppo.append(posizioni_valide)
+        for dest_col, valori in valori_gruppo.items():
+            valori_per_gruppo[dest_col].append(valori[posizioni_valide])
+
+    posizioni = np.concatenate(posizioni_per_gruppo)
+    if len(posizioni) == 0: return pd.DataFrame()
+    gruppi = np.repeat(np.arange(num_groups), [len(p) for p in posizioni_per_gruppo])
+
+    # Ordine finale: prima per riga sorgente, poi per gruppo (come nel loop)
+    ordine = np.lexsort((gruppi, posizioni))
+    posizioni_ordinate = posizioni[ordine]
+    prima_riga = np.ones(len(posizioni_ordinate), dtype=bool)
+    prima_riga[1:] = posizioni_ordinate[1:] != posizioni_ordinate[:-1]
+
+    colonne = {}
+    for dest_col, source_col in key_cols_map.items():
+        colonne[dest_col] = _valori_colonna(df, source_col, None)[posizioni_ordinate]
+    for dest_col, source_col in context_cols_map.items():
+        valori = _valori_colonna(df, source_col, None)[posizioni_ordinate]
+        colonne[dest_col] = np.where(prima_riga, valori, np.nan)
+    for dest_col, blocchi in valori_per_gruppo.items():
+        colonne[dest_col] = np.concatenate(blocchi)[ordine]
+
+    return pd.DataFrame(colonne)
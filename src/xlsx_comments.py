@@ -0,0 +1,95 @@
+"""
+Lettura dei commenti di cella da un file .xlsx senza caricare l'intero workbook.
+
+Un .xlsx è un archivio zip: i commenti di un foglio stanno in una parte XML separata
+(xl/commentsN.xml) collegata al foglio tramite le relazioni. Qui si leggono solo
+workbook.xml, le relazioni e la parte dei commenti, mentre i valori della riga di
+intestazione vengono letti in streaming con openpyxl in modalità read-only.
+"""
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+
+import openpyxl
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL_DOC = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_REL_PKG = 'http://schemas.openxmlformats.org/package/2006/relationships'
+TIPO_COMMENTI = '/comments'
+
+
+def _risolvi_target(base_dir, target):
+    """Risolve il Target di una relazione (relativo alla cartella della parte, o assoluto)."""
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def _relazioni(archivio, parte):
+    """Restituisce le relazioni di una parte come {Id: (Type, percorso_risolto)}."""
+    cartella, nome = posixpath.split(parte)
+    rels_path = posixpath.join(cartella, '_rels', f'{nome}.rels')
+    if rels_path not in archivio.namelist():
+        return {}
+    root = ET.fromstring(archivio.read(rels_path))
+    return {
+        rel.get('Id'): (rel.get('Type', ''), _risolvi_target(cartella, rel.get('Target', '')))
+        for rel in root.iter(f'{{{NS_REL_PKG}}}Relationship')
+    }
+
+
+def _parte_foglio_attivo(archivio):
+    """Restituisce (titolo, percorso della parte XML) del foglio attivo del workbook."""
+    root = ET.fromstring(archivio.read('xl/workbook.xml'))
+    fogli = list(root.iter(f'{{{NS_MAIN}}}sheet'))
+    view = root.find(f'{{{NS_MAIN}}}bookViews/{{{NS_MAIN}}}workbookView')
+    indice_attivo = int(view.get('activeTab', 0)) if view is not None else 0
+    foglio = fogli[indice_attivo] if indice_attivo < len(fogli) else fogli[0]
+    _, parte = _relazioni(archivio, 'xl/workbook.xml')[foglio.get(f'{{{NS_REL_DOC}}}id')]
+    return foglio.get('name'), parte
+
+
+def _testo_commento(elemento_text):
+    """Ricompone il testo di un commento concatenando i run (<r><t>) o il testo semplice (<t>)."""
+    parti = []
+    for figlio in elemento_text:
+        if figlio.tag == f'{{{NS_MAIN}}}t':
+            parti.append(figlio.text or '')
+        elif figlio.tag == f'{{{NS_MAIN}}}r':
+            t = figlio.find(f'{{{NS_MAIN}}}t')
+            if t is not None:
+                parti.append(t.text or '')
+    return ''.join(parti)
+
+
+def leggi_commenti_riga(file_path, riga):
+    """
+    Restituisce [(valore_cella, testo_commento)] per le celle della riga indicata (1-based)
+    del foglio attivo che hanno sia un valore sia un commento, nell'ordine delle colonne.
+    """
+    with zipfile.ZipFile(file_path) as archivio:
+        titolo_foglio, parte_foglio = _parte_foglio_attivo(archivio)
+        commenti = {}
+        for tipo, parte in _relazioni(archivio, parte_foglio).values():
+            if tipo.endswith(TIPO_COMMENTI) and parte in archivio.namelist():
+                root = ET.fromstring(archivio.read(parte))
+                for commento in root.iter(f'{{{NS_MAIN}}}comment'):
+                    colonna, riga_commento = coordinate_from_string(commento.get('ref'))
+                    if riga_commento == riga:
+                        text = commento.find(f'{{{NS_MAIN}}}text')
+                        commenti[column_index_from_string(colonna)] = _testo_commento(text) if text is not None else ''
+    if not commenti:
+        return []
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        sheet = workbook[titolo_foglio]
+        valori = {}
+        for row in sheet.iter_rows(min_row=riga, max_row=riga):
+            for cell in row:
+                if getattr(cell, 'value', None) is not None:
+                    valori[cell.column] = cell.value
+    finally:
+        workbook.close()
+    return [(valori[col], commenti[col]) for col in sorted(commenti) if valori.get(col)]
@@ -0,0 +1,75 @@
+"""
+Scrittura degli export Excel a memoria costante.
+
+La tabella viene letta da SQLite a blocchi e ogni blocco viene scritto subito su disco
+tramite un workbook openpyxl in modalità write-only: la memoria occupata non dipende
+dal numero di righe della tabella.
+"""
+import openpyxl
+import pandas as pd
+
+from src.date_normalize import FormatiColonne
+from src.db import identificatore
+
+# Righe lette da SQLite per ogni blocco
+CHUNKSIZE = 20000
+INTESTAZIONE_FISSA = "Non modificare questa riga"
+# Colonne controllate per ogni query di trova_colonne_vuote (SQLite ammette al massimo 2000 colonne nel risultato)
+COLONNE_PER_QUERY = 500
+# Caratteri ignorati nel controllo delle colonne vuote: spazio, tab, a capo, ritorno, tab verticale, form feed, spazio non separabile
+SPAZI_SQL = "char(32, 9, 10, 13, 11, 12, 160)"
+
+
+def _leggi_a_blocchi(engine, table_name, colonne, chunksize):
+    """Legge le colonne indicate di una tabella a blocchi di `chunksize` righe."""
+    select_cols = ', '.join(identificatore(c) for c in colonne) if colonne else '*'
+    return pd.read_sql_query(f'SELECT {select_cols} FROM {identificatore(table_name)}', engine, chunksize=chunksize)
+
+
+def trova_colonne_vuote(engine, table_name, colonne, colonne_per_query=COLONNE_PER_QUERY):
+    """
+    Restituisce le colonne che in tutte le righe della tabella contengono solo stringhe vuote o di spazi.
+    Come nel controllo originale (valori convertiti con str), una cella NULL conta come valore
+    e la colonna viene mantenuta.
+    Il controllo è un'unica query di aggregazione per ogni gruppo di `colonne_per_query` colonne:
+    SQLite scorre la tabella una volta e al programma arriva una sola riga di 0/1.
+    """
+    colonne = list(colonne)
+    vuote = []
+    with engine.connect() as connection:
+        for inizio in range(0, len(colonne), colonne_per_query):
+            gruppo = colonne[inizio:inizio + colonne_per_query]
+            aggregati = ', '.join(f"MAX(COALESCE(TRIM({identificatore(c)}, {SPAZI_SQL}) <> '', 1))" for c in gruppo)
+            piene = connection.exec_driver_sql(f"SELECT {aggregati} FROM {identificatore(table_name)}").one()
+            vuote.extend(c for c, piena in zip(gruppo, piene) if not piena)
+    return vuote
+
+
+def scrivi_export_xlsx(engine, table_name, export_file_path, base_name, header_map, colonne, colonne_data=(), chunksize=CHUNKSIZE):
+    """
+    Scrive l'export di una tabella di struttura con le tre righe "Non modificare questa riga"
+    (nome tabella, intestazioni numeriche, intestazioni descrittive) seguite dai dati.
+    Le colonne in `colonne_data` vengono formattate come gg/mm/aaaa, con il formato di origine
+    riconosciuto una volta per colonna (vedi src/date_normalize.py).
+    """
+    wb_export = openpyxl.Workbook(write_only=True)
+    ws_export = wb_export.create_sheet("Sheet")
+
+    numeric_headers_row = [header_map.get(col, '') for col in colonne]
+    ws_export.append([INTESTAZIONE_FISSA, base_name.upper()])
+    ws_export.append([INTESTAZIONE_FISSA] + numeric_headers_row)
+    ws_export.append([INTESTAZIONE_FISSA] + list(colonne))
+
+    righe_scritte = 0
+    if colonne:
+        date_da_convertire = [col for col in colonne_data if col in colonne]
+        formati = FormatiColonne()
+        for chunk in _leggi_a_blocchi(engine, table_name, colonne, chunksize):
+            for col in date_da_convertire:
+                chunk[col] = formati.normalizza(col, chunk[col])
+            for row_data_tuple in chunk.itertuples(index=False, name=None):
+                ws_export.append([""] + list(row_data_tuple))
+            righe_scritte += len(chunk)
+
+    wb_export.save(export_file_path)
+    return righe_scritte